@@ -0,0 +1,11 @@
+#-*- coding: utf-8 -*-
+
+"""
+ (c) 2014 - Copyright Red Hat Inc
+
+ Authors:
+   Pierre-Yves Chibon <pingou@pingoured.fr>
+
+Benchmarks of spechub run against generated data, see benchmarks/run.py.
+
+"""
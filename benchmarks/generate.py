@@ -0,0 +1,225 @@
+#-*- coding: utf-8 -*-
+
+"""
+ (c) 2014 - Copyright Red Hat Inc
+
+ Authors:
+   Pierre-Yves Chibon <pingou@pingoured.fr>
+
+Generate synthetic package repositories, forks, pull-requests and comments
+to benchmark spechub against.
+
+The data only depends on the provided options and seed, two runs with the
+same options produce the same repositories, commits included.
+
+"""
+
+import os
+import random
+
+import pygit2
+
+
+# Start of the history of the generated repositories, 2014-01-01 UTC
+EPOCH = 1388534400
+
+DEFAULTS = {
+    'repos': 20,
+    'forks': 3,
+    'commits': 200,
+    'fork_commits': 5,
+    'spec_lines': 2000,
+    'comments': 50,
+    'seed': 42,
+}
+
+WORDS = [
+    'build', 'rebuild', 'fix', 'update', 'patch', 'requires', 'python',
+    'devel', 'libs', 'doc', 'test', 'upstream', 'release', 'bump', 'spec',
+    'license', 'macro', 'scriptlet', 'cleanup', 'backport', 'security',
+]
+
+
+def _signature(rand, offset):
+    ''' Return the pygit2.Signature of a generated commit. '''
+    user = 'packager%s' % rand.randint(0, 9)
+    return pygit2.Signature(
+        user, '%s@example.com' % user, EPOCH + offset * 3600, 0)
+
+
+def _sentence(rand, size=6):
+    ''' Return some random words. '''
+    return ' '.join(rand.choice(WORDS) for _ in range(size))
+
+
+def spec_file(name, rand, lines, release):
+    ''' Return the content of a spec file of about ``lines`` lines. '''
+    header = [
+        'Name:           %s' % name,
+        'Version:        1.0',
+        'Release:        %s%%{?dist}' % release,
+        'Summary:        %s' % _sentence(rand),
+        'License:        GPLv2+',
+        'URL:            https://example.com/%s' % name,
+        'Source0:        %s-1.0.tar.gz' % name,
+        'Patch0:         %s-fix.patch' % name,
+        '',
+        'BuildRequires:  gcc',
+        '',
+        '%description',
+        _sentence(rand, 20),
+        '',
+        '%prep',
+        '%setup -q',
+        '%patch0 -p1',
+        '',
+        '%build',
+        '%configure',
+        'make %{?_smp_mflags}',
+        '',
+        '%install',
+        'make install DESTDIR=%{buildroot}',
+        '',
+        '%files',
+        '%{_bindir}/%{name}',
+        '',
+        '%changelog',
+    ]
+    body = []
+    for idx in range(max(lines - len(header), 0) // 3):
+        body.append('* Mon Jan 01 2014 Packager <packager@example.com> - '
+                    '1.0-%s' % (release - idx))
+        body.append('- %s' % _sentence(rand))
+        body.append('')
+    return '\n'.join(header + body) + '\n'
+
+
+def patch_file(name, rand, lines=200):
+    ''' Return the content of a patch of about ``lines`` lines. '''
+    output = [
+        '--- a/%s.c' % name,
+        '+++ b/%s.c' % name,
+        '@@ -1,%s +1,%s @@' % (lines // 2, lines // 2),
+    ]
+    for _ in range(lines // 2):
+        output.append('-    %s();' % rand.choice(WORDS))
+        output.append('+    %s_%s();' % (rand.choice(WORDS), name))
+    return '\n'.join(output) + '\n'
+
+
+def _commit(repo_obj, files, parents, rand, offset, message):
+    ''' Create a commit of the provided files, a dict of name -> content,
+    on top of ``parents`` and return its oid. '''
+    builder = repo_obj.TreeBuilder()
+    for name, content in sorted(files.items()):
+        builder.insert(
+            name, repo_obj.create_blob(content), pygit2.GIT_FILEMODE_BLOB)
+    tree = builder.write()
+    signature = _signature(rand, offset)
+    return repo_obj.create_commit(
+        None, signature, signature, message, tree, parents)
+
+
+def generate_repo(path, name, rand, commits, spec_lines):
+    ''' Create at ``path`` a bare repository of a package with a history
+    of ``commits`` commits, each one updating its spec file.
+
+    :return: the pygit2.Repository created.
+    '''
+    repo_obj = pygit2.init_repository(path, bare=True)
+    files = {
+        'README.rst': '%s\n%s\n\n%s\n' % (
+            name, '=' * len(name), _sentence(rand, 50)),
+        '%s-fix.patch' % name: patch_file(name, rand),
+        'sources': '%032x  %s-1.0.tar.gz\n' % (
+            rand.getrandbits(128), name),
+    }
+    parents = []
+    for idx in range(1, commits + 1):
+        files['%s.spec' % name] = spec_file(name, rand, spec_lines, idx)
+        oid = _commit(
+            repo_obj, files, parents, rand, idx,
+            '%s\n\n%s' % (_sentence(rand), _sentence(rand, 20)))
+        parents = [oid]
+    repo_obj.create_reference('refs/heads/master', parents[0])
+    return repo_obj
+
+
+def add_commits(repo_obj, name, rand, commits, spec_lines, offset):
+    ''' Add ``commits`` commits on top of the master branch of the
+    provided repo.
+
+    :return: the list of the hex of the commits added.
+    '''
+    head = repo_obj.lookup_branch('master').get_object()
+    files = dict(
+        (entry.name, repo_obj[entry.oid].data) for entry in head.tree)
+    parents = [head.oid]
+    output = []
+    for idx in range(commits):
+        files['%s.spec' % name] = spec_file(
+            name, rand, spec_lines, 1000 + offset + idx)
+        oid = _commit(
+            repo_obj, files, parents, rand, offset + idx, _sentence(rand))
+        parents = [oid]
+        output.append(oid.hex)
+    repo_obj.lookup_reference('refs/heads/master').target = parents[0]
+    return output
+
+
+def generate(session, gitfolder, forkfolder, options=None):
+    ''' Generate the repositories, forks, pull-requests and comments in
+    the provided folders and database.
+
+    :kwarg options: a dict overriding the values of DEFAULTS.
+    :return: a dict describing the data generated, with the keys: repos,
+        the list of the names of the repos, and forks, the list of
+        (username, repo, list of the hex of the commits of the fork).
+    '''
+    # Imported here for the benchmark to configure spechub first
+    import spechub.lib
+    from spechub import model
+
+    opts = dict(DEFAULTS)
+    opts.update(options or {})
+    rand = random.Random(opts['seed'])
+
+    for folder in (gitfolder, forkfolder):
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+    output = {'repos': [], 'forks': []}
+    for cnt in range(opts['repos']):
+        name = 'package%04d' % cnt
+        generate_repo(
+            os.path.join(gitfolder, name + '.git'), name, rand,
+            opts['commits'], opts['spec_lines'])
+        output['repos'].append(name)
+
+        for fork_cnt in range(opts['forks']):
+            username = 'user%02d' % fork_cnt
+            spechub.lib.fork_project(
+                session, username, name, gitfolder, forkfolder)
+            fork_obj = pygit2.Repository(
+                os.path.join(forkfolder, username, name + '.git'))
+            commits = add_commits(
+                fork_obj, name, rand, opts['fork_commits'],
+                opts['spec_lines'], opts['commits'] + 1)
+            output['forks'].append((username, name, commits))
+
+            spechub.lib.new_pull_request(
+                session, name, None, 'master', _sentence(rand, 4),
+                username, commits[-1], commits[0])
+            request = session.query(
+                model.PullRequest
+            ).order_by(
+                model.PullRequest.id.desc()
+            ).first()
+            for comment_cnt in range(opts['comments']):
+                spechub.lib.add_pull_request_comment(
+                    session, request, rand.choice(commits),
+                    rand.randint(1, opts['spec_lines']),
+                    _sentence(rand, 12), username)
+            session.commit()
+
+    return output
@@ -0,0 +1,288 @@
+#!/usr/bin/env python2
+#-*- coding: utf-8 -*-
+
+"""
+ (c) 2014 - Copyright Red Hat Inc
+
+ Authors:
+   Pierre-Yves Chibon <pingou@pingoured.fr>
+
+Benchmark the routes of spechub against generated data.
+
+Usage::
+
+    python -m benchmarks.run --workdir /var/tmp/spechub-bench \\
+        --output results.json
+
+The data is generated in the work directory on the first run and reused
+by the next runs made with the same options. Every route is requested
+through the Flask test client, once cold and then ``--iterations`` times,
+and the results are written as JSON: latency percentiles in milliseconds,
+number of SQL queries (from the Server-Timing header) and peak memory of
+the process, per route.
+
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import time
+
+from benchmarks import generate
+
+
+# Routes changing the data or the session, they are not benchmarked
+SKIPPED = [
+    'admin_delete_project', 'auth_login', 'auth_logout', 'fork_project',
+    'merge_request_pull', 'static',
+]
+
+
+class FakeUser(object):
+    ''' Logged in user, admin of spechub, used for the benchmark. '''
+    username = 'user00'
+    cla_done = True
+
+    def __init__(self, groups):
+        self.groups = groups
+
+
+def _write_config(workdir, config_file):
+    ''' Write the spechub configuration used by the benchmark. '''
+    with open(config_file, 'w') as stream:
+        stream.write('\n'.join([
+            "DB_URL = 'sqlite:///%s'" % os.path.join(workdir, 'db.sqlite'),
+            "GIT_FOLDER = %r" % os.path.join(workdir, 'repos'),
+            "FORK_FOLDER = %r" % os.path.join(workdir, 'forks'),
+            "CONTENT_INDEX_PATH = %r" % os.path.join(
+                workdir, 'content.sqlite'),
+            "SECRET_KEY = 'benchmark'",
+            "JOBS_ASYNC = False",
+            "METRICS = True",
+            "",
+        ]))
+
+
+def percentile(values, percent):
+    ''' Return the percentile of the sorted list of values. '''
+    if not values:
+        return None
+    idx = int(round((len(values) - 1) * percent / 100.0))
+    return values[idx]
+
+
+def parse_server_timing(header):
+    ''' Return a dict of name -> (count, duration in ms) of the provided
+    Server-Timing header. '''
+    output = {}
+    for item in (header or '').split(','):
+        parts = [part.strip() for part in item.split(';')]
+        if not parts[0]:
+            continue
+        count = duration = None
+        for part in parts[1:]:
+            key, _, value = part.partition('=')
+            if key == 'desc':
+                count = int(value.strip('"'))
+            elif key == 'dur':
+                duration = float(value)
+        output[parts[0]] = (count, duration)
+    return output
+
+
+def get_scenarios(app, data, session):
+    ''' Return the list of (name, endpoint, URL) requested. '''
+    import flask
+    import pygit2
+    import spechub.jobs
+    import spechub.lib
+
+    repo = data['repos'][0]
+    username, fork, commits = data['forks'][0]
+    repo_obj = pygit2.Repository(
+        os.path.join(app.config['GIT_FOLDER'], repo + '.git'))
+    head = repo_obj.lookup_branch('master').get_object()
+    request = spechub.lib.get_pull_requests(session)[0]
+    job = spechub.jobs.submit(
+        session, app.config, 'reap_trash', lock_key='trash')
+
+    routes = [
+        ('index', {}),
+        ('search', {'term': 'package00*'}),
+        ('search', {'term': 'Release', 'mode': 'content'}),
+        ('view_repo', {'repo': repo}),
+        ('view_repo', {'repo': fork, 'username': username}),
+        ('view_repo_branch', {'repo': repo, 'branchname': 'master'}),
+        ('view_log', {'repo': repo}),
+        ('view_log', {'repo': repo, 'page': 5}),
+        ('view_log', {'repo': fork, 'username': username}),
+        ('view_file', {
+            'repo': repo, 'identifier': 'master',
+            'filename': '%s.spec' % repo}),
+        ('view_file', {
+            'repo': repo, 'identifier': head.hex,
+            'filename': '%s-fix.patch' % repo}),
+        ('view_raw_file', {
+            'repo': repo, 'identifier': 'master',
+            'filename': '%s.spec' % repo}),
+        ('view_commit', {'repo': repo, 'commitid': head.hex}),
+        ('view_tree', {'repo': repo}),
+        ('view_tree', {'repo': repo, 'identifier': head.hex}),
+        ('view_forks', {'repo': repo}),
+        ('request_pulls', {'repo': repo}),
+        ('request_pull', {'repo': repo, 'requestid': request.id}),
+        ('view_commit_diff', {
+            'repo': fork, 'username': username, 'commitid': commits[-1],
+            'requestid': request.id}),
+        ('pull_request_add_comment', {
+            'repo': repo, 'requestid': request.id, 'commit': commits[-1],
+            'row': 1}),
+        ('new_request_pull', {'repo': fork, 'username': username}),
+        ('view_job', {'jobid': job.id}),
+        ('job_status', {'jobid': job.id}),
+        ('admin_index', {}),
+        ('admin_metrics', {}),
+        ('gitolite_conf', {}),
+    ]
+
+    output = []
+    with app.test_request_context():
+        for endpoint, args in routes:
+            url = flask.url_for(endpoint, **args)
+            output.append(('%s %s' % (endpoint, url), endpoint, url))
+    return output
+
+
+def run_scenario(client, url, iterations):
+    ''' Request the URL once cold and then ``iterations`` times.
+
+    :return: a dict of the measures.
+    '''
+    start = time.time()
+    response = client.get(url)
+    cold = (time.time() - start) * 1000
+
+    durations = []
+    queries = []
+    statuses = set([response.status_code])
+    for _ in range(iterations):
+        start = time.time()
+        response = client.get(url)
+        durations.append((time.time() - start) * 1000)
+        statuses.add(response.status_code)
+        timing = parse_server_timing(response.headers.get('Server-Timing'))
+        queries.append(timing.get('db', (0, 0))[0] or 0)
+
+    durations.sort()
+    return {
+        'status': sorted(statuses),
+        'cold_ms': cold,
+        'mean_ms': sum(durations) / len(durations),
+        'p50_ms': percentile(durations, 50),
+        'p90_ms': percentile(durations, 90),
+        'p99_ms': percentile(durations, 99),
+        'max_ms': durations[-1],
+        'queries': max(queries),
+        'peak_memory_kb': resource.getrusage(
+            resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def main():
+    ''' Generate the data if needed, run the benchmark and write its
+    results. '''
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument(
+        '--workdir', default='/var/tmp/spechub-bench',
+        help='Folder holding the generated data')
+    parser.add_argument(
+        '--output', default='-',
+        help='File in which the JSON results are written, - for stdout')
+    parser.add_argument(
+        '--iterations', type=int, default=20,
+        help='Number of requests per route, after the cold one')
+    for key, value in sorted(generate.DEFAULTS.items()):
+        parser.add_argument(
+            '--%s' % key.replace('_', '-'), type=int, default=value,
+            help='Default: %s' % value)
+    args = parser.parse_args()
+
+    options = dict(
+        (key, getattr(args, key)) for key in generate.DEFAULTS)
+    workdir = os.path.abspath(
+        os.path.join(args.workdir, '-'.join(
+            '%s%s' % (key, options[key]) for key in sorted(options))))
+    if not os.path.exists(workdir):
+        os.makedirs(workdir)
+
+    config_file = os.path.join(workdir, 'spechub.cfg')
+    _write_config(workdir, config_file)
+    os.environ['SPECHUB_CONFIG'] = config_file
+
+    start = time.time()
+    import flask
+    import spechub
+    from spechub import APP, SESSION, model
+    import_time = time.time() - start
+
+    data_file = os.path.join(workdir, 'data.json')
+    if not os.path.exists(data_file):
+        model.create_tables(APP.config['DB_URL'])
+        start = time.time()
+        data = generate.generate(
+            SESSION, APP.config['GIT_FOLDER'], APP.config['FORK_FOLDER'],
+            options)
+        spechub.CONTENT_INDEX.refresh(APP.config['GIT_FOLDER'])
+        sys.stderr.write(
+            'Data generated in %.1fs\n' % (time.time() - start))
+        with open(data_file, 'w') as stream:
+            json.dump(data, stream)
+    with open(data_file) as stream:
+        data = json.load(stream)
+
+    user = FakeUser([APP.config['ADMIN_GROUP']])
+    @APP.before_request
+    def login():
+        ''' Log the benchmark user in. '''
+        flask.g.fas_user = user
+
+    scenarios = get_scenarios(APP, data, SESSION)
+    client = APP.test_client()
+    results = {}
+    for name, _, url in scenarios:
+        sys.stderr.write('%s\n' % name)
+        results[name] = run_scenario(client, url, args.iterations)
+
+    covered = set(endpoint for _, endpoint, _ in scenarios)
+    missing = sorted(
+        rule.endpoint for rule in APP.url_map.iter_rules()
+        if rule.endpoint not in covered and rule.endpoint not in SKIPPED)
+
+    output = {
+        'spechub_version': spechub.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'options': options,
+        'iterations': args.iterations,
+        'import_s': import_time,
+        'peak_memory_kb': resource.getrusage(
+            resource.RUSAGE_SELF).ru_maxrss,
+        'routes': results,
+        'skipped': sorted(SKIPPED),
+        'not_covered': sorted(set(missing)),
+    }
+
+    if args.output == '-':
+        json.dump(output, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    else:
+        with open(args.output, 'w') as stream:
+            json.dump(output, stream, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
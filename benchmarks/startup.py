@@ -0,0 +1,100 @@
+#!/usr/bin/env python2
+#-*- coding: utf-8 -*-
+
+"""
+ (c) 2014 - Copyright Red Hat Inc
+
+ Authors:
+   Pierre-Yves Chibon <pingou@pingoured.fr>
+
+Measure how long a fresh process takes to import spechub and to answer its
+first request, with and without preloading.
+
+Usage::
+
+    python -m benchmarks.startup --runs 10 --output startup.json
+
+Each measure is made in a new python process, the configuration used is
+the one of the SPECHUB_CONFIG environment variable, if set.
+
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+
+# Run in a new process, prints the durations measured as JSON
+PROBE = '''
+import json, time
+start = time.time()
+import spechub
+imported = time.time()
+if %(preload)r:
+    spechub.preload()
+preloaded = time.time()
+response = spechub.APP.test_client().get(%(url)r)
+done = time.time()
+print json.dumps({
+    'import_s': imported - start,
+    'preload_s': preloaded - imported,
+    'first_request_s': done - preloaded,
+    'status': response.status_code,
+})
+'''
+
+
+def probe(preload, url):
+    ''' Return the durations measured by a new process. '''
+    start = time.time()
+    output = subprocess.check_output(
+        [sys.executable, '-c', PROBE % {'preload': preload, 'url': url}])
+    result = json.loads(output.strip().splitlines()[-1])
+    result['process_s'] = time.time() - start
+    return result
+
+
+def summarize(results):
+    ''' Return the median and minimum of each duration of the results. '''
+    output = {}
+    for key in ['import_s', 'preload_s', 'first_request_s', 'process_s']:
+        values = sorted(result[key] for result in results)
+        output[key] = {
+            'median': values[len(values) // 2],
+            'min': values[0],
+        }
+    output['status'] = sorted(set(result['status'] for result in results))
+    return output
+
+
+def main():
+    ''' Run the measures and write their results. '''
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument(
+        '--runs', type=int, default=10,
+        help='Number of processes started per mode')
+    parser.add_argument(
+        '--url', default='/',
+        help='URL of the first request')
+    parser.add_argument(
+        '--output', default='-',
+        help='File in which the JSON results are written, - for stdout')
+    args = parser.parse_args()
+
+    output = {'runs': args.runs, 'url': args.url}
+    for mode, preload in [('lazy', False), ('preload', True)]:
+        output[mode] = summarize(
+            [probe(preload, args.url) for _ in range(args.runs)])
+
+    if args.output == '-':
+        json.dump(output, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    else:
+        with open(args.output, 'w') as stream:
+            json.dump(output, stream, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
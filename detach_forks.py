@@ -0,0 +1,25 @@
+#!/usr/bin/env python2
+
+## These two lines are needed to run on EL6
+__requires__ = ['SQLAlchemy >= 0.8', 'jinja2 >= 2.4']
+import pkg_resources
+
+import argparse
+
+import spechub.lib
+from spechub import APP, SESSION
+
+parser = argparse.ArgumentParser(
+    description='Copy into the forks of projects the objects they borrow '
+    'from them, before deleting or pruning the projects')
+parser.add_argument('projects', nargs='+', help='Name of the projects')
+args = parser.parse_args()
+
+for name in args.projects:
+    project = spechub.lib.get_project(SESSION, name)
+    if project is None:
+        print 'No project %s' % name
+        continue
+    for fork in spechub.lib.detach_forks(
+            SESSION, project, APP.config['FORK_FOLDER']):
+        print 'Detached %s' % fork.fullname
@@ -0,0 +1,19 @@
+#!/usr/bin/env python2
+
+## These two lines are needed to run on EL6
+__requires__ = ['SQLAlchemy >= 0.8', 'jinja2 >= 2.4']
+import pkg_resources
+
+import argparse
+
+from spechub import APP
+import spechub.jobs
+
+parser = argparse.ArgumentParser(
+    description='Run the background jobs of spechub')
+parser.add_argument(
+    '--workers', type=int, default=None,
+    help='Number of worker processes to start (default: JOB_WORKERS)')
+args = parser.parse_args()
+
+spechub.jobs.run_workers(APP.config, workers=args.workers)
@@ -15,8 +15,10 @@ import pkg_resources
 __version__ = '0.1'
 
 import datetime
+import hashlib
 import logging
 import os
+import re
 import subprocess
 import textwrap
 import urlparse
@@ -30,7 +32,16 @@ from functools import wraps
 from sqlalchemy.exc import SQLAlchemyError
 
 import spechub.lib
+import spechub.cache
+import spechub.commit_graph
+import spechub.content_index
 import spechub.doc_utils
+import spechub.head_cache
+import spechub.metrics
+import spechub.model
+import spechub.name_index
+import spechub.registry
+import spechub.repo_pool
 
 
 # Create the application.
@@ -45,8 +56,48 @@ if 'SPECHUB_CONFIG' in os.environ:
     APP.config.from_envvar('SPECHUB_CONFIG')
 
 
+# A full commit id, addressing content that never changes
+OID_RE = re.compile('^[0-9a-f]{40}$')
+# Identifier of the deployed version, see get_build_id
+BUILD_ID = None
+
+# The OpenID libraries are only imported when handling a login
 FAS = FAS(APP)
 SESSION = spechub.lib.create_session(APP.config['DB_URL'])
+METRICS = None
+REPO_FACTORY = pygit2.Repository
+if APP.config.get('METRICS', True):
+    METRICS = spechub.metrics.Metrics()
+    spechub.metrics.instrument_engine(SESSION.bind)
+    APP.jinja_env.template_class = spechub.metrics.TimedTemplate
+    REPO_FACTORY = spechub.metrics.TimedRepository
+REPO_POOL = spechub.repo_pool.RepositoryPool(
+    APP.config.get('REPO_POOL_SIZE', 256), REPO_FACTORY)
+HIGHLIGHT_CACHE = spechub.cache.TieredCache(
+    APP.config.get('HIGHLIGHT_CACHE_SIZE', 64 * 1024 * 1024),
+    APP.config.get('HIGHLIGHT_CACHE_FOLDER', None),
+    APP.config.get('HIGHLIGHT_CACHE_FOLDER_SIZE', 1024 * 1024 * 1024))
+REPO_REGISTRY = spechub.registry.RepoRegistry(
+    APP.config['GIT_FOLDER'],
+    APP.config.get('REPO_REGISTRY_CHECK_INTERVAL', 5))
+NAME_INDEX = spechub.name_index.NameIndex()
+REPO_REGISTRY.listeners.append(NAME_INDEX.update)
+CONTENT_INDEX = None
+if APP.config.get('CONTENT_INDEX_PATH'):
+    CONTENT_INDEX = spechub.content_index.ContentIndex(
+        APP.config['CONTENT_INDEX_PATH'])
+DIFF_CACHE = spechub.cache.TieredCache(
+    APP.config.get('DIFF_CACHE_SIZE', 64 * 1024 * 1024),
+    APP.config.get('DIFF_CACHE_FOLDER', None),
+    APP.config.get('DIFF_CACHE_FOLDER_SIZE', 1024 * 1024 * 1024))
+DOC_CACHE = spechub.cache.TieredCache(
+    APP.config.get('DOC_CACHE_SIZE', 16 * 1024 * 1024),
+    APP.config.get('DOC_CACHE_FOLDER', None),
+    APP.config.get('DOC_CACHE_FOLDER_SIZE', 1024 * 1024 * 1024))
+HEAD_CACHE = spechub.head_cache.HeadCache(
+    APP.config.get('HEAD_CACHE_SIZE', 4096))
+# Process-wide memo of the id of the projects: (name, username) -> id
+PROJECT_IDS = {}
 
 # Set up the logger
 ## Send emails for big exception
@@ -141,6 +192,71 @@ work.
     return decorated_function
 
 
+def get_build_id():
+    """ Return the identifier of the deployed version of spechub, part of
+    the ETags: the BUILD_ID configuration key or, if it is not set, the
+    version and the time the templates were last changed.
+    """
+    global BUILD_ID
+    if BUILD_ID is None:
+        BUILD_ID = APP.config.get('BUILD_ID')
+    if BUILD_ID is None:
+        mtime = 0
+        for root, _, files in os.walk(
+                os.path.join(APP.root_path, APP.template_folder)):
+            for filename in files:
+                mtime = max(
+                    mtime, os.stat(os.path.join(root, filename)).st_mtime)
+        BUILD_ID = '%s-%d' % (__version__, mtime)
+    return BUILD_ID
+
+
+def immutable_by_oid(argname):
+    """ Flask decorator sending the page with a strong ETag and as
+immutable when its ``argname`` argument is a full commit id, the page of a
+commit never changing.
+
+A request whose If-None-Match header matches the ETag gets a 304 answer
+without the view being called, so without touching the git repository.
+The templates leave out the content that changes, such as the number of
+forks, when ``g.immutable`` is set. The login state varies with the
+session cookie and pages having flashed messages are not cached.
+"""
+    def decorator(function):
+        """ Decorator of the view. """
+        @wraps(function)
+        def decorated_function(*args, **kwargs):
+            """ Decorated function, actually does the work. """
+            oid = kwargs.get(argname)
+            if not oid or not OID_RE.match(oid) \
+                    or '_flashes' in flask.session:
+                return function(*args, **kwargs)
+            flask.g.immutable = True
+
+            username = None
+            if authenticated():
+                username = flask.g.fas_user.username
+            etag = '%s-%s' % (oid, hashlib.sha1('\0'.join([
+                get_build_id(), flask.request.path, username or '',
+            ]).encode('utf-8')).hexdigest()[:16])
+            cache_control = '%s, max-age=%s, immutable' % (
+                'private' if username else 'public',
+                APP.config.get('IMMUTABLE_MAX_AGE', 3600))
+
+            if flask.request.if_none_match.contains(etag):
+                response = flask.Response(status=304)
+            else:
+                response = flask.make_response(function(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = cache_control
+            response.vary.add('Cookie')
+            return response
+        return decorated_function
+    return decorator
+
+
 @APP.context_processor
 def inject_variables():
     """ With this decorator we can set some variables to all templates.
@@ -161,13 +277,105 @@ def set_session():
     flask.session.permanent = True
 
 
+@APP.before_request
+def start_metrics():
+    """ Start recording the work done by the request. """
+    if METRICS is not None:
+        spechub.metrics.start_request()
+
+
+@APP.after_request
+def add_server_timing(response):
+    """ Describe the work done by the request in a Server-Timing header,
+    for the admins only unless SERVER_TIMING is set.
+    """
+    recorder = spechub.metrics.current()
+    if recorder is not None \
+            and (APP.config.get('SERVER_TIMING') or is_admin()):
+        response.headers['Server-Timing'] = recorder.server_timing()
+    return response
+
+
+@APP.teardown_request
+def stop_metrics(exception=None):
+    """ Add the work done by the request to the totals of its route. """
+    recorder = spechub.metrics.stop_request()
+    if recorder is not None and METRICS is not None:
+        METRICS.add(flask.request.endpoint or 'unknown', recorder)
+
+
+@APP.teardown_request
+def checkin_repos(exception=None):
+    """ Give back to the pool the git repositories used by the request. """
+    repos = getattr(flask.g, 'repos', {})
+    while repos:
+        REPO_POOL.checkin(repos.popitem()[1])
+
+
+def open_repo(path):
+    """ Return the pygit2.Repository of the git repo at the specified path.
+
+    The repository is taken from the process-wide pool and given back at
+    the end of the request, opening the same path twice during a request
+    returns the same object.
+    """
+    path = os.path.abspath(path)
+    if not hasattr(flask.g, 'repos'):
+        flask.g.repos = {}
+    if path not in flask.g.repos:
+        flask.g.repos[path] = REPO_POOL.checkout(path)
+    return flask.g.repos[path]
+
+
+def get_project(repo, username=None):
+    """ Return the project having the specified name and user, or None if
+    it does not exist in the database.
+
+    This never writes to the database, the projects are created when they
+    are forked or receive a pull-request. The result is memoized for the
+    request and the id of the project for the process.
+    """
+    key = (repo, username)
+    if not hasattr(flask.g, 'projects'):
+        flask.g.projects = {}
+    if key in flask.g.projects:
+        return flask.g.projects[key]
+
+    project = None
+    project_id = PROJECT_IDS.get(key)
+    if project_id is not None:
+        project = spechub.lib.get_project_by_id(SESSION, project_id)
+        # The project may have been deleted since
+        if project is not None and (
+                project.name != repo
+                or (project.user.user if project.user else None)
+                != username):
+            project = None
+
+    if project is None:
+        project = spechub.lib.get_project(SESSION, repo, username)
+        if project is None:
+            PROJECT_IDS.pop(key, None)
+        else:
+            PROJECT_IDS[key] = project.id
+
+    flask.g.projects[key] = project
+    return project
+
+
 @APP.template_filter('lastcommit_date')
 def lastcommit_date_filter(repo):
-    """ Template filter returning the last commit date of the provided repo.
+    """ Template filter returning the last commit date of the provided repo,
+    a pygit2.Repository or the name of a project of the GIT_FOLDER.
     """
-    if not repo.is_empty:
-        commit = repo[repo.head.target]
-        return arrow.get(commit.commit_time).humanize()
+    if isinstance(repo, basestring):
+        info = HEAD_CACHE.get(
+            os.path.join(APP.config['GIT_FOLDER'], repo + '.git'))
+    else:
+        info = HEAD_CACHE.get(repo.path, repo)
+    if info is None:
+        return ''
+    return arrow.get(info.commit_time).humanize()
 
 
 @APP.template_filter('humanize')
@@ -182,7 +390,8 @@ def rst2html(rst_string):
     """ Template filter transforming rst text into html
     """
     if rst_string:
-        return spechub.doc_utils.convert_doc(unicode(rst_string))
+        return spechub.doc_utils.convert_doc(
+            unicode(rst_string), cache=DOC_CACHE)
 
 
 @APP.template_filter('format_ts')
@@ -194,80 +403,80 @@ def format_ts(string):
 
 
 @APP.template_filter('format_loc')
-def format_loc(loc, commit=None, prequest=None):
+def format_loc(loc, commit=None, comments=None):
     """ Template filter putting the provided lines of code into a table
+
+    :arg loc: the highlighted code to render.
+    :kwarg commit: the pygit2.Commit the code comes from, if specified
+        the lines can be commented.
+    :kwarg comments: the index of the comments of the pull-request, as
+        returned by ``spechub.lib.get_pull_request_comments_index``.
     """
+    comments = comments or {}
+
+    if commit:
+        commitid = commit.oid.hex
+        row_start = (
+            '<tr><td class="cell1">'
+            '<a id="%%(cnt)s" href="#%%(cnt)s">%%(cnt)s</a></td>'
+            '<td class="prc" data-row="%%(cnt)s" data-commit="%(commitid)s">'
+            '<p>'
+            '<img src="%(img)s" alt="Add comment" title="Add comment"/>'
+            '</p>'
+            '</td>' % (
+                {
+                    'img': flask.url_for(
+                        'static', filename='users.png').replace('%', '%%'),
+                    'commitid': commitid,
+                }
+            )
+        )
+    else:
+        commitid = None
+        row_start = (
+            '<tr><td class="cell1">'
+            '<a id="%(cnt)s" href="#%(cnt)s">%(cnt)s</a></td>'
+        )
+
     output = [
         '<div class="highlight">',
         '<table class="code_table">'
     ]
+    append = output.append
 
-    comments = {}
-    if prequest and not isinstance(prequest, flask.wrappers.Request):
-        for com in prequest.comments:
-            if commit and com.commit_id == commit.oid.hex:
-                if com.line in comments:
-                    comments[com.line].append(com)
-                else:
-                    comments[com.line] = [com]
-    for key in comments:
-        comments[key] = sorted(comments[key], key=lambda obj: obj.date_created)
-
-    cnt = 1
+    cnt = 0
     for line in loc.split('\n'):
-        if commit:
-            output.append(
-                '<tr><td class="cell1">'
-                '<a id="%(cnt)s" href="#%(cnt)s">%(cnt)s</a></td>'
-                '<td class="prc" data-row="%(cnt)s" data-commit="%(commitid)s">'
-                '<p>'
-                '<img src="%(img)s" alt="Add comment" title="Add comment"/>'
-                '</p>'
-                '</td>' % (
-                    {
-                        'cnt': cnt,
-                        'img': flask.url_for('static', filename='users.png'),
-                        'commitid': commit.oid.hex,
-                    }
-                )
-            )
-        else:
-            output.append(
-                '<tr><td class="cell1">'
-                '<a id="%(cnt)s" href="#%(cnt)s">%(cnt)s</a></td>'
-                % ({'cnt': cnt})
-            )
-
         cnt += 1
+        append(row_start % {'cnt': cnt})
+
         if not line:
-            output.append(line)
+            append(line)
             continue
         if line == '</pre></div>':
             continue
         if line.startswith('<div'):
             line = line.split('<pre', 1)[1].split('>', 1)[1]
-        output.append('<td class="cell2"><pre>%s</pre></td>' % line)
-        output.append('</tr>')
-
-        if cnt - 1 in comments:
-            for comment in comments[cnt -1]:
-                output.append(
-                    '<tr><td></td>'
-                    '<td colspan="2"><table style="width:100%%"><tr>'
-                    '<td>%(user)s</td><td class="right">%(date)s</td>'
-                    '</tr>'
-                    '<tr><td colspan="2" class="pr_comment">%(comment)s</td></tr>'
-                    '</table></td></tr>' % (
-                        {
-                            'user': comment.user.user,
-                            'date': comment.date_created.strftime(
-                                '%b %d %Y %H:%M:%S'),
-                            'comment': comment.comment,
-                        }
-                    )
+        append('<td class="cell2"><pre>%s</pre></td>' % line)
+        append('</tr>')
+
+        for comment in comments.get((commitid, cnt), ()):
+            append(
+                '<tr><td></td>'
+                '<td colspan="2"><table style="width:100%%"><tr>'
+                '<td>%(user)s</td><td class="right">%(date)s</td>'
+                '</tr>'
+                '<tr><td colspan="2" class="pr_comment">%(comment)s</td></tr>'
+                '</table></td></tr>' % (
+                    {
+                        'user': comment.user.user,
+                        'date': comment.date_created.strftime(
+                            '%b %d %Y %H:%M:%S'),
+                        'comment': comment.comment,
+                    }
                 )
+            )
 
-    output.append('</table></div>')
+    append('</table></div>')
 
     return '\n'.join(output)
 
@@ -330,9 +539,30 @@ def __get_file_in_tree(repo_obj, tree, filepath):
                 return __get_file_in_tree(
                     repo_obj, repo_obj[el.oid], filepath[1:])
 
+def get_commit_graph(repo_obj):
+    ''' Return the commit-graph index of the provided repo or None if the
+    index is disabled or could not be updated.
+    '''
+    if not APP.config.get('COMMIT_GRAPH', True):
+        return None
+    return spechub.commit_graph.get_commit_graph(repo_obj)
+
+def preload():
+    """ Import and warm up the renderers and the authentication, which are
+    otherwise set up on first use, for example in the master process of
+    the WSGI server before it forks its workers.
+    """
+    import spechub.highlight_utils
+    spechub.highlight_utils.preload()
+    spechub.doc_utils.preload()
+    spechub.flask_fas_openid.preload()
+
 ## Import the application
 
 import spechub.ui.app
 import spechub.ui.admin
 import spechub.ui.fork
 import spechub.ui.repo
+
+if APP.config.get('PRELOAD', False):
+    preload()
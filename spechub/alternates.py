@@ -0,0 +1,170 @@
+#-*- coding: utf-8 -*-
+
+"""
+ (c) 2014 - Copyright Red Hat Inc
+
+ Authors:
+   Pierre-Yves Chibon <pingou@pingoured.fr>
+
+Forks sharing the objects of their parent through git alternates.
+
+A shared fork is a bare repository whose ``objects/info/alternates`` file
+points to the object database of its parent, it only stores the objects
+pushed to it. Creating one only copies the references of the parent.
+
+The parent must then never lose objects the fork uses: before the parent
+is deleted, or repacked with its unreachable objects pruned, its forks must
+be detached, which copies the borrowed objects into the fork. Creating a
+shared fork sets ``gc.pruneExpire`` to ``never`` in the parent so that
+``git gc`` keeps the objects no longer reachable from its refs.
+
+"""
+
+import fcntl
+import os
+import shutil
+import tempfile
+
+import pygit2
+
+import spechub.exceptions
+import spechub.merge
+from spechub.commit_graph import refs_stamp
+
+
+def _alternates_file(path):
+    ''' Return the path of the alternates file of the repository at
+    ``path``. '''
+    return os.path.join(path, 'objects', 'info', 'alternates')
+
+
+def get_alternates(path):
+    ''' Return the list of the object databases the repository at ``path``
+    borrows objects from. '''
+    filename = _alternates_file(path)
+    if not os.path.exists(filename):
+        return []
+    with open(filename) as stream:
+        return [
+            line.strip()
+            for line in stream
+            if line.strip() and not line.startswith('#')
+        ]
+
+
+def is_shared(path):
+    ''' Return whether the repository at ``path`` borrows objects from
+    another repository. '''
+    return bool(get_alternates(path))
+
+
+def create_shared_fork(parentpath, forkpath):
+    ''' Create at ``forkpath`` a bare repository borrowing the objects of
+    the bare repository at ``parentpath`` and having the same branches,
+    tags and HEAD.
+
+    :return: the pygit2.Repository of the fork.
+    '''
+    parent = pygit2.Repository(parentpath)
+    # The fork may use objects the parent no longer references
+    parent.config['gc.pruneExpire'] = 'never'
+
+    fork = pygit2.init_repository(forkpath, bare=True)
+    try:
+        filename = _alternates_file(forkpath)
+        if not os.path.exists(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        with open(filename, 'w') as stream:
+            stream.write(
+                os.path.abspath(os.path.join(parentpath, 'objects')) + '\n')
+
+        # Re-open the repository for the alternates to be used
+        fork = pygit2.Repository(forkpath)
+        for refname in parent.listall_references():
+            if not refname.startswith(('refs/heads/', 'refs/tags/')):
+                continue
+            ref = parent.lookup_reference(refname)
+            if ref.type != pygit2.GIT_REF_OID:
+                continue
+            fork.create_reference_direct(refname, ref.target, True)
+
+        head = parent.lookup_reference('HEAD')
+        if head.type == pygit2.GIT_REF_SYMBOLIC:
+            fork.create_reference_symbolic('HEAD', head.target, True)
+    except:
+        shutil.rmtree(forkpath, ignore_errors=True)
+        raise
+
+    return fork
+
+
+def _move_loose_objects(src, dest):
+    ''' Move the loose objects of the object database ``src`` into the
+    object database ``dest``, keeping the ones ``dest`` already has. '''
+    for prefix in os.listdir(src):
+        folder = os.path.join(src, prefix)
+        if len(prefix) != 2 or not os.path.isdir(folder):
+            continue
+        dest_folder = os.path.join(dest, prefix)
+        if not os.path.exists(dest_folder):
+            os.mkdir(dest_folder)
+        for name in os.listdir(folder):
+            target = os.path.join(dest_folder, name)
+            if not os.path.exists(target):
+                os.rename(os.path.join(folder, name), target)
+
+
+def detach_fork(forkpath):
+    ''' Copy into the repository at ``forkpath`` the objects it borrows
+    from other repositories and stop borrowing them.
+
+    The objects reachable from the references of the fork are first
+    written in a temporary repository, read through the alternates, and
+    then moved into the fork. The alternates file is only removed once
+    every object is in the fork, and the copy is started again if the
+    references of the fork changed meanwhile.
+
+    :return: the number of objects copied.
+    :raises spechub.exceptions.SpecHubException: if a borrowed object
+        database no longer exists.
+    '''
+    alternates = get_alternates(forkpath)
+    if not alternates:
+        return 0
+    for folder in alternates:
+        if not os.path.isdir(folder):
+            raise spechub.exceptions.SpecHubException(
+                'The objects of %s are borrowed from %s which no longer '
+                'exists' % (forkpath, folder))
+
+    objects = os.path.join(forkpath, 'objects')
+    lockpath = os.path.join(forkpath, 'spechub-alternates.lock')
+    copied = 0
+    with open(lockpath, 'a') as lockfile:
+        fcntl.flock(lockfile.fileno(), fcntl.LOCK_EX)
+        tmpdir = tempfile.mkdtemp(prefix='detach-', dir=forkpath)
+        try:
+            tmp_repo = pygit2.init_repository(tmpdir, bare=True)
+            done = set()
+            stamp = None
+            while stamp != refs_stamp(forkpath):
+                stamp = refs_stamp(forkpath)
+                fork = pygit2.Repository(forkpath)
+                for refname in fork.listall_references():
+                    target = fork.lookup_reference(refname).resolve().target
+                    if target.hex in done:
+                        continue
+                    copied += spechub.merge.copy_objects(
+                        fork, tmp_repo, target)
+                    done.add(target.hex)
+                _move_loose_objects(os.path.join(tmpdir, 'objects'), objects)
+
+            # The fork now has all its objects, stop borrowing them
+            filename = _alternates_file(forkpath)
+            os.rename(filename, filename + '.detached')
+            os.unlink(filename + '.detached')
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+            fcntl.flock(lockfile.fileno(), fcntl.LOCK_UN)
+
+    return copied
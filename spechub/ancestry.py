@@ -0,0 +1,147 @@
+#-*- coding: utf-8 -*-
+
+"""
+ (c) 2014 - Copyright Red Hat Inc
+
+ Authors:
+   Pierre-Yves Chibon <pingou@pingoured.fr>
+
+"""
+
+import collections
+
+import pygit2
+
+
+Ancestry = collections.namedtuple(
+    'Ancestry', ['ahead', 'behind', 'merge_base'])
+
+
+def _to_oid(repo_obj, commit_id):
+    ''' Return the Oid of the provided commit identifier (hex string, Oid
+    or Commit) if it exists in the given repo, None otherwise.
+    '''
+    if commit_id is None:
+        return None
+    if isinstance(commit_id, pygit2.Commit):
+        commit_id = commit_id.oid
+    elif not isinstance(commit_id, pygit2.Oid):
+        commit_id = pygit2.Oid(hex=commit_id)
+    if commit_id not in repo_obj:
+        return None
+    return commit_id
+
+
+def _get_boundary(repo_obj, orig_repo, orig_oid):
+    ''' Walk the history of the original repo from ``orig_oid`` down to the
+    commits that are also present in ``repo_obj``.
+
+    Returns a tuple: the list of hex of the commits only present in the
+    original repo and the list of Oid of the commits present in both repos
+    at which the walk stopped.
+
+    The walk only covers the commits the original repo has on top of what
+    is known by ``repo_obj``, not its whole history.
+    '''
+    behind = []
+    boundary = []
+    seen = set([orig_oid.hex])
+    queue = collections.deque([orig_oid])
+    while queue:
+        oid = queue.popleft()
+        if oid in repo_obj:
+            boundary.append(oid)
+            continue
+        behind.append(oid.hex)
+        for parent in orig_repo[oid].parents:
+            if parent.oid.hex not in seen:
+                seen.add(parent.oid.hex)
+                queue.append(parent.oid)
+    return behind, boundary
+
+
+def get_ancestry(
+        repo_obj, commit_id, orig_repo=None, orig_id=None, graph=None):
+    ''' Compute which commits are ahead of and behind a reference commit.
+
+    :arg repo_obj: the pygit2.Repository containing ``commit_id``, for
+        example a fork.
+    :arg commit_id: the tip (hex, Oid or Commit) whose history is compared.
+    :kwarg orig_repo: the pygit2.Repository containing ``orig_id``, for
+        example the parent of the fork. Defaults to ``repo_obj``.
+    :kwarg orig_id: the tip (hex, Oid or Commit) to compare against.
+        If None, every commit reachable from ``commit_id`` is ahead.
+    :kwarg graph: the spechub.commit_graph.CommitGraph of ``repo_obj``,
+        when provided the histories are compared using the index and only
+        the commits ahead are looked up in the repository.
+    :return: an ``Ancestry`` namedtuple holding:
+        - ahead: the list of pygit2.Commit reachable from ``commit_id`` but
+          not from ``orig_id``, most recent first,
+        - behind: the list of hex of the commits reachable from
+          ``orig_id`` but not from ``commit_id``,
+        - merge_base: the hex of the best common ancestor or None.
+
+    Neither history is walked in full: the walk of ``repo_obj`` hides the
+    commits it shares with ``orig_id`` and libgit2 stops at them.
+    '''
+    if orig_repo is None:
+        orig_repo = repo_obj
+
+    commit_oid = _to_oid(repo_obj, commit_id)
+    if commit_oid is None:
+        return Ancestry([], [], None)
+
+    hidden = []
+    behind = []
+    orig_oid = None
+    if orig_id is not None:
+        orig_oid = _to_oid(orig_repo, orig_id)
+
+    if orig_oid is not None:
+        if orig_oid in repo_obj:
+            hidden = [orig_oid]
+        else:
+            # The original repo has moved on since, only hide what both
+            # repos have in common.
+            behind, hidden = _get_boundary(repo_obj, orig_repo, orig_oid)
+
+    if graph is not None and commit_oid in graph and all(
+            oid in graph for oid in hidden):
+        ahead = [repo_obj[oid] for oid in graph.ahead(commit_oid, hidden)]
+        if hidden == [orig_oid]:
+            behind = graph.ahead(orig_oid, [commit_oid])
+    else:
+        walker = repo_obj.walk(commit_oid, pygit2.GIT_SORT_TIME)
+        for oid in hidden:
+            walker.hide(oid)
+        ahead = list(walker)
+
+    merge_base = None
+    for oid in hidden:
+        base = repo_obj.merge_base(commit_oid, oid)
+        if base is not None:
+            merge_base = base.hex
+            break
+
+    if merge_base and hidden == [orig_oid] and merge_base != orig_oid.hex \
+            and not behind:
+        walker = repo_obj.walk(orig_oid, pygit2.GIT_SORT_TIME)
+        walker.hide(commit_oid)
+        behind = [commit.oid.hex for commit in walker]
+
+    return Ancestry(ahead, behind, merge_base)
+
+
+def get_branch_ancestry(
+        repo_obj, commit_id, orig_repo, branchname='master', graph=None):
+    ''' Convenience wrapper around ``get_ancestry`` comparing ``commit_id``
+    with the tip of the branch ``branchname`` in ``orig_repo``.
+    '''
+    orig_id = None
+    if not orig_repo.is_empty:
+        branch = orig_repo.lookup_branch(branchname)
+        if branch:
+            orig_id = branch.get_object().oid
+    return get_ancestry(
+        repo_obj, commit_id, orig_repo=orig_repo, orig_id=orig_id,
+        graph=graph)
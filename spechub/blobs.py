@@ -0,0 +1,53 @@
+#-*- coding: utf-8 -*-
+
+"""
+ (c) 2014 - Copyright Red Hat Inc
+
+ Authors:
+   Pierre-Yves Chibon <pingou@pingoured.fr>
+
+Read the content of blobs by chunks, from the output of git cat-file, so
+that large files are never held in memory as a whole.
+
+"""
+
+import subprocess
+
+
+# Number of bytes read at once
+CHUNK_SIZE = 64 * 1024
+
+
+def iter_blob(repo_path, oid, chunk_size=CHUNK_SIZE, limit=None):
+    ''' Yield the content of the specified blob of the git repository at
+    ``repo_path`` by chunks of at most ``chunk_size`` bytes.
+
+    :arg oid: the hex of the blob.
+    :kwarg limit: stop after having read this number of bytes.
+    '''
+    process = subprocess.Popen(
+        ['git', '--git-dir=%s' % repo_path, 'cat-file', 'blob', oid],
+        stdout=subprocess.PIPE)
+    read = 0
+    try:
+        while limit is None or read < limit:
+            size = chunk_size
+            if limit is not None:
+                size = min(size, limit - read)
+            chunk = process.stdout.read(size)
+            if not chunk:
+                break
+            read += len(chunk)
+            yield chunk
+    finally:
+        # Stop git if the content was not read up to its end
+        if process.poll() is None:
+            process.kill()
+        process.stdout.close()
+        process.wait()
+
+
+def read_blob(repo_path, oid, size):
+    ''' Return the first ``size`` bytes of the specified blob of the git
+    repository at ``repo_path``. '''
+    return ''.join(iter_blob(repo_path, oid, limit=size))
@@ -0,0 +1,262 @@
+#-*- coding: utf-8 -*-
+
+"""
+ (c) 2014 - Copyright Red Hat Inc
+
+ Authors:
+   Pierre-Yves Chibon <pingou@pingoured.fr>
+
+"""
+
+import collections
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+
+class LRUCache(object):
+    ''' In-process cache of strings evicting the least recently used
+    entries once the total length of the values reaches ``max_size``.
+    '''
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self._data = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        ''' Return the value stored for ``key`` or None. '''
+        with self.lock:
+            value = self._data.pop(key, None)
+            if value is None:
+                self.misses += 1
+                return None
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        ''' Store ``value`` for ``key``, values larger than the cache are
+        not stored. '''
+        if len(value) > self.max_size:
+            return
+        with self.lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._data[key] = value
+            self.size += len(value)
+            while self.size > self.max_size:
+                _, old = self._data.popitem(last=False)
+                self.size -= len(old)
+                self.evictions += 1
+
+    def clear(self):
+        ''' Remove every entry of the cache. '''
+        with self.lock:
+            self._data.clear()
+            self.size = 0
+
+    def stats(self):
+        ''' Return a dict of the counters of the cache. '''
+        with self.lock:
+            return {
+                'entries': len(self._data),
+                'size': self.size,
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+class DiskCache(object):
+    ''' Cache of unicode strings stored as files in a folder, which may be
+    shared by several processes or hosts.
+
+    Entries are written to a temporary file renamed into place, so readers
+    never see a partial entry.
+
+    If ``max_size`` is specified, the folder is scanned every time about a
+    tenth of it has been written by the process, and the least recently
+    used entries, by mtime which reads update, are removed until it holds
+    at most 90% of ``max_size`` bytes.
+    '''
+
+    # Temporary files older than this number of seconds were left behind
+    # by a writer that died and are removed by the pruning
+    TMP_TIMEOUT = 3600
+
+    def __init__(self, folder, max_size=None):
+        self.folder = folder
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.prune_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size = None
+        # Bytes written since the folder was last scanned, the first write
+        # triggers a scan
+        self._written = max_size or 0
+
+    def _path(self, key):
+        ''' Return the path of the file storing the entry ``key``. '''
+        digest = hashlib.sha1(repr(key)).hexdigest()
+        return os.path.join(self.folder, digest[:2], digest[2:])
+
+    def get(self, key):
+        ''' Return the value stored for ``key`` or None. '''
+        try:
+            with open(self._path(key), 'rb') as stream:
+                value = stream.read().decode('utf-8')
+        except IOError:
+            with self.lock:
+                self.misses += 1
+            return None
+        if self.max_size:
+            try:
+                # Mark the entry as recently used
+                os.utime(self._path(key), None)
+            except OSError:
+                pass
+        with self.lock:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        ''' Store ``value`` for ``key``, errors are ignored as the entry can
+        always be computed again. '''
+        path = self._path(key)
+        try:
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+            data = value.encode('utf-8')
+            with os.fdopen(fd, 'wb') as stream:
+                stream.write(data)
+            os.rename(tmp, path)
+        except (IOError, OSError):
+            return
+
+        if not self.max_size:
+            return
+        with self.lock:
+            self._written += len(data)
+            if self._written < self.max_size / 10:
+                return
+            self._written = 0
+        self.prune()
+
+    def prune(self):
+        ''' Remove the least recently used entries until the folder holds
+        at most 90% of ``max_size`` bytes. Nothing is done if another thread
+        of the process is already pruning.
+
+        :return: the number of entries removed.
+        '''
+        if not self.prune_lock.acquire(False):
+            return 0
+        try:
+            entries = []
+            size = 0
+            now = time.time()
+            for root, _, files in os.walk(self.folder):
+                for filename in files:
+                    path = os.path.join(root, filename)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    if filename.startswith(tempfile.template):
+                        if stat.st_mtime < now - self.TMP_TIMEOUT:
+                            entries.append((0, stat.st_size, path))
+                            size += stat.st_size
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+                    size += stat.st_size
+
+            removed = 0
+            if size > self.max_size:
+                entries.sort()
+                target = self.max_size * 9 / 10
+                for _, entry_size, path in entries:
+                    if size <= target:
+                        break
+                    try:
+                        os.unlink(path)
+                    except OSError:
+                        continue
+                    size -= entry_size
+                    removed += 1
+
+            with self.lock:
+                self.size = size
+                self.evictions += removed
+            return removed
+        finally:
+            self.prune_lock.release()
+
+    def stats(self):
+        ''' Return a dict of the counters of the cache, ``size`` is the one
+        found at the last pruning. '''
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': self.size,
+                'max_size': self.max_size,
+            }
+
+
+class TieredCache(object):
+    ''' Cache looking up an in-process LRUCache first and an optional
+    DiskCache second. '''
+
+    def __init__(self, max_size, folder=None, folder_size=None):
+        ''' Instanciate a cache keeping up to ``max_size`` characters in
+        memory and, if ``folder`` is specified, up to ``folder_size`` bytes
+        on disk, or every entry if it is None. '''
+        self.memory = LRUCache(max_size)
+        self.disk = None
+        if folder:
+            self.disk = DiskCache(folder, folder_size)
+
+    def get(self, key):
+        ''' Return the value stored for ``key`` or None. '''
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.memory.set(key, value)
+        return value
+
+    def set(self, key, value):
+        ''' Store ``value`` for ``key`` in every tier. '''
+        self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+
+    def get_or_set(self, key, function, *args, **kwargs):
+        ''' Return the value stored for ``key``, computing it by calling
+        ``function`` with the provided arguments and storing it first if
+        needed. '''
+        value = self.get(key)
+        if value is None:
+            value = function(*args, **kwargs)
+            self.set(key, value)
+        return value
+
+    def stats(self):
+        ''' Return a dict of the counters of each tier. '''
+        output = {'memory': self.memory.stats()}
+        if self.disk is not None:
+            output['disk'] = self.disk.stats()
+        return output
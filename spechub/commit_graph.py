@@ -0,0 +1,647 @@
+#-*- coding: utf-8 -*-
+
+"""
+ (c) 2014 - Copyright Red Hat Inc
+
+ Authors:
+   Pierre-Yves Chibon <pingou@pingoured.fr>
+
+Persistent commit-graph index of a git repository.
+
+The index lives next to the objects of the bare repository and stores, for
+each commit, its parents, its generation number and its commit time.
+It allows answering ancestry, ordering and counting questions on the
+history of a repo without having libgit2 inflate the commit objects.
+
+Two append-only files are used:
+
+- ``spechub-graph.idx``: a header (magic, version, number of commits,
+  number of edges) followed by one fixed-size record per commit: the raw
+  oid, the commit time, the generation number, the position of its first
+  parent in the edges file and its number of parents,
+- ``spechub-graph.edges``: the position of the parents, as uint32.
+
+Commits are always appended after their parents, the position of a commit
+in the file is thus used as its identifier in the edges.
+
+The tips of the refs at the time of the last update are kept in
+``spechub-graph.tips`` so that an update only walks the new commits.
+
+"""
+
+import collections
+import fcntl
+import hashlib
+import heapq
+import itertools
+import mmap
+import os
+import struct
+import threading
+
+import pygit2
+
+
+IDX_FILE = 'spechub-graph.idx'
+EDGES_FILE = 'spechub-graph.edges'
+TIPS_FILE = 'spechub-graph.tips'
+
+MAGIC = 'SHCG'
+VERSION = 1
+
+HEADER = struct.Struct('<4sIII')
+RECORD = struct.Struct('<20sqIII')
+EDGE = struct.Struct('<I')
+
+# Number of CommitGraph objects kept in memory per process
+CACHE_SIZE = 128
+
+# Number of commit counts, keyed by tip, kept in memory per process
+COUNT_CACHE_SIZE = 4096
+
+_CACHE = collections.OrderedDict()
+_CACHE_LOCK = threading.Lock()
+_COUNTS = collections.OrderedDict()
+
+
+def refs_stamp(path):
+    ''' Return a value changing every time a ref of the git repository at
+    the specified path is created, moved or deleted.
+
+    The stamp is built from the content of HEAD and of every loose ref,
+    in any namespace, and from the inode, size and mtime of the
+    packed-refs file, which git always rewrites into a new file. It does
+    not depend on the precision of the timestamps of the file system.
+    '''
+    digest = hashlib.sha1()
+    for name in ('HEAD', 'packed-refs'):
+        try:
+            stat = os.stat(os.path.join(path, name))
+        except OSError:
+            digest.update('%s:none\n' % name)
+            continue
+        if name == 'HEAD':
+            with open(os.path.join(path, name)) as stream:
+                digest.update('HEAD:%s\n' % stream.read())
+        else:
+            digest.update('%s:%s:%s:%s\n' % (
+                name, stat.st_ino, stat.st_size, stat.st_mtime))
+
+    refs = os.path.join(path, 'refs')
+    for root, dirs, files in os.walk(refs):
+        dirs.sort()
+        for filename in sorted(files):
+            if filename.endswith('.lock'):
+                continue
+            refpath = os.path.join(root, filename)
+            try:
+                with open(refpath) as stream:
+                    target = stream.read()
+            except IOError:
+                # Deleted since it was listed
+                continue
+            digest.update('%s:%s\n' % (
+                os.path.relpath(refpath, refs), target))
+    return (digest.hexdigest(),)
+
+
+def _to_raw(commit_id):
+    ''' Return the raw 20 bytes of the provided commit identifier (hex
+    string, Oid or Commit).
+    '''
+    if isinstance(commit_id, pygit2.Commit):
+        commit_id = commit_id.oid
+    if isinstance(commit_id, pygit2.Oid):
+        return commit_id.raw
+    return pygit2.Oid(hex=commit_id).raw
+
+
+def get_ref_tips(repo_obj):
+    ''' Return the list of Oid of the commits pointed to by the refs of
+    the provided repository, annotated tags being peeled.
+    '''
+    tips = []
+    for refname in repo_obj.listall_references():
+        try:
+            obj = repo_obj.lookup_reference(refname).resolve().get_object()
+        except (KeyError, ValueError, pygit2.GitError):
+            continue
+        while isinstance(obj, pygit2.Tag):
+            obj = repo_obj[obj.target]
+        if isinstance(obj, pygit2.Commit):
+            tips.append(obj.oid)
+    return tips
+
+
+class _Index(object):
+    ''' The index files as mapped in memory by one load of a CommitGraph.
+
+    A load never modifies an _Index but replaces it, queries thus keep
+    reading a consistent view of the index while it is being updated.
+    '''
+
+    def __init__(self, idx=None, edges=''):
+        self.idx = idx
+        self.edges = edges
+
+    def record(self, pos):
+        ''' Return the (raw oid, commit time, generation, first edge,
+        number of parents) tuple stored at the specified position. '''
+        return RECORD.unpack_from(self.idx, HEADER.size + pos * RECORD.size)
+
+    def parents(self, pos):
+        ''' Return the positions of the parents of the commit at the
+        specified position. '''
+        _, _, _, start, nparents = self.record(pos)
+        return [
+            EDGE.unpack_from(self.edges, (start + cnt) * EDGE.size)[0]
+            for cnt in xrange(nparents)
+        ]
+
+    def generation(self, pos):
+        return self.record(pos)[2]
+
+    def time(self, pos):
+        return self.record(pos)[1]
+
+    def hex(self, pos):
+        return self.record(pos)[0].encode('hex')
+
+
+class CommitGraph(object):
+    ''' Memory-mapped commit-graph index of a bare git repository.
+
+    ``lock`` is held while the index is loaded or updated. Queries only
+    take it to look up the positions of their commits and to get the
+    current _Index, the traversal itself runs without it.
+    '''
+
+    def __init__(self, path):
+        ''' Open the index stored in the git repository at ``path``.
+        Nothing is read until the index is first used.
+        '''
+        self.path = path
+        self.idx_path = os.path.join(path, IDX_FILE)
+        self.edges_path = os.path.join(path, EDGES_FILE)
+        self.tips_path = os.path.join(path, TIPS_FILE)
+        self.stamp = None
+        self.lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        ''' Forget everything loaded from the index files. New objects are
+        created so that running queries keep the ones they started with.
+        '''
+        self._index = _Index()
+        self._count = 0
+        self._n_edges = 0
+        self._positions = {}
+        self._counts = {}
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, commit_id):
+        with self.lock:
+            return _to_raw(commit_id) in self._positions
+
+    ## Reading
+
+    def _load(self):
+        ''' Map the index files in memory and index the oids they contain,
+        reading only the records appended since the last load.
+        '''
+        if not os.path.exists(self.idx_path):
+            self._reset()
+            return
+
+        with open(self.idx_path, 'rb') as stream:
+            header = stream.read(HEADER.size)
+        if len(header) < HEADER.size:
+            self._reset()
+            return
+        magic, version, count, n_edges = HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            self._reset()
+            return
+        if count < self._count:
+            # The index was rebuilt by another process
+            self._reset()
+
+        if count == self._count and self._index.idx is not None:
+            return
+
+        with open(self.idx_path, 'rb') as stream:
+            idx = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        edges = ''
+        if n_edges:
+            with open(self.edges_path, 'rb') as stream:
+                edges = mmap.mmap(
+                    stream.fileno(), 0, access=mmap.ACCESS_READ)
+
+        # Positions are only ever added, the records they point to are in
+        # the mapping of every _Index taken since they were added
+        for pos in xrange(self._count, count):
+            raw = idx[
+                HEADER.size + pos * RECORD.size:
+                HEADER.size + pos * RECORD.size + 20]
+            self._positions[raw] = pos
+        self._index = _Index(idx, edges)
+        self._count = count
+        self._n_edges = n_edges
+
+    def _position(self, commit_id):
+        ''' Return the position of the provided commit in the index.
+
+        :raises KeyError: if the commit is not in the index.
+        '''
+        return self._positions[_to_raw(commit_id)]
+
+    def _snapshot(self, commit_ids):
+        ''' Return the current _Index and the positions of the provided
+        commits in it.
+
+        :raises KeyError: if a commit is not in the index.
+        '''
+        with self.lock:
+            return (
+                self._index,
+                [self._position(commit_id) for commit_id in commit_ids])
+
+    ## Writing
+
+    def _read_tips(self):
+        ''' Return the list of Oid of the ref tips seen at the last
+        update. '''
+        tips = []
+        if os.path.exists(self.tips_path):
+            with open(self.tips_path) as stream:
+                for line in stream:
+                    line = line.strip()
+                    if line:
+                        tips.append(pygit2.Oid(hex=line))
+        return tips
+
+    def update(self, repo_obj, force=False):
+        ''' Add to the index the commits reachable from the refs of the
+        provided repository that are not indexed yet.
+
+        Nothing is done if the refs did not change since the last update
+        made by this object, unless ``force`` is True.
+        '''
+        with self.lock:
+            stamp = refs_stamp(self.path)
+            if not force and stamp == self.stamp:
+                self._load()
+                return
+
+            with open(os.path.join(self.path, IDX_FILE + '.lock'), 'a') \
+                    as lockfile:
+                fcntl.flock(lockfile.fileno(), fcntl.LOCK_EX)
+                try:
+                    self._load()
+                    self._update(repo_obj)
+                finally:
+                    fcntl.flock(lockfile.fileno(), fcntl.LOCK_UN)
+            self.stamp = stamp
+
+    def _update(self, repo_obj):
+        ''' Append the new commits to the index files, the lock on the index
+        must be held. '''
+        if self._index.idx is None:
+            with open(self.idx_path, 'wb') as stream:
+                stream.write(HEADER.pack(MAGIC, VERSION, 0, 0))
+            with open(self.edges_path, 'wb'):
+                pass
+            self._reset()
+
+        tips = get_ref_tips(repo_obj)
+        new_tips = [oid for oid in tips if oid.raw not in self._positions]
+        if not new_tips:
+            self._write_tips(tips)
+            return
+
+        walker = repo_obj.walk(
+            new_tips[0],
+            pygit2.GIT_SORT_TOPOLOGICAL | pygit2.GIT_SORT_REVERSE)
+        for oid in new_tips[1:]:
+            walker.push(oid)
+        for oid in self._read_tips():
+            if oid.raw in self._positions:
+                walker.hide(oid)
+
+        positions = {}
+        records = []
+        edges = []
+        count = self._count
+        n_edges = self._n_edges
+        generations = {}
+        for commit in walker:
+            raw = commit.oid.raw
+            if raw in self._positions or raw in positions:
+                continue
+            generation = 0
+            parents = []
+            for parent in commit.parents:
+                praw = parent.oid.raw
+                if praw in positions:
+                    ppos = positions[praw]
+                    pgen = generations[ppos]
+                else:
+                    ppos = self._positions[praw]
+                    pgen = self._index.generation(ppos)
+                parents.append(ppos)
+                generation = max(generation, pgen)
+            pos = count + len(records)
+            positions[raw] = pos
+            generations[pos] = generation + 1
+            records.append(RECORD.pack(
+                raw, commit.commit_time, generation + 1,
+                n_edges + len(edges), len(parents)))
+            edges.extend(parents)
+
+        with open(self.edges_path, 'ab') as stream:
+            stream.write(''.join(EDGE.pack(edge) for edge in edges))
+        with open(self.idx_path, 'r+b') as stream:
+            stream.seek(HEADER.size + count * RECORD.size)
+            stream.write(''.join(records))
+            stream.flush()
+            # The header is updated last so that readers never see
+            # incomplete records
+            stream.seek(0)
+            stream.write(HEADER.pack(
+                MAGIC, VERSION, count + len(records),
+                n_edges + len(edges)))
+        self._write_tips(tips)
+        self._load()
+
+    def _write_tips(self, tips):
+        ''' Store the provided list of Oid as the known ref tips. '''
+        tmp = self.tips_path + '.tmp'
+        with open(tmp, 'w') as stream:
+            stream.write('\n'.join(oid.hex for oid in tips))
+        os.rename(tmp, self.tips_path)
+
+    ## Queries
+
+    def generation(self, commit_id):
+        ''' Return the generation number of the specified commit, root
+        commits have a generation of 1. '''
+        index, (pos,) = self._snapshot([commit_id])
+        return index.generation(pos)
+
+    def commit_time(self, commit_id):
+        ''' Return the commit time of the specified commit. '''
+        index, (pos,) = self._snapshot([commit_id])
+        return index.time(pos)
+
+    def parents(self, commit_id):
+        ''' Return the list of hex of the parents of the specified commit.
+        '''
+        index, (pos,) = self._snapshot([commit_id])
+        return [index.hex(parent) for parent in index.parents(pos)]
+
+    def is_ancestor(self, ancestor_id, commit_id):
+        ''' Return whether ``ancestor_id`` is reachable from ``commit_id``.
+
+        Commits having a generation lower than the one of ``ancestor_id``
+        cannot lead to it and are not visited.
+        '''
+        index, (target, start) = self._snapshot([ancestor_id, commit_id])
+        min_gen = index.generation(target)
+        seen = set([start])
+        stack = [start]
+        while stack:
+            pos = stack.pop()
+            if pos == target:
+                return True
+            for parent in index.parents(pos):
+                if parent not in seen and index.generation(parent) >= min_gen:
+                    seen.add(parent)
+                    stack.append(parent)
+        return False
+
+    def count(self, commit_id):
+        ''' Return the number of commits reachable from the specified
+        commit, itself included. Results are kept per commit.
+        '''
+        with self.lock:
+            index, (start,) = self._snapshot([commit_id])
+            counts = self._counts
+        if start not in counts:
+            seen = set([start])
+            stack = [start]
+            while stack:
+                for parent in index.parents(stack.pop()):
+                    if parent not in seen:
+                        seen.add(parent)
+                        stack.append(parent)
+            counts[start] = len(seen)
+        return counts[start]
+
+    def walk(self, commit_id):
+        ''' Iterate over the hex of the commits reachable from
+        ``commit_id`` most recent first, as a GIT_SORT_TIME walk would.
+        '''
+        # Taken before the generator is first advanced, so that a commit
+        # missing from the index raises right away
+        index, (start,) = self._snapshot([commit_id])
+        return self._walk(index, [start])
+
+    def walk_parents(self, commit_id):
+        ''' Iterate over the hex of the commits reachable from the parents
+        of ``commit_id`` most recent first, as a GIT_SORT_TIME walk started
+        at these parents would.
+        '''
+        index, (pos,) = self._snapshot([commit_id])
+        return self._walk(index, index.parents(pos))
+
+    @staticmethod
+    def _walk(index, starts):
+        ''' Generator doing the walks of the walk methods. '''
+        seen = set(starts)
+        heap = [(-index.time(pos), -pos) for pos in seen]
+        heapq.heapify(heap)
+        while heap:
+            _, pos = heapq.heappop(heap)
+            pos = -pos
+            yield index.hex(pos)
+            for parent in index.parents(pos):
+                if parent not in seen:
+                    seen.add(parent)
+                    heapq.heappush(heap, (-index.time(parent), -parent))
+
+    def ahead(self, commit_id, hidden):
+        ''' Return the list of hex of the commits reachable from
+        ``commit_id`` but from none of the ``hidden`` commits, most recent
+        first.
+        '''
+        hidden = list(hidden)
+        index, positions = self._snapshot([commit_id] + hidden)
+        positions = _ahead(index, positions[:1], positions[1:])
+        positions.sort(key=lambda pos: (index.time(pos), pos), reverse=True)
+        return [index.hex(pos) for pos in positions]
+
+
+def _ahead(index, starts, hidden):
+    ''' Return the positions of the provided _Index reachable from
+    ``starts`` but not from ``hidden``.
+
+    Commits are processed by decreasing generation so that a commit is
+    only visited once all of its children have been, the walk stops as
+    soon as every queued commit is known to be reachable from ``hidden``.
+    '''
+    flags = {}
+    for pos in starts:
+        flags[pos] = flags.get(pos, 0) | 1
+    for pos in hidden:
+        flags[pos] = flags.get(pos, 0) | 2
+
+    heap = [(-index.generation(pos), pos) for pos in flags]
+    heapq.heapify(heap)
+    interesting = sum(1 for flag in flags.values() if flag == 1)
+
+    output = []
+    while heap and interesting:
+        _, pos = heapq.heappop(heap)
+        flag = flags[pos]
+        if flag == 1:
+            interesting -= 1
+            output.append(pos)
+        for parent in index.parents(pos):
+            if parent not in flags:
+                flags[parent] = flag
+                heapq.heappush(heap, (-index.generation(parent), parent))
+                if flag == 1:
+                    interesting += 1
+            elif flags[parent] | flag != flags[parent]:
+                if flags[parent] == 1:
+                    interesting -= 1
+                flags[parent] |= flag
+    return output
+
+
+def get_commit_graph(repo_obj):
+    ''' Return the up to date CommitGraph of the provided repository.
+
+    CommitGraph objects are kept in memory per process, up to CACHE_SIZE
+    of them.
+
+    :return: the CommitGraph or None if the index could not be read or
+        written, in which case callers should fall back to walking the
+        repository.
+    '''
+    if repo_obj.is_empty:
+        return None
+
+    path = os.path.abspath(repo_obj.path)
+    with _CACHE_LOCK:
+        graph = _CACHE.pop(path, None)
+        if graph is None:
+            graph = CommitGraph(path)
+        _CACHE[path] = graph
+        while len(_CACHE) > CACHE_SIZE:
+            _CACHE.popitem(last=False)
+
+    try:
+        graph.update(repo_obj)
+    except (IOError, OSError, KeyError, pygit2.GitError):
+        return None
+    return graph
+
+
+def count_commits(repo_obj, commit_id, graph=None):
+    ''' Return the number of commits reachable from the specified commit.
+
+    The result only depends on the commit so it is kept in memory, keyed
+    by its hex, and the history is only counted once per tip. The count
+    is done on the CommitGraph when provided and by walking the
+    repository otherwise.
+    '''
+    commit_hex = _to_raw(commit_id).encode('hex')
+    with _CACHE_LOCK:
+        if commit_hex in _COUNTS:
+            _COUNTS[commit_hex] = _COUNTS.pop(commit_hex)
+            return _COUNTS[commit_hex]
+
+    if graph is not None and commit_id in graph:
+        count = graph.count(commit_id)
+    else:
+        count = 0
+        for _ in repo_obj.walk(commit_hex, pygit2.GIT_SORT_TIME):
+            count += 1
+
+    with _CACHE_LOCK:
+        _COUNTS[commit_hex] = count
+        while len(_COUNTS) > COUNT_CACHE_SIZE:
+            _COUNTS.popitem(last=False)
+    return count
+
+
+def _walk_after(repo_obj, after, graph=None):
+    ''' Return an iterator over the hex of the commits reachable from the
+    parents of the commit ``after``, a hex, most recent first.
+
+    :return: the iterator, or None if ``after`` is not a valid hex or not
+        a commit of the repository.
+    '''
+    try:
+        after = str(after)
+        pygit2.Oid(hex=after)
+    except (TypeError, ValueError):
+        return None
+    if graph is not None and after in graph:
+        return graph.walk_parents(after)
+
+    try:
+        commit = repo_obj[after]
+    except (KeyError, ValueError):
+        return None
+    if not isinstance(commit, pygit2.Commit):
+        return None
+    if not commit.parents:
+        return iter([])
+    walker = repo_obj.walk(commit.parents[0].oid, pygit2.GIT_SORT_TIME)
+    for parent in commit.parents[1:]:
+        walker.push(parent.oid)
+    return (commit.oid.hex for commit in walker)
+
+
+def get_log_page(repo_obj, commit_id, limit, start=0, after=None,
+                 graph=None):
+    ''' Return the list of pygit2.Commit of one page of the history of the
+    specified commit, most recent first.
+
+    :arg limit: the number of commits in the page.
+    :kwarg start: the number of commits to skip before the page.
+    :kwarg after: the hex of a commit, when specified the page is made
+        of the history of its parents and ``start`` is ignored. For the
+        ``after`` of the links to the next page, the last commit of a
+        page, this is the rest of the history. ``start`` is used if the
+        commit is not in the repository.
+    :kwarg graph: the CommitGraph of the repository, if provided the
+        commits skipped are found in the index and only the ones of the
+        page are looked up in the repository.
+
+    The walk stops as soon as the page is full.
+    '''
+    history = None
+    if after:
+        # Seek to the commit instead of walking the history up to it
+        history = _walk_after(repo_obj, after, graph)
+        if history is not None:
+            start = 0
+
+    if history is None and graph is not None and commit_id in graph:
+        history = graph.walk(commit_id)
+    elif history is None:
+        history = (
+            commit.oid.hex
+            for commit in repo_obj.walk(
+                _to_raw(commit_id).encode('hex'), pygit2.GIT_SORT_TIME)
+        )
+
+    return [
+        repo_obj[commit_hex]
+        for commit_hex in itertools.islice(history, start, start + limit)
+    ]
@@ -0,0 +1,272 @@
+#-*- coding: utf-8 -*-
+
+"""
+ (c) 2014 - Copyright Red Hat Inc
+
+ Authors:
+   Pierre-Yves Chibon <pingou@pingoured.fr>
+
+Full-text index of the files at the head of every branch of the git
+repositories, stored in a SQLite database using its FTS4 extension.
+
+The tree of each indexed branch head is recorded, a branch is only looked
+at again when its tree changed and only the blobs not indexed yet are
+read. Blobs are indexed once, no matter how many repos or branches hold
+them.
+
+"""
+
+import os
+import sqlite3
+
+import pygit2
+
+
+# Files larger than this, in bytes, are not indexed
+MAX_SIZE = 1024 * 1024
+
+# Maximum number of matching lines returned per file
+MAX_SNIPPETS = 3
+
+# File modes of the sub-trees and sub-modules in a git tree
+FILEMODE_TREE = 16384
+FILEMODE_COMMIT = 57344
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS heads (
+        repo TEXT NOT NULL,
+        branch TEXT NOT NULL,
+        tree TEXT NOT NULL,
+        PRIMARY KEY (repo, branch))''',
+    '''CREATE TABLE IF NOT EXISTS files (
+        repo TEXT NOT NULL,
+        branch TEXT NOT NULL,
+        path TEXT NOT NULL,
+        blob TEXT NOT NULL,
+        PRIMARY KEY (repo, branch, path))''',
+    '''CREATE INDEX IF NOT EXISTS files_blob ON files (blob)''',
+    '''CREATE TABLE IF NOT EXISTS blob_ids (
+        id INTEGER PRIMARY KEY,
+        oid TEXT NOT NULL UNIQUE,
+        indexed BOOLEAN NOT NULL)''',
+    '''CREATE VIRTUAL TABLE IF NOT EXISTS blobs USING fts4(content)''',
+]
+
+
+def _list_files(repo_obj, tree, prefix=''):
+    ''' Return a dict of the path of the files in the provided tree and
+    its sub-trees associated with the hex of their blob. '''
+    output = {}
+    for entry in tree:
+        if entry.filemode == FILEMODE_TREE:
+            output.update(_list_files(
+                repo_obj, repo_obj[entry.oid], prefix + entry.name + '/'))
+        elif entry.filemode != FILEMODE_COMMIT:
+            output[prefix + entry.name] = entry.hex
+    return output
+
+
+class ContentIndex(object):
+    ''' Full-text index of the content of the git repositories stored in
+    the SQLite database at ``path``. '''
+
+    def __init__(self, path):
+        self.path = path
+
+    def connect(self):
+        ''' Return a new connection to the database, creating its tables if
+        needed. '''
+        conn = sqlite3.connect(self.path, timeout=60)
+        for statement in SCHEMA:
+            conn.execute(statement)
+        return conn
+
+    ## Indexing
+
+    def _index_blob(self, conn, repo_obj, blob_hex):
+        ''' Add the content of the specified blob to the index if it is not
+        in it already. Binary and large blobs are recorded but their
+        content is not indexed. '''
+        row = conn.execute(
+            'SELECT id FROM blob_ids WHERE oid = ?', (blob_hex,)).fetchone()
+        if row:
+            return
+
+        blob = repo_obj[blob_hex]
+        indexed = blob.size <= MAX_SIZE and not blob.is_binary
+        cursor = conn.execute(
+            'INSERT INTO blob_ids (oid, indexed) VALUES (?, ?)',
+            (blob_hex, indexed))
+        if indexed:
+            conn.execute(
+                'INSERT INTO blobs (docid, content) VALUES (?, ?)',
+                (cursor.lastrowid, blob.data.decode('utf-8', 'replace')))
+
+    def update_repo(self, name, repo_obj):
+        ''' Bring the index up to date with the branch heads of the
+        provided repository, only looking at the branches whose tree
+        changed since the last update.
+
+        :return: the number of branches re-indexed.
+        '''
+        conn = self.connect()
+        try:
+            stored = dict(conn.execute(
+                'SELECT branch, tree FROM heads WHERE repo = ?', (name,)))
+
+            branches = []
+            if not repo_obj.is_empty:
+                branches = repo_obj.listall_branches()
+
+            updated = 0
+            for branchname in branches:
+                tree = repo_obj.lookup_branch(branchname).get_object().tree
+                if stored.get(branchname) == tree.hex:
+                    continue
+
+                files = _list_files(repo_obj, tree)
+                old_files = dict(conn.execute(
+                    'SELECT path, blob FROM files '
+                    'WHERE repo = ? AND branch = ?', (name, branchname)))
+
+                for path, blob_hex in old_files.items():
+                    if files.get(path) != blob_hex:
+                        conn.execute(
+                            'DELETE FROM files '
+                            'WHERE repo = ? AND branch = ? AND path = ?',
+                            (name, branchname, path))
+                for path, blob_hex in files.items():
+                    if old_files.get(path) != blob_hex:
+                        self._index_blob(conn, repo_obj, blob_hex)
+                        conn.execute(
+                            'INSERT INTO files (repo, branch, path, blob) '
+                            'VALUES (?, ?, ?, ?)',
+                            (name, branchname, path, blob_hex))
+
+                conn.execute(
+                    'INSERT OR REPLACE INTO heads (repo, branch, tree) '
+                    'VALUES (?, ?, ?)', (name, branchname, tree.hex))
+                updated += 1
+
+            for branchname in set(stored) - set(branches):
+                self._remove(conn, name, branchname)
+                updated += 1
+
+            conn.commit()
+        finally:
+            conn.close()
+        return updated
+
+    def _remove(self, conn, name, branchname=None):
+        ''' Remove a repo, or only one of its branches, from the index. '''
+        query = 'WHERE repo = ?'
+        args = [name]
+        if branchname is not None:
+            query += ' AND branch = ?'
+            args.append(branchname)
+        conn.execute('DELETE FROM heads ' + query, args)
+        conn.execute('DELETE FROM files ' + query, args)
+
+    def remove_repo(self, name):
+        ''' Remove every branch of the specified repo from the index. '''
+        conn = self.connect()
+        try:
+            self._remove(conn, name)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def prune(self):
+        ''' Remove from the index the blobs no file points to anymore. '''
+        conn = self.connect()
+        try:
+            orphans = (
+                'SELECT id FROM blob_ids WHERE oid NOT IN '
+                '(SELECT blob FROM files)')
+            conn.execute('DELETE FROM blobs WHERE docid IN (%s)' % orphans)
+            conn.execute('DELETE FROM blob_ids WHERE id IN (%s)' % orphans)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def refresh(self, gitfolder):
+        ''' Update the index with every git repository of the specified
+        folder and drop the repositories that no longer exist.
+
+        :return: the number of branches re-indexed.
+        '''
+        names = set()
+        updated = 0
+        for entry in sorted(os.listdir(gitfolder)):
+            if not entry.endswith('.git'):
+                continue
+            name = entry[:-len('.git')]
+            names.add(name)
+            repo_obj = pygit2.Repository(os.path.join(gitfolder, entry))
+            updated += self.update_repo(name, repo_obj)
+
+        conn = self.connect()
+        try:
+            indexed = set(
+                row[0]
+                for row in conn.execute('SELECT DISTINCT repo FROM heads'))
+        finally:
+            conn.close()
+        for name in indexed - names:
+            self.remove_repo(name)
+
+        self.prune()
+        return updated
+
+    ## Searching
+
+    def search(self, term, limit=200):
+        ''' Return the files, at the head of the branches, containing the
+        provided text.
+
+        :return: a list of dict with the keys: repo, branch, path and
+            snippets, a list of (line number, line) of the matching lines.
+        '''
+        term = term.strip()
+        if not term:
+            return []
+
+        conn = self.connect()
+        try:
+            rows = conn.execute(
+                'SELECT blob_ids.oid, blobs.content FROM blobs '
+                'JOIN blob_ids ON blob_ids.id = blobs.docid '
+                'WHERE blobs.content MATCH ? LIMIT ?',
+                ('"%s"' % term.replace('"', '""'), limit)).fetchall()
+
+            output = []
+            for blob_hex, content in rows:
+                snippets = self._snippets(content, term)
+                for repo, branch, path in conn.execute(
+                        'SELECT repo, branch, path FROM files '
+                        'WHERE blob = ?', (blob_hex,)):
+                    output.append({
+                        'repo': repo,
+                        'branch': branch,
+                        'path': path,
+                        'snippets': snippets,
+                    })
+        finally:
+            conn.close()
+
+        output.sort(
+            key=lambda item: (item['repo'], item['branch'], item['path']))
+        return output[:limit]
+
+    @staticmethod
+    def _snippets(content, term):
+        ''' Return the first (line number, line) of the content containing
+        the term, case-insensitively. '''
+        term = term.lower()
+        output = []
+        for cnt, line in enumerate(content.split('\n'), 1):
+            if term in line.lower():
+                output.append((cnt, line))
+                if len(output) == MAX_SNIPPETS:
+                    break
+        return output
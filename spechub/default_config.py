@@ -21,6 +21,12 @@ SECRET_KEY = '<insert here your own key>'
 # url to the database server:
 DB_URL = 'sqlite:////var/tmp/spechub.sqlite'
 
+# Path to the SQLite database holding the full-text index of the content
+# of the git repositories, None to disable searching their content. Run
+# update_content_index.py once after setting it to build the index, the
+# merges then only index the branches they changed.
+CONTENT_INDEX_PATH = None
+
 # The FAS group in which the admin of spechub are
 ADMIN_GROUP = 'sysadmin-main'
 
@@ -51,3 +57,117 @@ FORK_FOLDER = os.path.join(
     '..',
     'forks'
 )
+
+# Create the forks as repositories borrowing the objects of their parent
+# (git alternates) instead of full clones. gc.pruneExpire is set to never
+# in the parents, run detach_forks.py on a project before deleting it or
+# pruning its git repository. The forks borrowing from a fork deleted in
+# the admin page are detached automatically.
+FORK_SHARED_OBJECTS = False
+
+# Maintain a commit-graph index (parents, generation numbers and commit
+# times) in each git repo to answer history queries without walking it
+COMMIT_GRAPH = True
+
+# Number of idle git repositories kept open per process for reuse by the
+# next requests
+REPO_POOL_SIZE = 256
+
+# Number of commits whose date, author and summary are kept in memory per
+# process to present the last activity of the repositories
+HEAD_CACHE_SIZE = 4096
+
+# Maximum number of characters of highlighted code kept in memory per
+# process
+HIGHLIGHT_CACHE_SIZE = 64 * 1024 * 1024
+
+# Folder, possibly shared between hosts, in which highlighted code is
+# stored, None to only keep it in memory
+HIGHLIGHT_CACHE_FOLDER = None
+
+# Maximum number of bytes of highlighted code stored in the folder, the least
+# recently used are removed beyond it. None for no limit.
+HIGHLIGHT_CACHE_FOLDER_SIZE = 1024 * 1024 * 1024
+
+# Files larger than this number of bytes are not highlighted in full, only
+# their first PREVIEW_SIZE bytes are shown with a link to the raw file
+MAX_HIGHLIGHT_SIZE = 512 * 1024
+PREVIEW_SIZE = 64 * 1024
+
+# Number of bytes sent at once when streaming the raw content of a file
+RAW_CHUNK_SIZE = 64 * 1024
+
+# Number of seconds the pages addressed by a commit id, whose content never
+# changes, may be cached by the browsers and proxies. Their rendering
+# changes with the deployed version, which is part of their ETag.
+IMMUTABLE_MAX_AGE = 3600
+
+# Identifier of the deployed version of spechub, for example the commit
+# deployed, changing the ETags of the pages. If None, it is derived from
+# the version and the time the templates were last changed.
+BUILD_ID = None
+
+# Maximum number of characters of highlighted diffs kept in memory per
+# process
+DIFF_CACHE_SIZE = 64 * 1024 * 1024
+
+# Folder, possibly shared between hosts, in which highlighted diffs are
+# stored, None to only keep them in memory
+DIFF_CACHE_FOLDER = None
+
+# Maximum number of bytes of highlighted diffs stored in the folder, the least
+# recently used are removed beyond it. None for no limit.
+DIFF_CACHE_FOLDER_SIZE = 1024 * 1024 * 1024
+
+# Maximum number of characters of rendered README and rst documents kept
+# in memory per process
+DOC_CACHE_SIZE = 16 * 1024 * 1024
+
+# Folder, possibly shared between hosts, in which rendered documents are
+# stored, None to only keep them in memory
+DOC_CACHE_FOLDER = None
+
+# Maximum number of bytes of rendered documents stored in the folder, the least
+# recently used are removed beyond it. None for no limit.
+DOC_CACHE_FOLDER_SIZE = 1024 * 1024 * 1024
+
+# Number of commits of a pull-request whose diff is sent with the page,
+# the diffs of the other commits are loaded when the user reaches them
+PULL_REQUEST_DIFFS = 10
+
+# Minimum number of seconds between two checks of the GIT_FOLDER for new
+# or deleted repositories
+REPO_REGISTRY_CHECK_INTERVAL = 5
+
+# Run the forks and merges in the background with the workers started by
+# runworker.py, if False they are run within the web request
+JOBS_ASYNC = False
+
+# Number of worker processes started by runworker.py
+JOB_WORKERS = 2
+
+# Number of seconds an idle worker waits before checking for new jobs
+JOB_POLL_INTERVAL = 1
+
+# Number of seconds after which a job still running is considered
+# abandoned by its worker: it is marked as failed and the jobs waiting for
+# it are run
+JOB_STALE_TIMEOUT = 3600
+
+# Number of seconds a job run within the web request, when JOBS_ASYNC is
+# False, waits for the jobs on the same repo to be over before giving up
+JOB_LOCK_TIMEOUT = 30
+
+# Count and time the database queries, git operations and rendering of
+# each request, sent to the admins in a Server-Timing header and aggregated
+# per route at /admin/metrics
+METRICS = True
+
+# Send the Server-Timing header to every user, not only to the admins
+SERVER_TIMING = False
+
+# Import the renderers (pygments, docutils, markdown) and the OpenID
+# libraries of the FAS authentication when the application is imported,
+# instead of on first use, to warm a WSGI master process before it forks
+# its workers
+PRELOAD = False
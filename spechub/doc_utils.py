@@ -9,10 +9,32 @@
 
 """
 
+import hashlib
+
+# docutils.core and markdown are slow to import, they are imported on
+# first use, see preload
 import docutils
-import docutils.core
 import markupsafe
-import markdown
+
+from spechub.metrics import timed, DOCS
+
+
+def renderer_version(renderer):
+    """ Return the version of the specified renderer, part of the keys of
+    the rendered documents in the cache so that upgrading a renderer does
+    not serve stale documents. """
+    if renderer == 'rst':
+        return docutils.__version__
+    elif renderer == 'markdown':
+        import markdown
+        return getattr(markdown, 'version', None)
+
+
+def preload():
+    """ Import and warm up the renderers, which are otherwise imported on
+    first use. """
+    _convert_doc(u'preload')
+    _convert_markdown('preload')
 
 
 def modify_rst(rst):
@@ -58,8 +80,20 @@ def modify_html(html):
     return html
 
 
-def convert_doc(rst_string):
-    """ Utility to load an RST file and turn it into fancy HTML. """
+def _render_key(renderer, content, oid=None):
+    """ Return the key of the rendering of the provided content in the
+    render cache, the oid of its blob if it is known or its sha1. """
+    if oid is None:
+        if isinstance(content, unicode):
+            content = content.encode('utf-8')
+        oid = hashlib.sha1(content).hexdigest()
+    return ('doc', renderer, renderer_version(renderer), oid)
+
+
+@timed(DOCS)
+def _convert_doc(rst_string):
+    """ Render the provided rst text as HTML. """
+    import docutils.core
     rst = modify_rst(rst_string)
 
     overrides = {'report_level': 'quiet'}
@@ -72,17 +106,49 @@ def convert_doc(rst_string):
 
     html_string = modify_html(html_string)
 
+    return html_string
+
+
+@timed(DOCS)
+def _convert_markdown(content):
+    """ Render the provided markdown text as HTML. """
+    import markdown
+    return markdown.markdown(content)
+
+
+def convert_doc(rst_string, cache=None, oid=None):
+    """ Utility to load an RST file and turn it into fancy HTML.
+
+    :kwarg cache: a spechub.cache.TieredCache in which the HTML is kept,
+        keyed by the oid of the blob holding the text, if provided, or by
+        the sha1 of the text.
+    """
+    if cache is None:
+        html_string = _convert_doc(rst_string)
+    else:
+        html_string = cache.get_or_set(
+            _render_key('rst', rst_string, oid), _convert_doc, rst_string)
+
     html_string = markupsafe.Markup(html_string)
     return html_string
 
 
-def convert_readme(content, ext):
+def convert_readme(content, ext, cache=None, oid=None):
     ''' Convert the provided content according to the extension of the file
     provided.
+
+    :kwarg cache: a spechub.cache.TieredCache in which the output is kept,
+        see ``convert_doc``.
+    :kwarg oid: the hex of the blob holding the content.
     '''
     output = content
     if ext and ext in ['.rst']:
-        output = convert_doc(unicode(content))
+        output = convert_doc(unicode(content), cache=cache, oid=oid)
     elif ext and ext in ['.mk']:
-        output = markdown.markdown(content)
+        if cache is None:
+            output = _convert_markdown(content)
+        else:
+            output = cache.get_or_set(
+                _render_key('markdown', content, oid),
+                _convert_markdown, content)
     return output
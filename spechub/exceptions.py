@@ -28,3 +28,10 @@ class FileNotFoundException(SpecHubException):
     exists.
     '''
     pass
+
+
+class MergeConflictException(SpecHubException):
+    ''' Exception thrown when the changes of a pull-request do not merge
+    cleanly.
+    '''
+    pass
@@ -35,16 +35,18 @@ try:
 except ImportError:
     from flask import _request_ctx_stack as stack
 
-import openid
-from openid.consumer import consumer
-from openid.fetchers import setDefaultFetcher, Urllib2Fetcher
-from openid.extensions import pape, sreg
-from openid_cla import cla
-from openid_teams import teams
-
 from fedora import __version__
 
 
+def preload():
+    """ Import the OpenID libraries, which are otherwise imported when the
+    first login is handled as they are slow to import. """
+    from openid.consumer import consumer
+    from openid.extensions import pape, sreg
+    from openid_cla import cla
+    from openid_teams import teams
+
+
 class FASJSONEncoder(flask.json.JSONEncoder):
     """ Dedicated JSON encoder for the FAS openid information. """
 
@@ -96,6 +98,7 @@ class FAS(object):
         app.config.setdefault('FAS_OPENID_CHECK_CERT', True)
 
         if not self.app.config['FAS_OPENID_CHECK_CERT']:
+            from openid.fetchers import setDefaultFetcher, Urllib2Fetcher
             setDefaultFetcher(Urllib2Fetcher())
 
         @app.route('/_flask_fas_openid_handler/', methods=['GET', 'POST'])
@@ -112,6 +115,11 @@ class FAS(object):
         return f
 
     def _handle_openid_request(self):
+        from openid.consumer import consumer
+        from openid.extensions import pape, sreg
+        from openid_cla import cla
+        from openid_teams import teams
+
         return_url = flask.session.get('FLASK_FAS_OPENID_RETURN_URL', None)
         cancel_url = flask.session.get('FLASK_FAS_OPENID_CANCEL_URL', None)
         base_url = self.normalize_url(flask.request.base_url)
@@ -191,6 +199,11 @@ class FAS(object):
         """
         if return_url is None and return_func is None:
             return_url = flask.request.args.get('next', flask.request.url)
+        from openid.consumer import consumer
+        from openid.extensions import pape, sreg
+        from openid_cla import cla
+        from openid_teams import teams
+
         session = {}
         oidconsumer = consumer.Consumer(session, None)
         try:
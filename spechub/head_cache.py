@@ -0,0 +1,131 @@
+#-*- coding: utf-8 -*-
+
+"""
+ (c) 2014 - Copyright Red Hat Inc
+
+ Authors:
+   Pierre-Yves Chibon <pingou@pingoured.fr>
+
+"""
+
+import collections
+import os
+import threading
+
+import pygit2
+
+from spechub.commit_graph import refs_stamp
+
+
+HeadInfo = collections.namedtuple(
+    'HeadInfo', ['oid', 'commit_time', 'author', 'summary'])
+
+
+def _read_ref(path, refname):
+    ''' Return the content of the specified ref of the git repository at
+    ``path``, looking at its loose file then at the packed-refs file. '''
+    try:
+        with open(os.path.join(path, refname)) as stream:
+            return stream.read().strip()
+    except IOError:
+        pass
+
+    try:
+        with open(os.path.join(path, 'packed-refs')) as stream:
+            for line in stream:
+                if line.startswith(('#', '^')):
+                    continue
+                parts = line.split()
+                if len(parts) == 2 and parts[1] == refname:
+                    return parts[0]
+    except IOError:
+        pass
+    return None
+
+
+def read_head_target(path):
+    ''' Return the hex of the commit the HEAD of the git repository at
+    ``path`` points to, or None if it points to a branch that does not
+    exist, as in an empty repository.
+
+    The ref files are read directly, without opening the repository.
+    '''
+    target = _read_ref(path, 'HEAD')
+    # Follow the symbolic refs, a few levels at most
+    for _ in range(5):
+        if not target or not target.startswith('ref:'):
+            break
+        target = _read_ref(path, target[len('ref:'):].strip())
+    if not target or len(target) != 40:
+        return None
+    return target
+
+
+class HeadCache(object):
+    ''' Cache of the metadata of the HEAD commit of git repositories.
+
+    The HEAD target of a repository is only read again when its refs
+    changed on disk, see spechub.commit_graph.refs_stamp, and the metadata
+    of a commit, which never changes, is kept in a bounded LRU keyed by
+    its hex. Repositories are only opened to read commits not in the
+    cache.
+    '''
+
+    def __init__(self, size=4096):
+        self.size = size
+        self.lock = threading.Lock()
+        # path -> (refs stamp, HEAD target)
+        self._targets = {}
+        # commit hex -> HeadInfo, least recently used first
+        self._infos = collections.OrderedDict()
+
+    def get(self, path, repo_obj=None):
+        ''' Return the HeadInfo of the HEAD commit of the git repository at
+        ``path``, or None if the repository is empty.
+
+        :kwarg repo_obj: the pygit2.Repository of the git repository, if
+            it is already opened.
+        '''
+        path = os.path.abspath(path)
+        stamp = refs_stamp(path)
+        with self.lock:
+            entry = self._targets.get(path)
+        if entry is not None and entry[0] == stamp:
+            target = entry[1]
+        else:
+            target = read_head_target(path)
+            with self.lock:
+                self._targets[path] = (stamp, target)
+
+        if target is None:
+            return None
+
+        with self.lock:
+            info = self._infos.pop(target, None)
+            if info is not None:
+                self._infos[target] = info
+                return info
+
+        if repo_obj is None:
+            repo_obj = pygit2.Repository(path)
+        try:
+            commit = repo_obj[target]
+        except (KeyError, ValueError):
+            return None
+        info = HeadInfo(
+            oid=target,
+            commit_time=commit.commit_time,
+            author=commit.author.name,
+            summary=commit.message.split('\n', 1)[0],
+        )
+
+        with self.lock:
+            self._infos[target] = info
+            while len(self._infos) > self.size:
+                self._infos.popitem(last=False)
+        return info
+
+    def invalidate(self, path):
+        ''' Forget the HEAD target of the git repository at ``path``. '''
+        with self.lock:
+            self._targets.pop(os.path.abspath(path), None)
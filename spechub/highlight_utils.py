@@ -0,0 +1,212 @@
+#-*- coding: utf-8 -*-
+
+"""
+ (c) 2014 - Copyright Red Hat Inc
+
+ Authors:
+   Pierre-Yves Chibon <pingou@pingoured.fr>
+
+"""
+
+import collections
+import fnmatch
+import os
+import threading
+
+import spechub.blobs
+from spechub.metrics import timed, HIGHLIGHT
+
+
+# Options of the HtmlFormatter used to render code
+FORMATTER_OPTIONS = {
+    'noclasses': True,
+    'style': 'tango',
+}
+
+# Lexers of the files commonly found in the package repositories, by
+# filename pattern, checked before the lexers known to pygments
+FILENAME_LEXERS = [
+    ('*.spec', 'spec'),
+    ('*.patch', 'diff'),
+    ('*.diff', 'diff'),
+    ('Makefile', 'make'),
+    ('GNUmakefile', 'make'),
+    ('*.mk', 'make'),
+    ('*.sh', 'bash'),
+    ('*.bash', 'bash'),
+    ('sources', 'text'),
+]
+
+# Number of bytes of a file looked at to guess its lexer when its name
+# does not tell it
+GUESS_SIZE = 4096
+
+# Number of filenames whose lexer is kept in memory
+LEXER_CACHE_SIZE = 1024
+
+_LEXER_LOCK = threading.Lock()
+# filename -> lexer instance or None if it has to be guessed
+_LEXERS = collections.OrderedDict()
+
+
+def _filename_lexer(filename):
+    ''' Return the lexer of the specified file according to its name, or
+    None if the name does not tell it. '''
+    from pygments.lexers import get_lexer_by_name, get_lexer_for_filename
+    from pygments.util import ClassNotFound
+
+    for pattern, alias in FILENAME_LEXERS:
+        if fnmatch.fnmatch(filename, pattern):
+            try:
+                return get_lexer_by_name(alias)
+            except ClassNotFound:
+                break
+    try:
+        return get_lexer_for_filename(filename)
+    except ClassNotFound:
+        return None
+
+
+def get_lexer(filename):
+    ''' Return the lexer of the specified file according to its name, or
+    None if the name does not tell it.
+
+    The lexers are resolved once per filename, the instances are reused.
+    '''
+    filename = os.path.basename(filename)
+    with _LEXER_LOCK:
+        if filename in _LEXERS:
+            lexer = _LEXERS.pop(filename)
+            _LEXERS[filename] = lexer
+            return lexer
+
+    lexer = _filename_lexer(filename)
+    with _LEXER_LOCK:
+        _LEXERS[filename] = lexer
+        while len(_LEXERS) > LEXER_CACHE_SIZE:
+            _LEXERS.popitem(last=False)
+    return lexer
+
+
+def guess_lexer(data):
+    ''' Return the lexer guessed from the start of the provided content,
+    the text lexer if none fits. '''
+    from pygments.lexers import guess_lexer as pygments_guess_lexer
+    from pygments.lexers.special import TextLexer
+    from pygments.util import ClassNotFound
+
+    try:
+        return pygments_guess_lexer(data[:GUESS_SIZE])
+    except ClassNotFound:
+        return TextLexer()
+
+
+def preload():
+    ''' Import pygments and the lexers and formatter used, which are
+    otherwise imported on first use. '''
+    from pygments.lexers.text import DiffLexer
+    from pygments.formatters import HtmlFormatter
+    # Guessing imports every lexer
+    guess_lexer('#!/bin/sh\n')
+    for pattern, _ in FILENAME_LEXERS:
+        get_lexer(pattern.replace('*', 'preload'))
+    DiffLexer()
+    HtmlFormatter(**FORMATTER_OPTIONS)
+
+
+def formatter_key(options=None):
+    ''' Return a hashable representation of the formatter options. '''
+    options = options or FORMATTER_OPTIONS
+    return tuple(sorted(options.items()))
+
+
+def highlight_blob(blob, cache=None, options=None, filename=None,
+                   size=None, repo_path=None):
+    ''' Return the provided pygit2.Blob highlighted as HTML.
+
+    The lexer is chosen from the filename if it tells it, see
+    ``get_lexer``, and guessed from the start of the content otherwise.
+
+    If ``size`` is provided and the blob is larger, only its first ``size``
+    bytes, up to the last complete line, are highlighted. They are read
+    from the git repository at ``repo_path``, which must then be provided,
+    without loading the whole blob.
+
+    The content of a blob never changes so the output is stored in the
+    provided spechub.cache.TieredCache keyed by the oid of the blob, the
+    lexer and the formatter options.
+    '''
+    options = options or FORMATTER_OPTIONS
+    truncated = size is not None and blob.size > size
+    lexer = None
+    if filename:
+        lexer = get_lexer(filename)
+
+    def _highlight():
+        from pygments import highlight
+        from pygments.formatters import HtmlFormatter
+        if truncated:
+            data = spechub.blobs.read_blob(repo_path, blob.oid.hex, size)
+            if '\n' in data:
+                data = data[:data.rindex('\n') + 1]
+        else:
+            data = blob.data
+        # Reading the blob is git work, only pygments is timed here
+        with timed(HIGHLIGHT):
+            return highlight(
+                data,
+                lexer or guess_lexer(data),
+                HtmlFormatter(**options)
+            )
+
+    if cache is None:
+        return _highlight()
+
+    lexer_key = 'guess'
+    if lexer is not None:
+        lexer_key = lexer.aliases[0] if lexer.aliases else lexer.name
+    key = ('blob', blob.oid.hex, lexer_key, formatter_key(options))
+    if truncated:
+        key += ('preview', size)
+    return cache.get_or_set(key, _highlight)
+
+
+def highlight_diff(repo_obj, commit, cache=None, options=None):
+    ''' Return the diff introduced by the provided pygit2.Commit, against
+    its first parent, highlighted as HTML.
+
+    A (parent, commit) pair never changes so the output is stored in the
+    provided spechub.cache.TieredCache keyed by their oids and the
+    formatter options. On a cache hit, neither the diff nor its
+    highlighting are computed.
+    '''
+    options = options or FORMATTER_OPTIONS
+    parent = None
+    if commit.parents:
+        parent = commit.parents[0]
+
+    def _highlight():
+        from pygments import highlight
+        from pygments.lexers.text import DiffLexer
+        from pygments.formatters import HtmlFormatter
+        if parent is not None:
+            diff = repo_obj.diff(parent, commit)
+        else:
+            # First commit in the repo
+            diff = commit.tree.diff_to_tree(swap=True)
+        patch = diff.patch
+        # The diff is git work, only pygments is timed here
+        with timed(HIGHLIGHT):
+            return highlight(
+                patch,
+                DiffLexer(),
+                HtmlFormatter(**options)
+            )
+
+    if cache is None:
+        return _highlight()
+
+    key = (
+        'diff', parent.oid.hex if parent else None, commit.oid.hex,
+        formatter_key(options))
+    return cache.get_or_set(key, _highlight)
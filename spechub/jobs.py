@@ -0,0 +1,404 @@
+#-*- coding: utf-8 -*-
+
+"""
+ (c) 2014 - Copyright Red Hat Inc
+
+ Authors:
+   Pierre-Yves Chibon <pingou@pingoured.fr>
+
+Run the long git operations (forks, merges...) out of the web requests.
+
+Jobs are stored in the ``jobs`` table and run by worker processes, see
+``runworker.py``. Jobs sharing a lock key, for example the merges into a
+given repo, are run one after the other, in the order they were created.
+
+"""
+
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+
+import pygit2
+import sqlalchemy as sa
+from sqlalchemy.exc import SQLAlchemyError
+
+import spechub.content_index
+import spechub.exceptions
+import spechub.lib
+from spechub import model
+
+
+LOG = logging.getLogger('spechub.jobs')
+
+# Number of seconds after which a running job is considered abandoned by
+# its worker, see JOB_STALE_TIMEOUT
+STALE_TIMEOUT = 3600
+
+# Number of seconds a job run within the web request waits for the jobs
+# sharing its lock key, see JOB_LOCK_TIMEOUT
+LOCK_TIMEOUT = 30
+
+HANDLERS = {}
+
+
+def job_handler(kind):
+    ''' Decorator registering the decorated function as the handler of the
+    jobs of the specified kind.
+
+    Handlers are called with the session, the configuration of the
+    application, a callable to report their progress and the arguments of
+    the job as keyword arguments. They return a message describing their
+    outcome and raise a SpecHubException on failure.
+    '''
+    def decorator(function):
+        HANDLERS[kind] = function
+        return function
+    return decorator
+
+
+@job_handler('fork')
+def fork_job(session, config, progress, username, repo):
+    ''' Fork a project into the namespace of a user. '''
+    progress(10, 'Cloning %s' % repo)
+    message = spechub.lib.fork_project(
+        session=session,
+        repo=repo,
+        gitfolder=config['GIT_FOLDER'],
+        forkfolder=config['FORK_FOLDER'],
+        username=username,
+        shared=config.get('FORK_SHARED_OBJECTS', False))
+    session.commit()
+    return message
+
+
+@job_handler('merge')
+def merge_job(session, config, progress, requestid):
+    ''' Merge a pull-request into its project. '''
+    request = spechub.lib.get_pull_request(session, requestid=requestid)
+    if not request:
+        raise spechub.exceptions.SpecHubException(
+            'Pull-request #%s not found' % requestid)
+
+    message = spechub.lib.merge_pull_request(
+        session, request, config['GIT_FOLDER'], config['FORK_FOLDER'],
+        progress=progress)
+    session.commit()
+
+    if config.get('CONTENT_INDEX_PATH'):
+        progress(90, 'Indexing the content of %s' % request.repo.name)
+        try:
+            spechub.content_index.ContentIndex(
+                config['CONTENT_INDEX_PATH']).update_repo(
+                    request.repo.name,
+                    pygit2.Repository(os.path.join(
+                        config['GIT_FOLDER'], request.repo.path)))
+        except sqlite3.Error, err:  # pragma: no cover
+            LOG.exception(err)
+    return message
+
+
+@job_handler('reap_trash')
+def reap_trash_job(session, config, progress):
+    ''' Remove the git repos of the deleted forks. '''
+    cnt = spechub.lib.reap_trash(config['FORK_FOLDER'])
+    return '%s git repos removed' % cnt
+
+
+def reap_trash_later(session, config):
+    ''' Remove the git repos of the deleted forks out of the current
+    request: by a worker if JOBS_ASYNC is set, by a thread otherwise. '''
+    if config.get('JOBS_ASYNC', False):
+        return submit(session, config, 'reap_trash', lock_key='trash')
+
+    thread = threading.Thread(
+        target=spechub.lib.reap_trash, args=(config['FORK_FOLDER'],))
+    thread.daemon = True
+    thread.start()
+
+
+def submit(session, config, kind, lock_key, user=None, url=None, **kwargs):
+    ''' Create a job of the specified kind with the provided arguments.
+
+    If the JOBS_ASYNC configuration key is set, the job is left for the
+    workers, otherwise it is run right away, once the jobs created before
+    it with the same lock key are over. If they are not over after
+    JOB_LOCK_TIMEOUT seconds, the job is marked as failed.
+
+    :arg lock_key: the jobs sharing this key are run one at a time.
+    :kwarg user: the username of the user requesting the job.
+    :kwarg url: the URL showing the outcome of the job once done.
+    :return: the Job created.
+    '''
+    if kind not in HANDLERS:
+        raise spechub.exceptions.SpecHubException(
+            'Unknown job type: %s' % kind)
+
+    user_id = None
+    if user:
+        user_id = model.User.get_or_create(session, user).id
+
+    job = model.Job(
+        kind=kind,
+        lock_key=lock_key,
+        arguments=json.dumps(kwargs),
+        user_id=user_id,
+        url=url,
+    )
+    session.add(job)
+    session.commit()
+
+    if not config.get('JOBS_ASYNC', False):
+        if wait_for_lock(
+                session, job,
+                config.get('JOB_LOCK_TIMEOUT', LOCK_TIMEOUT),
+                config.get('JOB_STALE_TIMEOUT', STALE_TIMEOUT)):
+            if claim_job(session, job):
+                run_job(session, config, job)
+        else:
+            job.status = 'failed'
+            job.message = 'Another operation is in progress on %s, ' \
+                'please try again later' % lock_key
+            job.date_finished = datetime.datetime.utcnow()
+            session.add(job)
+            session.commit()
+    return job
+
+
+def wait_for_lock(session, job, timeout, stale_timeout=STALE_TIMEOUT):
+    ''' Wait for the jobs created before the specified one with the same
+    lock key to be over, ignoring the ones created or started more than
+    ``stale_timeout`` seconds ago, whose web request or worker died.
+
+    :return: whether they are over, False if they are still queued or
+        running after ``timeout`` seconds.
+    '''
+    deadline = time.time() + timeout
+    while True:
+        # End the transaction to see the changes made by the other jobs
+        session.commit()
+        blocking = session.query(
+            model.Job.id
+        ).filter(
+            model.Job.lock_key == job.lock_key
+        ).filter(
+            model.Job.id < job.id
+        ).filter(
+            _pending(stale_timeout)
+        ).filter(
+            model.Job.date_created >= _stale_date(stale_timeout)
+        ).first()
+        if blocking is None:
+            return True
+        if time.time() >= deadline:
+            return False
+        time.sleep(0.5)
+
+
+def get_job(session, jobid):
+    ''' Retrieve the specified job. '''
+    return session.query(model.Job).filter(model.Job.id == jobid).first()
+
+
+def _stale_date(stale_timeout):
+    ''' Return the date before which a running job is stale. '''
+    return datetime.datetime.utcnow() - datetime.timedelta(
+        seconds=stale_timeout)
+
+
+def _pending(stale_timeout):
+    ''' Return the filter of the jobs queued or running, ignoring the ones
+    running for more than ``stale_timeout`` seconds. '''
+    return sa.or_(
+        model.Job.status == 'queued',
+        sa.and_(
+            model.Job.status == 'running',
+            model.Job.date_started >= _stale_date(stale_timeout),
+        ),
+    )
+
+
+def get_pending_job(session, kind, lock_key, stale_timeout=STALE_TIMEOUT):
+    ''' Retrieve the queued or running job of the specified kind and lock
+    key, if any, ignoring the jobs running for more than ``stale_timeout``
+    seconds. '''
+    return session.query(
+        model.Job
+    ).filter(
+        model.Job.kind == kind
+    ).filter(
+        model.Job.lock_key == lock_key
+    ).filter(
+        _pending(stale_timeout)
+    ).order_by(
+        model.Job.id
+    ).first()
+
+
+def claim_job(session, job):
+    ''' Mark the specified job as running if it is still queued.
+
+    :return: whether the job was claimed, if not another worker has it.
+    '''
+    claimed = session.query(
+        model.Job
+    ).filter(
+        model.Job.id == job.id
+    ).filter(
+        model.Job.status == 'queued'
+    ).update(
+        {
+            'status': 'running',
+            'date_started': datetime.datetime.utcnow(),
+        },
+        synchronize_session=False)
+    session.commit()
+    session.refresh(job)
+    return claimed == 1
+
+
+def fail_stale_jobs(session, stale_timeout=STALE_TIMEOUT):
+    ''' Mark as failed the jobs running for more than ``stale_timeout``
+    seconds, their worker having most likely died, so that the jobs
+    sharing their lock key can run.
+
+    :return: the number of jobs marked as failed.
+    '''
+    failed = session.query(
+        model.Job
+    ).filter(
+        model.Job.status == 'running'
+    ).filter(
+        model.Job.date_started < _stale_date(stale_timeout)
+    ).update(
+        {
+            'status': 'failed',
+            'message': 'The job did not finish in time, its worker stopped',
+            'date_finished': datetime.datetime.utcnow(),
+        },
+        synchronize_session=False)
+    session.commit()
+    if failed:
+        LOG.warning('%s stale jobs marked as failed', failed)
+    return failed
+
+
+def next_job(session, stale_timeout=STALE_TIMEOUT):
+    ''' Claim the next job to run.
+
+    Only the oldest queued job of each lock key is considered, and only if
+    no job with that key is running. The stale running jobs are marked as
+    failed first, see ``fail_stale_jobs``.
+
+    :return: the Job claimed or None if there is nothing to run.
+    '''
+    fail_stale_jobs(session, stale_timeout)
+    running = session.query(
+        model.Job.lock_key
+    ).filter(
+        model.Job.status == 'running'
+    )
+    oldest = session.query(
+        sa.func.min(model.Job.id)
+    ).filter(
+        model.Job.status == 'queued'
+    ).group_by(
+        model.Job.lock_key
+    )
+    candidates = session.query(
+        model.Job
+    ).filter(
+        model.Job.id.in_(oldest)
+    ).filter(
+        ~model.Job.lock_key.in_(running)
+    ).order_by(
+        model.Job.id
+    ).limit(10).all()
+
+    for job in candidates:
+        if claim_job(session, job):
+            return job
+    return None
+
+
+def run_job(session, config, job):
+    ''' Run the specified job, which must have been claimed, and record its
+    outcome. '''
+
+    def progress(percent, message=None):
+        ''' Report the progress of the job. '''
+        job.progress = percent
+        if message:
+            job.message = message
+        session.add(job)
+        session.commit()
+
+    handler = HANDLERS[job.kind]
+    try:
+        message = handler(
+            session, config, progress, **json.loads(job.arguments))
+        job.status = 'done'
+        job.progress = 100
+    except spechub.exceptions.SpecHubException, err:
+        session.rollback()
+        message = str(err)
+        job.status = 'failed'
+    except Exception, err:  # pylint: disable=W0703
+        session.rollback()
+        LOG.exception('Job %s failed', job.id)
+        message = 'Internal error: %s' % err
+        job.status = 'failed'
+
+    job.message = message
+    job.date_finished = datetime.datetime.utcnow()
+    session.add(job)
+    session.commit()
+    return job
+
+
+def work(config, poll_interval=1, max_jobs=None):
+    ''' Run the queued jobs, waiting for new ones when there is none.
+
+    :kwarg max_jobs: stop after having run this many jobs.
+    '''
+    session = spechub.lib.create_session(config['DB_URL'])
+    stale_timeout = config.get('JOB_STALE_TIMEOUT', STALE_TIMEOUT)
+    done = 0
+    while max_jobs is None or done < max_jobs:
+        try:
+            job = next_job(session, stale_timeout)
+        except SQLAlchemyError, err:  # pragma: no cover
+            LOG.exception(err)
+            session.rollback()
+            job = None
+
+        if job is None:
+            session.remove()
+            time.sleep(poll_interval)
+            continue
+
+        LOG.info('Running job %s: %s', job.id, job.kind)
+        run_job(session, config, job)
+        done += 1
+        session.remove()
+
+
+def run_workers(config, workers=None, poll_interval=None):
+    ''' Start the specified number of worker processes and wait for them.
+    '''
+    workers = workers or config.get('JOB_WORKERS', 2)
+    poll_interval = poll_interval or config.get('JOB_POLL_INTERVAL', 1)
+
+    processes = []
+    for _ in range(workers):
+        process = multiprocessing.Process(
+            target=work, args=(dict(config), poll_interval))
+        process.start()
+        processes.append(process)
+
+    for process in processes:
+        process.join()
@@ -17,14 +17,20 @@ import uuid
 
 import sqlalchemy
 from datetime import timedelta
+from sqlalchemy.orm import contains_eager
+from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import joinedload_all
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm import scoped_session
+from sqlalchemy.orm import undefer
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.exc import SQLAlchemyError
 
 import pygit2
 
+import spechub.alternates
 import spechub.exceptions
+import spechub.merge
 from spechub import model
 
 
@@ -106,8 +112,13 @@ def new_pull_request(
     return 'Request created'
 
 
-def fork_project(session, username, repo, gitfolder, forkfolder):
-    ''' Fork a given project into the user's forks. '''
+def fork_project(session, username, repo, gitfolder, forkfolder,
+                 shared=False):
+    ''' Fork a given project into the user's forks.
+
+    :kwarg shared: if True, the fork borrows the objects of the project
+        through git alternates instead of being a full clone of it.
+    '''
 
     reponame = os.path.join(gitfolder, repo + '.git')
     forkreponame = '%s.git' % os.path.join(forkfolder, username, repo)
@@ -133,11 +144,74 @@ def fork_project(session, username, repo, gitfolder, forkfolder):
     # Make sure we won't have SQLAlchemy error before we create the repo
     session.flush()
 
-    pygit2.clone_repository(reponame, forkreponame, bare=True)
+    if shared:
+        spechub.alternates.create_shared_fork(reponame, forkreponame)
+    else:
+        pygit2.clone_repository(reponame, forkreponame, bare=True)
 
     return 'Repo "%s" cloned to "%s/%s"' % (repo, username, repo)
 
 
+def merge_pull_request(session, request, gitfolder, forkfolder,
+                       progress=None):
+    ''' Merge the specified pull-request into its project and close it.
+
+    :kwarg progress: a callable called with the percentage of the work
+        done and a message describing the current step.
+    :return: a message describing the outcome of the merge.
+    :raises spechub.exceptions.SpecHubException: if the merge could not
+        be made, the pull-request is then left open.
+    '''
+    progress = progress or (lambda percent, message: None)
+
+    if request.repo_from is None:
+        raise spechub.exceptions.SpecHubException(
+            'The project the pull-request was made from was deleted')
+
+    if request.repo_from.is_fork:
+        repopath = os.path.join(forkfolder, request.repo_from.path)
+    else:
+        repopath = os.path.join(gitfolder, request.repo_from.path)
+    fork_obj = pygit2.Repository(repopath)
+    orig_repo = pygit2.Repository(
+        os.path.join(gitfolder, request.repo.path))
+
+    repo_commit = fork_obj[request.stop_id]
+
+    progress(10, 'Merging the changes')
+    merge = spechub.merge.merge_commit(
+        orig_repo,
+        repo_commit.oid.hex,
+        request.branch or 'master',
+        repo_commit.author,
+        repo_commit.committer,
+        'Merge #%s `%s`' % (request.id, request.title),
+        src_repo=fork_obj,
+    )
+
+    close_pull_request(session, request)
+
+    if merge == spechub.merge.UP_TO_DATE:
+        return 'Nothing to do, changes were already merged'
+    return 'Changes merged!'
+
+
+def detach_forks(session, project, forkfolder):
+    ''' Copy into the forks of the specified project the objects they
+    borrow from it, this must be done before deleting the project or
+    pruning objects from its git repository.
+
+    :return: the list of the forks detached.
+    '''
+    output = []
+    for fork in get_forks(session, project):
+        forkreponame = os.path.join(forkfolder, fork.path)
+        if spechub.alternates.is_shared(forkreponame):
+            spechub.alternates.detach_fork(forkreponame)
+            output.append(fork)
+    return output
+
+
 def delete_fork(session, fork, forkfolder):
     ''' Delete a specified fork from the DB and the system. '''
     forkreponame = os.path.join(forkfolder, fork.path)
@@ -146,26 +220,168 @@ def delete_fork(session, fork, forkfolder):
         raise spechub.exceptions.RepoExistsException(
             'Repo "%s" could not be found' % fork.fullname)
 
-    for req in fork.requests:
-        session.delete(req)
-    session.delete(fork)
+    fullname = fork.fullname
+    delete_forks(session, [fork], forkfolder)
+
+    return 'Fork %s deleted' % fullname
+
+
+def _chunks(item_list, chunks_size=500):
+    ''' Yield successive chunks of the provided list, to keep the number
+    of parameters of the queries under the limit of the database. '''
+    for idx in xrange(0, len(item_list), chunks_size):
+        yield item_list[idx:idx + chunks_size]
+
+
+def get_trash_folder(forkfolder):
+    ''' Return the folder in which the git repos of the deleted forks
+    wait to be removed, it is on the same file system as the forks. '''
+    return os.path.join(forkfolder, '.trash')
+
+
+def delete_forks(session, forks, forkfolder):
+    ''' Delete the specified forks, the pull-requests made to them and
+    their comments from the DB, and move their git repos to the trash
+    folder, see ``reap_trash``.
+
+    The pull-requests made from the forks to other projects are kept in
+    the history of these projects, closed and without their origin.
+
+    The forks borrowing objects from a deleted fork are detached first,
+    see ``detach_forks``.
+
+    :return: the number of forks deleted.
+    :raises spechub.exceptions.SpecHubException: if a fork could not be
+        detached, nothing is deleted then.
+    '''
+    fork_ids = [fork.id for fork in forks if fork.is_fork]
+    paths = [fork.path for fork in forks if fork.is_fork]
+
+    for ids in _chunks(fork_ids):
+        children = session.query(
+            model.Project
+        ).options(
+            joinedload(model.Project.user)
+        ).filter(
+            model.Project.parent_id.in_(ids)
+        )
+        for child in children:
+            if child.id in fork_ids:
+                continue
+            childreponame = os.path.join(forkfolder, child.path)
+            if spechub.alternates.is_shared(childreponame):
+                spechub.alternates.detach_fork(childreponame)
+
+    for ids in _chunks(fork_ids):
+        request_ids = [
+            row.id
+            for row in session.query(
+                model.PullRequest.id
+            ).filter(
+                model.PullRequest.project_id.in_(ids)
+            )
+        ]
+        for chunk in _chunks(request_ids):
+            session.query(
+                model.PullRequestComment
+            ).filter(
+                model.PullRequestComment.pull_request_id.in_(chunk)
+            ).delete(synchronize_session=False)
+            session.query(
+                model.PullRequest
+            ).filter(
+                model.PullRequest.id.in_(chunk)
+            ).delete(synchronize_session=False)
+
+        session.query(
+            model.PullRequest
+        ).filter(
+            model.PullRequest.project_id_from.in_(ids)
+        ).update(
+            {'project_id_from': None, 'status': False},
+            synchronize_session=False)
+        session.query(
+            model.Project
+        ).filter(
+            model.Project.id.in_(ids)
+        ).delete(synchronize_session=False)
 
     # Delete from the DB
     session.commit()
+    session.expire_all()
+
+    # Move out of the way on the FS, the reaper deletes them later
+    trash = get_trash_folder(forkfolder)
+    if not os.path.exists(trash):
+        os.makedirs(trash)
+    for path in paths:
+        forkreponame = os.path.join(forkfolder, path)
+        if os.path.exists(forkreponame):
+            trashname = '%s-%s' % (uuid.uuid4().hex, path.replace('/', '-'))
+            os.rename(forkreponame, os.path.join(trash, trashname))
+
+    return len(fork_ids)
+
+
+def reap_trash(forkfolder):
+    ''' Remove from the file system the git repos of the deleted forks.
+
+    :return: the number of git repos removed.
+    '''
+    trash = get_trash_folder(forkfolder)
+    if not os.path.exists(trash):
+        return 0
+
+    cnt = 0
+    for entry in os.listdir(trash):
+        shutil.rmtree(os.path.join(trash, entry), ignore_errors=True)
+        cnt += 1
+    return cnt
 
-    # Delete from the FS
-    shutil.rmtree(forkreponame)
 
-    return 'Fork %s deleted' % fork.fullname
+def get_forks_by_fullname(session, fullnames):
+    ''' Retrieve the forks having the specified names, as user/project.
+    '''
+    wanted = set()
+    for fullname in fullnames:
+        if '/' in fullname:
+            wanted.add(tuple(fullname.split('/', 1)))
+
+    output = []
+    names = sorted(set(name for _, name in wanted))
+    for chunk in _chunks(names):
+        query = session.query(
+            model.Project
+        ).join(
+            model.Project.user
+        ).options(
+            contains_eager(model.Project.user)
+        ).filter(
+            model.Project.parent_id != None
+        ).filter(
+            model.Project.name.in_(chunk)
+        )
+        output.extend(
+            fork for fork in query if (fork.user.user, fork.name) in wanted)
+
+    return output
 
 
 def get_pull_requests(
         session, project_id=None, project_id_from=None, status=None):
     ''' Retrieve the specified issue
+
+    The users, projects and number of comments of the pull-requests are
+    loaded with them.
     '''
 
     query = session.query(
         model.PullRequest,
+    ).options(
+        joinedload(model.PullRequest.user),
+        joinedload_all(model.PullRequest.repo, model.Project.user),
+        joinedload_all(model.PullRequest.repo_from, model.Project.user),
+        undefer('comment_count'),
     ).order_by(
         model.PullRequest.id
     )
@@ -210,6 +426,31 @@ def get_pull_request(session, requestid, project=None):
     return query.first()
 
 
+def get_pull_request_comments_index(session, request):
+    ''' Retrieve the comments of the specified pull-request, with their
+    user, in a single query and index them by (commit, line).
+
+    :return: a dict mapping (commit id, line) tuples to the list of the
+        comments made on that line, oldest first.
+    '''
+    query = session.query(
+        model.PullRequestComment
+    ).options(
+        joinedload(model.PullRequestComment.user)
+    ).filter(
+        model.PullRequestComment.pull_request_id == request.id
+    ).order_by(
+        model.PullRequestComment.date_created,
+        model.PullRequestComment.id
+    )
+
+    index = {}
+    for comment in query.all():
+        index.setdefault((comment.commit_id, comment.line), []).append(
+            comment)
+    return index
+
+
 def close_pull_request(session, request):
     ''' Close the provided pull-request.
     '''
@@ -261,11 +502,16 @@ def get_fork(session, user, project):
 
 
 def get_forks(session, project):
-    ''' Retrieve the forks of a project
+    ''' Retrieve the forks of a project, with their user, no project
+    having no fork.
     '''
+    if project is None:
+        return []
 
     query = session.query(
         model.Project
+    ).options(
+        joinedload(model.Project.user)
     ).filter(
         model.Project.parent_id == project.id
     ).order_by(
@@ -276,11 +522,13 @@ def get_forks(session, project):
 
 
 def get_all_forks(session):
-    ''' Retrieve all the forks
+    ''' Retrieve all the forks, with their user
     '''
 
     query = session.query(
         model.Project
+    ).options(
+        joinedload(model.Project.user)
     ).filter(
         model.Project.parent_id != None
     ).order_by(
@@ -290,6 +538,45 @@ def get_all_forks(session):
     return query.all()
 
 
+def get_project(session, project_name, project_user=None):
+    ''' Retrieve the project having the specified name and user, without
+    creating it if it does not exist.
+    '''
+    query = session.query(
+        model.Project
+    ).filter(
+        model.Project.name == project_name
+    )
+
+    if project_user:
+        query = query.join(
+            model.Project.user
+        ).options(
+            contains_eager(model.Project.user)
+        ).filter(
+            model.User.user == project_user
+        )
+    else:
+        query = query.filter(
+            model.Project.user_id == None
+        )
+
+    return query.first()
+
+
+def get_project_by_id(session, project_id):
+    ''' Retrieve the project having the specified id, with its user, or
+    None if it does not exist.
+    '''
+    query = session.query(
+        model.Project
+    ).options(
+        joinedload(model.Project.user)
+    )
+
+    return query.get(project_id)
+
+
 def get_or_create_project(session, project_name, project_user=None):
     ''' Get or create the project having with the specified information.
     '''
@@ -0,0 +1,144 @@
+#-*- coding: utf-8 -*-
+
+"""
+ (c) 2014 - Copyright Red Hat Inc
+
+ Authors:
+   Pierre-Yves Chibon <pingou@pingoured.fr>
+
+Merge commits of a fork into its parent directly in the bare repository of
+the parent: the missing objects are copied over, the trees are merged in
+memory and the branch is moved while holding a lock, without any clone,
+checkout or push.
+
+"""
+
+import fcntl
+import os
+
+import pygit2
+
+import spechub.exceptions
+
+
+# Results of ``merge_commit``
+UP_TO_DATE = 'up-to-date'
+FAST_FORWARD = 'fast-forward'
+MERGED = 'merged'
+
+
+def copy_objects(src_repo, dest_repo, oid):
+    ''' Copy the commit ``oid`` of ``src_repo``, and the objects it
+    references, into ``dest_repo``.
+
+    The walk stops at the objects ``dest_repo`` already has, so only the
+    objects introduced by the commits missing in ``dest_repo`` are read.
+    An object is only written after all the objects it references, so an
+    object present in ``dest_repo`` is always complete, even if a previous
+    copy was interrupted.
+
+    :return: the number of objects copied.
+    '''
+    copied = 0
+    # (oid, whether the objects it references were already pushed)
+    stack = [(oid, False)]
+    seen = set()
+    while stack:
+        oid, expanded = stack.pop()
+        if expanded:
+            obj_type, data = src_repo.read(oid)
+            dest_repo.write(obj_type, data)
+            copied += 1
+            continue
+        if oid.hex in seen or oid in dest_repo:
+            continue
+        seen.add(oid.hex)
+
+        obj = src_repo[oid]
+        children = []
+        if isinstance(obj, pygit2.Commit):
+            children.append(obj.tree.oid)
+            children.extend(parent.oid for parent in obj.parents)
+        elif isinstance(obj, pygit2.Tree):
+            # Sub-modules point to commits of other repositories
+            children.extend(
+                entry.oid for entry in obj if entry.filemode != 57344)
+        elif isinstance(obj, pygit2.Tag):
+            children.append(obj.target)
+
+        # Written once the objects it references, popped first, are
+        stack.append((oid, True))
+        stack.extend((child, False) for child in children)
+    return copied
+
+
+def merge_commit(repo_obj, commit_id, branchname, author, committer,
+                 message, src_repo=None):
+    ''' Merge the specified commit into a branch of the bare repository
+    ``repo_obj``.
+
+    :arg repo_obj: the pygit2.Repository to merge into.
+    :arg commit_id: the hex of the commit to merge.
+    :arg branchname: the name of the branch to merge into.
+    :arg author: the pygit2.Signature of the author of the merge commit.
+    :arg committer: the pygit2.Signature of the committer of the merge
+        commit.
+    :arg message: the message of the merge commit.
+    :kwarg src_repo: the pygit2.Repository, for example a fork, holding
+        the commit, its objects missing in ``repo_obj`` are copied first.
+    :return: UP_TO_DATE, FAST_FORWARD or MERGED.
+    :raises spechub.exceptions.MergeConflictException: if the changes
+        do not merge cleanly, the branch is then left untouched.
+    :raises spechub.exceptions.SpecHubException: if the branch does not
+        exist, has no history in common with the commit or was moved while
+        merging.
+
+    The branch is locked while the merge is computed and is only moved
+    if it still points to the commit the merge was computed from.
+    '''
+    oid = pygit2.Oid(hex=commit_id)
+    if src_repo is not None:
+        copy_objects(src_repo, repo_obj, oid)
+
+    lockpath = os.path.join(repo_obj.path, 'spechub-merge.lock')
+    with open(lockpath, 'a') as lockfile:
+        fcntl.flock(lockfile.fileno(), fcntl.LOCK_EX)
+        try:
+            branch = repo_obj.lookup_branch(branchname)
+            if branch is None:
+                raise spechub.exceptions.SpecHubException(
+                    'Branch %s does not exist' % branchname)
+            ref = repo_obj.lookup_reference(branch.name)
+            head = ref.get_object()
+
+            base = repo_obj.merge_base(head.oid, oid)
+            if base is None:
+                raise spechub.exceptions.SpecHubException(
+                    'Commit %s has no history in common with the branch '
+                    '%s' % (commit_id, branchname))
+            if base.hex == oid.hex:
+                return UP_TO_DATE
+
+            if base.hex == head.hex:
+                new_target = oid
+                result = FAST_FORWARD
+            else:
+                index = repo_obj.merge_trees(
+                    repo_obj[base].tree, head.tree, repo_obj[oid].tree)
+                if index.conflicts is not None:
+                    raise spechub.exceptions.MergeConflictException(
+                        'Merge conflicts!')
+                tree = index.write_tree(repo_obj)
+                new_target = repo_obj.create_commit(
+                    None, author, committer, message, tree, [head.oid, oid])
+                result = MERGED
+
+            if ref.resolve().target.hex != head.hex:
+                raise spechub.exceptions.SpecHubException(
+                    'Branch %s was updated during the merge, please try '
+                    'again' % branchname)
+            ref.target = new_target
+        finally:
+            fcntl.flock(lockfile.fileno(), fcntl.LOCK_UN)
+
+    return result
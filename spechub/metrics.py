@@ -0,0 +1,250 @@
+#-*- coding: utf-8 -*-
+
+"""
+ (c) 2014 - Copyright Red Hat Inc
+
+ Authors:
+   Pierre-Yves Chibon <pingou@pingoured.fr>
+
+Count and time the work done by each request: database queries, git
+operations, highlighting, documentation and template rendering.
+
+The measures of the request being processed by the current thread are
+kept in a ``Recorder``, they are then added to the per-route totals of the
+process-wide ``Metrics``. Outside of a request, nothing is recorded.
+
+"""
+
+import functools
+import threading
+import time
+
+import jinja2
+import pygit2
+import sqlalchemy as sa
+
+
+# Categories of the work measured, in the order they are presented
+DB = 'db'
+GIT = 'git'
+HIGHLIGHT = 'highlight'
+DOCS = 'docs'
+TEMPLATE = 'template'
+CATEGORIES = (DB, GIT, HIGHLIGHT, DOCS, TEMPLATE)
+
+_LOCAL = threading.local()
+
+
+class Recorder(object):
+    ''' Counts and durations, in seconds, of the work done by a request.
+    '''
+
+    def __init__(self):
+        self.start = time.time()
+        self.counts = dict((category, 0) for category in CATEGORIES)
+        self.durations = dict((category, 0.0) for category in CATEGORIES)
+        # Categories being timed, nested measures are not added twice
+        self.active = set()
+
+    def add(self, category, duration):
+        ''' Record one operation of the category lasting ``duration``. '''
+        self.counts[category] += 1
+        self.durations[category] += duration
+
+    def server_timing(self):
+        ''' Return the value of the Server-Timing header describing the
+        request so far. '''
+        items = []
+        for category in CATEGORIES:
+            if self.counts[category]:
+                items.append('%s;desc="%s";dur=%.1f' % (
+                    category, self.counts[category],
+                    self.durations[category] * 1000))
+        items.append(
+            'total;dur=%.1f' % ((time.time() - self.start) * 1000))
+        return ', '.join(items)
+
+
+def start_request():
+    ''' Start recording the work done by the current thread. '''
+    _LOCAL.recorder = Recorder()
+    return _LOCAL.recorder
+
+
+def stop_request():
+    ''' Stop recording the work done by the current thread.
+
+    :return: the Recorder of the request or None if none was started.
+    '''
+    recorder = getattr(_LOCAL, 'recorder', None)
+    _LOCAL.recorder = None
+    return recorder
+
+
+def current():
+    ''' Return the Recorder of the current thread, if any. '''
+    return getattr(_LOCAL, 'recorder', None)
+
+
+class timed(object):
+    ''' Context manager, and decorator, timing the enclosed code as one
+    operation of the specified category. '''
+
+    def __init__(self, category):
+        self.category = category
+        self._recorder = None
+        self._start = None
+
+    def __enter__(self):
+        recorder = current()
+        if recorder is not None and self.category not in recorder.active:
+            recorder.active.add(self.category)
+            self._recorder = recorder
+            self._start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._recorder is not None:
+            self._recorder.active.discard(self.category)
+            self._recorder.add(self.category, time.time() - self._start)
+            self._recorder = None
+
+    def __call__(self, function):
+        @functools.wraps(function)
+        def decorated_function(*args, **kwargs):
+            """ Decorated function, actually does the work. """
+            with timed(self.category):
+                return function(*args, **kwargs)
+        return decorated_function
+
+
+class Metrics(object):
+    ''' Process-wide totals of the recorded requests, per route. '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.routes = {}
+
+    def add(self, route, recorder):
+        ''' Add the measures of a finished request to the totals of its
+        route. '''
+        duration = time.time() - recorder.start
+        with self.lock:
+            stats = self.routes.get(route)
+            if stats is None:
+                stats = self.routes[route] = {
+                    'requests': 0,
+                    'duration': 0.0,
+                    'max_duration': 0.0,
+                    'counts': dict((cat, 0) for cat in CATEGORIES),
+                    'durations': dict((cat, 0.0) for cat in CATEGORIES),
+                }
+            stats['requests'] += 1
+            stats['duration'] += duration
+            stats['max_duration'] = max(stats['max_duration'], duration)
+            for category in CATEGORIES:
+                stats['counts'][category] += recorder.counts[category]
+                stats['durations'][category] += \
+                    recorder.durations[category]
+
+    def stats(self):
+        ''' Return a copy of the totals, as a list of (route, stats) sorted
+        by total duration, slowest first. '''
+        with self.lock:
+            output = [
+                (route, {
+                    'requests': stats['requests'],
+                    'duration': stats['duration'],
+                    'max_duration': stats['max_duration'],
+                    'counts': dict(stats['counts']),
+                    'durations': dict(stats['durations']),
+                })
+                for route, stats in self.routes.items()
+            ]
+        output.sort(key=lambda item: item[1]['duration'], reverse=True)
+        return output
+
+    def reset(self):
+        ''' Forget the totals recorded so far. '''
+        with self.lock:
+            self.routes = {}
+
+
+## Instrumentation of the libraries
+
+
+def instrument_engine(engine):
+    ''' Count and time the queries run through the provided SQLAlchemy
+    engine. '''
+
+    def before_execute(conn, cursor, statement, parameters, context,
+                       executemany):
+        conn.info.setdefault('spechub_start', []).append(time.time())
+
+    def after_execute(conn, cursor, statement, parameters, context,
+                      executemany):
+        start = conn.info['spechub_start'].pop()
+        recorder = current()
+        if recorder is not None:
+            recorder.add(DB, time.time() - start)
+
+    sa.event.listen(engine, 'before_cursor_execute', before_execute)
+    sa.event.listen(engine, 'after_cursor_execute', after_execute)
+
+
+class _TimedWalker(object):
+    ''' pygit2.Walker timing the production of each commit. '''
+
+    def __init__(self, walker):
+        self._walker = walker
+
+    def __getattr__(self, name):
+        return getattr(self._walker, name)
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        ''' Return the next commit of the walk. '''
+        with timed(GIT):
+            return next(self._walker)
+
+
+class TimedRepository(pygit2.Repository):
+    ''' pygit2.Repository timing its lookups, walks and diffs. '''
+
+    def __getitem__(self, key):
+        with timed(GIT):
+            return super(TimedRepository, self).__getitem__(key)
+
+    def walk(self, *args, **kwargs):
+        with timed(GIT):
+            return _TimedWalker(
+                super(TimedRepository, self).walk(*args, **kwargs))
+
+    def diff(self, *args, **kwargs):
+        with timed(GIT):
+            return super(TimedRepository, self).diff(*args, **kwargs)
+
+    def revparse_single(self, *args, **kwargs):
+        with timed(GIT):
+            return super(TimedRepository, self).revparse_single(
+                *args, **kwargs)
+
+    def lookup_branch(self, *args, **kwargs):
+        with timed(GIT):
+            return super(TimedRepository, self).lookup_branch(
+                *args, **kwargs)
+
+    def merge_base(self, *args, **kwargs):
+        with timed(GIT):
+            return super(TimedRepository, self).merge_base(*args, **kwargs)
+
+
+class TimedTemplate(jinja2.Template):
+    ''' Jinja template timing its rendering, to be used as the
+    ``template_class`` of the Jinja environment. '''
+
+    def render(self, *args, **kwargs):
+        with timed(TEMPLATE):
+            return super(TimedTemplate, self).render(*args, **kwargs)
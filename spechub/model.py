@@ -20,6 +20,7 @@ from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm import scoped_session
+from sqlalchemy.orm import column_property
 from sqlalchemy.orm import relation
 
 BASE = declarative_base()
@@ -209,11 +210,12 @@ class PullRequest(BASE):
         sa.ForeignKey(
             'projects.id', ondelete='CASCADE', onupdate='CASCADE'),
         nullable=False)
+    # NULL once the project the pull-request was made from is deleted
     project_id_from = sa.Column(
         sa.Integer,
         sa.ForeignKey(
             'projects.id', ondelete='CASCADE', onupdate='CASCADE'),
-        nullable=False)
+        nullable=True)
     title = sa.Column(
         sa.Text,
         nullable=False)
@@ -298,3 +300,54 @@ class PullRequestComment(BASE):
     pull_request = relation(
         'PullRequest', foreign_keys=[pull_request_id],
         remote_side=[PullRequest.id], backref='comments')
+
+
+# Number of comments of a pull-request, only loaded when asked for with the
+# ``undefer('comment_count')`` query option
+PullRequest.comment_count = column_property(
+    sa.select(
+        [sa.func.count(PullRequestComment.id)]
+    ).where(
+        PullRequestComment.pull_request_id == PullRequest.id
+    ).correlate_except(
+        PullRequestComment
+    ).label('comment_count'),
+    deferred=True)
+
+
+class Job(BASE):
+    """ Stores the long git operations run in the background.
+
+    Table -- jobs
+    """
+
+    __tablename__ = 'jobs'
+
+    id = sa.Column(sa.Integer, primary_key=True)
+    kind = sa.Column(sa.String(32), nullable=False)
+    # Jobs sharing a lock_key are run one after the other
+    lock_key = sa.Column(sa.String(255), nullable=False, index=True)
+    arguments = sa.Column(sa.Text, nullable=False, default='{}')
+    status = sa.Column(
+        sa.String(16), nullable=False, default='queued', index=True)
+    progress = sa.Column(sa.Integer, nullable=False, default=0)
+    message = sa.Column(sa.Text, nullable=True)
+    url = sa.Column(sa.Text, nullable=True)
+    user_id = sa.Column(
+        sa.Integer,
+        sa.ForeignKey('users.id', onupdate='CASCADE'),
+        nullable=True,
+        index=True)
+
+    date_created = sa.Column(sa.DateTime, nullable=False,
+                             default=datetime.datetime.utcnow)
+    date_started = sa.Column(sa.DateTime, nullable=True)
+    date_finished = sa.Column(sa.DateTime, nullable=True)
+
+    user = relation('User', foreign_keys=[user_id],
+                    remote_side=[User.id], backref='jobs')
+
+    @property
+    def finished(self):
+        ''' Return whether the job is over, successfully or not. '''
+        return self.status in ('done', 'failed')
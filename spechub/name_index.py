@@ -0,0 +1,137 @@
+#-*- coding: utf-8 -*-
+
+"""
+ (c) 2014 - Copyright Red Hat Inc
+
+ Authors:
+   Pierre-Yves Chibon <pingou@pingoured.fr>
+
+"""
+
+import bisect
+import threading
+
+
+def _trigrams(text):
+    ''' Return the set of the trigrams of the provided text. '''
+    return set(text[idx:idx + 3] for idx in xrange(len(text) - 2))
+
+
+def _parts_match(name, parts):
+    ''' Return whether the provided name matches the parts of a wildcard
+    query: it must start with the first part and contain the others in
+    order. '''
+    if not name.startswith(parts[0]):
+        return False
+    pos = len(parts[0])
+    for part in parts[1:]:
+        if not part:
+            continue
+        pos = name.find(part, pos)
+        if pos == -1:
+            return False
+        pos += len(part)
+    return True
+
+
+class NameIndex(object):
+    ''' In-memory index of project names answering substring and wildcard
+    queries without scanning every name.
+
+    Names are indexed, case-insensitively, by their trigrams. The
+    candidates of a query are the names having all the trigrams of the
+    query, which are then checked with plain string operations. Queries
+    too short to have trigrams use the sorted list of names instead.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._trigrams = {}
+        # sorted list of (lowercased name, name)
+        self._sorted = []
+
+    def __len__(self):
+        return len(self._sorted)
+
+    def update(self, added=None, removed=None):
+        ''' Add and remove the specified names from the index. This method
+        can be used as a listener of a spechub.registry.RepoRegistry. '''
+        with self.lock:
+            for name in removed or []:
+                key = (name.lower(), name)
+                idx = bisect.bisect_left(self._sorted, key)
+                if idx < len(self._sorted) and self._sorted[idx] == key:
+                    del self._sorted[idx]
+                for trigram in _trigrams(key[0]):
+                    names = self._trigrams.get(trigram)
+                    if names is not None:
+                        names.discard(name)
+                        if not names:
+                            del self._trigrams[trigram]
+            for name in added or []:
+                key = (name.lower(), name)
+                idx = bisect.bisect_left(self._sorted, key)
+                if idx == len(self._sorted) or self._sorted[idx] != key:
+                    self._sorted.insert(idx, key)
+                for trigram in _trigrams(key[0]):
+                    self._trigrams.setdefault(trigram, set()).add(name)
+
+    def _candidates(self, parts):
+        ''' Return the list of (lowercased name, name) possibly matching
+        the specified lowercased query parts. '''
+        trigrams = set()
+        for part in parts:
+            trigrams.update(_trigrams(part))
+
+        if trigrams:
+            postings = sorted(
+                (self._trigrams.get(trigram, set()) for trigram in trigrams),
+                key=len)
+            names = set(postings[0])
+            for posting in postings[1:]:
+                names.intersection_update(posting)
+                if not names:
+                    break
+            return [(name.lower(), name) for name in names]
+
+        if parts[0]:
+            # Prefix query: only the names starting with the prefix
+            output = []
+            idx = bisect.bisect_left(self._sorted, (parts[0],))
+            while idx < len(self._sorted) \
+                    and self._sorted[idx][0].startswith(parts[0]):
+                output.append(self._sorted[idx])
+                idx += 1
+            return output
+
+        return list(self._sorted)
+
+    def search(self, term):
+        ''' Return the names matching the provided query, best first.
+
+        A query without ``*`` returns the names containing it, the exact
+        match first, then the names starting with it, then the others,
+        shorter names first.
+        A query with ``*`` is a wildcard pattern matched from the start of
+        the names, as ``python-*`` or ``*-devel``, and returns the names
+        in alphabetical order.
+        '''
+        term = term.lower()
+        if '*' in term:
+            parts = term.split('*')
+            return sorted(
+                name
+                for lower, name in self._candidates(parts)
+                if _parts_match(lower, parts)
+            )
+
+        if not term:
+            return [name for _, name in self._sorted]
+
+        found = []
+        for lower, name in self._candidates(['', term]):
+            idx = lower.find(term)
+            if idx == -1:
+                continue
+            found.append(((lower != term, idx != 0, len(lower), lower), name))
+        return [name for _, name in sorted(found)]
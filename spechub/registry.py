@@ -0,0 +1,119 @@
+#-*- coding: utf-8 -*-
+
+"""
+ (c) 2014 - Copyright Red Hat Inc
+
+ Authors:
+   Pierre-Yves Chibon <pingou@pingoured.fr>
+
+"""
+
+import bisect
+import os
+import threading
+import time
+
+
+def _repo_name(entry):
+    ''' Return the name of the project stored in the specified entry of
+    the git folder. '''
+    return entry.replace('.git', '')
+
+
+class RepoRegistry(object):
+    ''' Sorted list of the names of the git repositories of a folder, kept
+    in memory.
+
+    The folder is only listed again when its mtime changed, which happens
+    when an entry is added or removed, and at most once every
+    ``check_interval`` seconds. Projects created or deleted by this
+    process can be registered right away through ``add`` and ``remove``.
+
+    Callables added to ``listeners`` are called with the lists of names
+    added and removed each time the registry changes.
+    '''
+
+    def __init__(self, folder, check_interval=5):
+        self.folder = folder
+        self.check_interval = check_interval
+        self.lock = threading.RLock()
+        self.listeners = []
+        self._names = []
+        self._mtime = None
+        self._checked = 0
+
+    def refresh(self, force=False):
+        ''' Update the list of names if the folder changed on disk. '''
+        now = time.time()
+        if not force and now - self._checked < self.check_interval:
+            return
+        with self.lock:
+            self._checked = now
+            try:
+                mtime = os.stat(self.folder).st_mtime
+            except OSError:
+                mtime = None
+            if not force and mtime == self._mtime:
+                return
+            self._mtime = mtime
+
+            names = set()
+            if mtime is not None:
+                names = set(
+                    _repo_name(entry) for entry in os.listdir(self.folder))
+            current = set(self._names)
+            added = sorted(names - current)
+            removed = sorted(current - names)
+            self._update(added, removed)
+
+    def _update(self, added, removed):
+        ''' Insert and remove the specified names, keeping the list sorted,
+        and notify the listeners. '''
+        if not added and not removed:
+            return
+        if len(added) + len(removed) > len(self._names) / 2:
+            names = set(self._names)
+            names.update(added)
+            names.difference_update(removed)
+            self._names = sorted(names)
+        else:
+            for name in removed:
+                idx = bisect.bisect_left(self._names, name)
+                if idx < len(self._names) and self._names[idx] == name:
+                    del self._names[idx]
+            for name in added:
+                idx = bisect.bisect_left(self._names, name)
+                if idx == len(self._names) or self._names[idx] != name:
+                    self._names.insert(idx, name)
+        for listener in self.listeners:
+            listener(added, removed)
+
+    def add(self, name):
+        ''' Register a project created in the folder. '''
+        with self.lock:
+            idx = bisect.bisect_left(self._names, name)
+            if idx == len(self._names) or self._names[idx] != name:
+                self._update([name], [])
+
+    def remove(self, name):
+        ''' Unregister a project deleted from the folder. '''
+        with self.lock:
+            idx = bisect.bisect_left(self._names, name)
+            if idx < len(self._names) and self._names[idx] == name:
+                self._update([], [name])
+
+    def __len__(self):
+        self.refresh()
+        return len(self._names)
+
+    def __contains__(self, name):
+        self.refresh()
+        names = self._names
+        idx = bisect.bisect_left(names, name)
+        return idx < len(names) and names[idx] == name
+
+    def names(self, start=0, stop=None):
+        ''' Return the sorted list of names, sliced with the specified
+        bounds. '''
+        self.refresh()
+        return self._names[start:stop]
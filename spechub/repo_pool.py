@@ -0,0 +1,120 @@
+#-*- coding: utf-8 -*-
+
+"""
+ (c) 2014 - Copyright Red Hat Inc
+
+ Authors:
+   Pierre-Yves Chibon <pingou@pingoured.fr>
+
+"""
+
+import collections
+import os
+import threading
+
+import pygit2
+
+from spechub.commit_graph import refs_stamp
+
+
+def repo_stamp(path):
+    ''' Return a value changing every time the refs or the packs of the git
+    repository at the specified path change on disk.
+    '''
+    try:
+        packs = os.stat(os.path.join(path, 'objects', 'pack')).st_mtime
+    except OSError:
+        packs = None
+    return refs_stamp(path) + (packs,)
+
+
+class RepositoryPool(object):
+    ''' Bounded LRU pool of pygit2.Repository objects keyed by path.
+
+    A pygit2.Repository must not be used by two threads at once, so
+    repositories are checked out of the pool for the exclusive use of the
+    caller and checked back in once done with.
+    A checked in repository is only kept if its refs and packs did not
+    change on disk since it was opened, otherwise it is dropped and the
+    next checkout opens the repository again.
+    '''
+
+    def __init__(self, size=256, factory=pygit2.Repository):
+        ''' Instanciate a new pool keeping at most ``size`` idle
+        repositories, opened by calling ``factory`` with their path.
+        '''
+        self.size = size
+        self.factory = factory
+        self.lock = threading.Lock()
+        # path -> list of (repo, stamp), least recently used path first
+        self._idle = collections.OrderedDict()
+        self._n_idle = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def checkout(self, path):
+        ''' Return a pygit2.Repository for the git repo at ``path``, reusing
+        an idle one if it is still up to date.
+        '''
+        path = os.path.abspath(path)
+        stamp = repo_stamp(path)
+        with self.lock:
+            entries = self._idle.get(path, [])
+            while entries:
+                repo_obj, repo_stamp_ = entries.pop()
+                self._n_idle -= 1
+                if repo_stamp_ == stamp:
+                    self.hits += 1
+                    if not entries:
+                        del self._idle[path]
+                    return repo_obj
+                self.invalidations += 1
+            self._idle.pop(path, None)
+            self.misses += 1
+
+        repo_obj = self.factory(path)
+        repo_obj._spechub_stamp = stamp
+        return repo_obj
+
+    def checkin(self, repo_obj):
+        ''' Give back to the pool a repository obtained from ``checkout``.
+        '''
+        stamp = getattr(repo_obj, '_spechub_stamp', None)
+        path = os.path.abspath(repo_obj.path)
+        if stamp is None or stamp != repo_stamp(path):
+            with self.lock:
+                self.invalidations += 1
+            return
+
+        with self.lock:
+            entries = self._idle.pop(path, [])
+            entries.append((repo_obj, stamp))
+            self._idle[path] = entries
+            self._n_idle += 1
+            while self._n_idle > self.size:
+                _, oldentries = self._idle.popitem(last=False)
+                self._n_idle -= len(oldentries)
+                self.evictions += len(oldentries)
+
+    def invalidate(self, path):
+        ''' Drop every idle repository opened on ``path``. '''
+        path = os.path.abspath(path)
+        with self.lock:
+            entries = self._idle.pop(path, [])
+            self._n_idle -= len(entries)
+            self.invalidations += len(entries)
+
+    def stats(self):
+        ''' Return a dict of the counters of the pool. '''
+        with self.lock:
+            return {
+                'size': self.size,
+                'idle': self._n_idle,
+                'repos': len(self._idle),
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'evictions': self.evictions,
+            }
@@ -8,13 +8,18 @@
 
 """
 
+import re
 from functools import wraps
 
 import flask
+from sqlalchemy.exc import SQLAlchemyError
 
+import spechub.jobs
 import spechub.lib
-from spechub import (APP, SESSION, LOG, cla_required, authenticated,
-                    is_admin)
+import spechub.metrics
+from spechub import (APP, SESSION, LOG, DIFF_CACHE, DOC_CACHE,
+                    HIGHLIGHT_CACHE, METRICS, REPO_POOL, cla_required,
+                    authenticated, is_admin)
 
 
 def admin_required(function):
@@ -46,6 +51,32 @@ def admin_index():
     return flask.render_template(
         'admin_index.html',
         forks=forks,
+        repo_pool=REPO_POOL.stats(),
+        caches=[
+            ('Highlighted files', HIGHLIGHT_CACHE.stats()),
+            ('Highlighted diffs', DIFF_CACHE.stats()),
+            ('Rendered documents', DOC_CACHE.stats()),
+        ],
+    )
+
+
+@APP.route('/admin/metrics')
+@admin_required
+def admin_metrics():
+    """ Presents the time spent by the requests per route, in the database,
+    git, highlighting, documentation and templates.
+    """
+    if METRICS is None:
+        flask.flash('Metrics are disabled', 'error')
+        return flask.redirect(flask.url_for('admin_index'))
+
+    if flask.request.args.get('format') == 'json':
+        return flask.jsonify(dict(METRICS.stats()))
+
+    return flask.render_template(
+        'admin_metrics.html',
+        routes=METRICS.stats(),
+        categories=spechub.metrics.CATEGORIES,
     )
 
 
@@ -67,27 +98,39 @@ def gitolite_conf():
 @APP.route('/admin/delete', methods=["POST"])
 @admin_required
 def admin_delete_project():
-    """ Delete a specified project.
+    """ Delete the specified projects.
     """
 
-    forkname = flask.request.form.get('project', None)
+    forknames = [
+        forkname
+        for value in flask.request.form.getlist('project')
+        for forkname in re.split(r'[\s,]+', value)
+        if forkname
+    ]
 
-    if not forkname or not '/' in forkname:
+    if not forknames or not all('/' in forkname for forkname in forknames):
         flask.flash('Invalid format, should be <user>/<project>', 'error')
         return flask.redirect(flask.url_for('admin_index'))
 
-    user, project = forkname.split('/', 1)
-
-    fork = spechub.lib.get_fork(SESSION, user, project)
-    if not fork:
-        flask.flash('Could not find fork %s' % forkname, 'error')
+    forks = spechub.lib.get_forks_by_fullname(SESSION, forknames)
+    missing = set(forknames) - set(fork.fullname for fork in forks)
+    if missing:
+        flask.flash(
+            'Could not find fork %s' % ', '.join(sorted(missing)), 'error')
         return flask.redirect(flask.url_for('admin_index'))
 
     try:
-        output = spechub.lib.delete_fork(
-            SESSION, fork, APP.config['FORK_FOLDER'])
-        flask.flash(output)
+        cnt = spechub.lib.delete_forks(
+            SESSION, forks, APP.config['FORK_FOLDER'])
+        spechub.jobs.reap_trash_later(SESSION, APP.config)
+        if cnt == 1:
+            flask.flash('Fork %s deleted' % forknames[0])
+        else:
+            flask.flash('%s forks deleted' % cnt)
     except spechub.exceptions.SpecHubException, err:
         flask.flash(str(err), 'error')
+    except SQLAlchemyError, err:  # pragma: no cover
+        SESSION.rollback()
+        flask.flash(str(err), 'error')
 
     return flask.redirect(flask.url_for('admin_index'))
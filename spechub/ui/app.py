@@ -9,22 +9,19 @@
 """
 
 import flask
-import os
-import re
 from math import ceil
 
 import pygit2
 from sqlalchemy.exc import SQLAlchemyError
-from pygments import highlight
-from pygments.lexers import guess_lexer
-from pygments.lexers.text import DiffLexer
-from pygments.formatters import HtmlFormatter
 
 
 import spechub.exceptions
+import spechub.jobs
 import spechub.lib
 import spechub.ui.forms
-from spechub import (APP, SESSION, LOG, __get_file_in_tree, cla_required,
+from spechub import (APP, SESSION, LOG, CONTENT_INDEX, NAME_INDEX,
+                    REPO_REGISTRY, __get_file_in_tree, authenticated,
+                    cla_required, is_admin,
                     #generate_gitolite_acls, generate_gitolite_key,
                     #generate_authorized_key_file
                     )
@@ -53,10 +50,9 @@ def index():
     limit = APP.config['ITEM_PER_PAGE']
     start = limit * (page - 1)
 
-    repos = sorted(os.listdir(APP.config['GIT_FOLDER']))[start:(start + limit)]
-    repos = [repo.replace('.git', '') for repo in repos]
+    repos = REPO_REGISTRY.names(start, start + limit)
 
-    num_repos = len(os.listdir(APP.config['GIT_FOLDER']))
+    num_repos = len(REPO_REGISTRY)
 
     total_page = int(ceil(num_repos / float(limit)))
 
@@ -73,23 +69,32 @@ def search(term='*'):
     """ Search for one or more repos according to the pattern given.
     """
     term = flask.request.args.get('term', term)
+    mode = flask.request.args.get('mode', 'name')
     page = flask.request.args.get('page', 1)
     try:
         page = int(page)
     except ValueError:
         page = 1
 
-    pattern = re.compile(term.replace('*', '.*'))
+    if mode == 'content':
+        results = []
+        if CONTENT_INDEX is None:
+            flask.flash('Searching the content is not available', 'error')
+        else:
+            results = CONTENT_INDEX.search(term)
+
+        return flask.render_template(
+            'search_content.html',
+            term=term,
+            results=results,
+        )
 
     limit = APP.config['ITEM_PER_PAGE']
     start = limit * (page - 1)
 
-    repos = sorted(os.listdir(APP.config['GIT_FOLDER']))
-    repos = [
-        repo.replace('.git', '')
-        for repo in repos
-        if re.match(pattern ,repo)
-    ]
+    # The name index is kept up to date by the registry
+    REPO_REGISTRY.refresh()
+    repos = NAME_INDEX.search(term)
 
     num_repos = len(repos)
     repos = repos[start:(start + limit)]
@@ -102,3 +107,52 @@ def search(term='*'):
         total_page=total_page,
         page=page,
     )
+
+
+def _get_job(jobid):
+    """ Return the specified job if the user is allowed to see it: the
+    admins see every job, the other users only the jobs they requested.
+    """
+    job = spechub.jobs.get_job(SESSION, jobid)
+    if not job:
+        flask.abort(404, 'Job not found')
+
+    if not is_admin() and not (
+            authenticated() and job.user is not None
+            and job.user.user == flask.g.fas_user.username):
+        # Do not tell which jobs exist
+        flask.abort(404, 'Job not found')
+    return job
+
+
+@APP.route('/job/<int:jobid>')
+def view_job(jobid):
+    """ Presents the progress of a background job.
+    """
+    job = _get_job(jobid)
+
+    if job.status == 'done' and job.url:
+        flask.flash(job.message)
+        return flask.redirect(job.url)
+
+    return flask.render_template(
+        'job.html',
+        job=job,
+    )
+
+
+@APP.route('/job/<int:jobid>/status')
+def job_status(jobid):
+    """ Returns the status of a background job as JSON.
+    """
+    job = _get_job(jobid)
+
+    return flask.jsonify({
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'progress': job.progress,
+        'message': job.message,
+        'url': job.url,
+        'finished': job.finished,
+    })
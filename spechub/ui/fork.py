@@ -10,23 +10,21 @@
 
 import flask
 import os
-import shutil
-import tempfile
 from math import ceil
 
 import pygit2
 from sqlalchemy.exc import SQLAlchemyError
-from pygments import highlight
-from pygments.lexers import guess_lexer
-from pygments.lexers.text import DiffLexer
-from pygments.formatters import HtmlFormatter
 
 
+import spechub.ancestry
 import spechub.doc_utils
+import spechub.highlight_utils
+import spechub.jobs
 import spechub.lib
 import spechub.ui.forms
-from spechub import (APP, SESSION, LOG, __get_file_in_tree, cla_required,
-                    is_repo_admin)
+from spechub import (APP, SESSION, LOG, DIFF_CACHE, __get_file_in_tree,
+                    cla_required, get_commit_graph, get_project,
+                    is_repo_admin, open_repo)
 
 
 @APP.route('/<repo>/request-pulls')
@@ -44,9 +42,11 @@ def request_pulls(repo, username=None):
     if not repo:
         flask.abort(404, 'Project not found')
 
-    project = spechub.lib.get_or_create_project(SESSION, repo, username)
+    project = get_project(repo, username)
 
-    if status is False or str(status).lower() == 'closed':
+    if project is None:
+        requests = []
+    elif status is False or str(status).lower() == 'closed':
         requests = spechub.lib.get_pull_requests(
             SESSION, project_id=project.id, status=False)
     else:
@@ -76,17 +76,16 @@ def request_pull(repo, requestid, username=None):
     if not request:
         flask.abort(404, 'Pull-request not found')
 
-    project = request.repo_from
-
-    reponame = os.path.join(APP.config['FORK_FOLDER'], project.path)
-    if not request.status:
-        project = request.repo
-        reponame = os.path.join(APP.config['GIT_FOLDER'], project.path)
+    project = request.repo
+    reponame = os.path.join(APP.config['GIT_FOLDER'], project.path)
+    if request.status:
+        project = request.repo_from
+        reponame = os.path.join(APP.config['FORK_FOLDER'], project.path)
 
     if not os.path.exists(reponame):
         flask.abort(404, 'Project not found')
 
-    repo_obj = pygit2.Repository(reponame)
+    repo_obj = open_repo(reponame)
 
     if project.parent:
         parentname = os.path.join(
@@ -94,37 +93,21 @@ def request_pull(repo, requestid, username=None):
     else:
         parentname = os.path.join(
             APP.config['GIT_FOLDER'], project.path)
-    orig_repo = pygit2.Repository(parentname)
+    orig_repo = open_repo(parentname)
 
     diff_commits = []
-    diffs = []
     repo_commit = repo_obj[request.stop_id]
     if not repo_obj.is_empty and not orig_repo.is_empty:
-        orig_commit = orig_repo[
-            orig_repo.lookup_branch(request.branch).get_object().hex]
-
-        master_commits = [
-            commit.oid.hex
-            for commit in orig_repo.walk(
-                orig_repo.lookup_branch(request.branch).get_object().hex,
-                pygit2.GIT_SORT_TIME)
-        ]
-
-        repo_commit = repo_obj[request.stop_id]
-
-        for commit in repo_obj.walk(
-                request.stop_id, pygit2.GIT_SORT_TIME):
-            if request.status and commit.oid.hex in master_commits:
-                break
-            elif not request.status and commit.oid.hex == request.start_id:
-                break
-            diff_commits.append(commit)
-            diffs.append(
-                repo_obj.diff(
-                    repo_obj.revparse_single(commit.parents[0].oid.hex),
-                    repo_obj.revparse_single(commit.oid.hex)
-                )
-            )
+        if request.status:
+            ancestry = spechub.ancestry.get_branch_ancestry(
+                repo_obj, request.stop_id, orig_repo, request.branch,
+                graph=get_commit_graph(repo_obj))
+        else:
+            ancestry = spechub.ancestry.get_ancestry(
+                repo_obj, request.stop_id, orig_id=request.start_id,
+                graph=get_commit_graph(repo_obj))
+
+        diff_commits = ancestry.ahead
 
     elif orig_repo.is_empty:
         orig_commit = None
@@ -136,17 +119,17 @@ def request_pull(repo, requestid, username=None):
         return flask.redirect(flask.url_for(
             'view_repo', username=username, repo=repo.name))
 
-    html_diffs = []
-    for diff in diffs:
-        html_diffs.append(
-            highlight(
-                diff.patch,
-                DiffLexer(),
-                HtmlFormatter(
-                    noclasses=True,
-                    style="tango",)
-            )
-        )
+    # Only the first diffs are rendered, the others are loaded by the page
+    # when needed
+    html_diffs = [
+        spechub.highlight_utils.highlight_diff(
+            repo_obj, commit, cache=DIFF_CACHE)
+        for commit in diff_commits[:APP.config['PULL_REQUEST_DIFFS']]
+    ]
+
+    diff_username = None
+    if request.status:
+        diff_username = request.repo_from.user.user
 
     return flask.render_template(
         'pull_request.html',
@@ -159,12 +142,55 @@ def request_pull(repo, requestid, username=None):
         repo_obj=repo_obj,
         orig_repo=orig_repo,
         diff_commits=diff_commits,
-        diffs=diffs,
         html_diffs=html_diffs,
+        diff_username=diff_username,
+        comments=spechub.lib.get_pull_request_comments_index(
+            SESSION, request),
         forks=spechub.lib.get_forks(SESSION, request.repo),
     )
 
 
+@APP.route('/<repo>/diff/<commitid>')
+@APP.route('/fork/<username>/<repo>/diff/<commitid>')
+def view_commit_diff(repo, commitid, username=None):
+    """ Render the diff of a commit as an HTML fragment, used by the
+    pull-request pages to load the diffs of their commits on demand.
+    """
+    reponame = os.path.join(APP.config['GIT_FOLDER'], repo + '.git')
+    if username:
+        reponame = os.path.join(
+            APP.config['FORK_FOLDER'], username, repo + '.git')
+
+    if not os.path.exists(reponame):
+        flask.abort(404, 'Project not found')
+
+    repo_obj = open_repo(reponame)
+
+    try:
+        commit = repo_obj.get(commitid)
+    except ValueError:
+        commit = None
+    if not isinstance(commit, pygit2.Commit):
+        flask.abort(404, 'Commit not found')
+
+    comments = {}
+    requestid = flask.request.args.get('requestid', None)
+    if requestid:
+        request = spechub.lib.get_pull_request(
+            SESSION, project=repo, requestid=requestid)
+        if request:
+            comments = spechub.lib.get_pull_request_comments_index(
+                SESSION, request)
+
+    return flask.render_template(
+        'commit_diff.html',
+        commit=commit,
+        html_diff=spechub.highlight_utils.highlight_diff(
+            repo_obj, commit, cache=DIFF_CACHE),
+        comments=comments,
+    )
+
+
 @APP.route('/<repo>/request-pull/<requestid>/comment/<commit>/<row>',
            methods=('GET', 'POST'))
 @APP.route('/fork/<username>/<repo>/request-pull/<requestid>/comment/'
@@ -172,14 +198,14 @@ def request_pull(repo, requestid, username=None):
 def pull_request_add_comment(repo, requestid, commit, row, username=None):
     """ Add a comment to a commit in a pull-request.
     """
-    repo = spechub.lib.get_or_create_project(SESSION, repo, username)
+    repo = get_project(repo, username)
 
     if not repo:
         flask.abort(404, 'Project not found')
 
     request = spechub.lib.get_pull_request(
         SESSION, project=repo.name, requestid=requestid)
-    repo = request.repo_from
+    repo = request.repo_from or request.repo
 
     if not request:
         flask.abort(404, 'Pull-request not found')
@@ -231,11 +257,14 @@ def merge_request_pull(repo, requestid, username=None):
     """
     request = spechub.lib.get_pull_request(
         SESSION, project=repo, requestid=requestid)
-    repo = request.repo_from
 
     if not request:
         flask.abort(404, 'Pull-request not found')
 
+    repo = request.repo_from
+    if repo is None:
+        flask.abort(404, 'Project not found')
+
     reponame = os.path.join(APP.config['FORK_FOLDER'], repo.path)
 
     if not os.path.exists(reponame):
@@ -255,79 +284,35 @@ def merge_request_pull(repo, requestid, username=None):
             requestid=requestid,
             username=username)
 
-    # Get the fork
-    if request.repo_from.is_fork:
-        repopath = os.path.join(
-            APP.config['FORK_FOLDER'], request.repo_from.path)
-    else:
-        repopath = os.path.join(
-            APP.config['GIT_FOLDER'], request.repo_from.path)
-    fork_obj = pygit2.Repository(repopath)
-
-    # Get the original repo
-    parentpath = os.path.join(APP.config['GIT_FOLDER'], request.repo.path)
-    orig_repo = pygit2.Repository(parentpath)
-
-    # Clone the original repo into a temp folder
-    newpath = tempfile.mkdtemp()
-    new_repo = pygit2.clone_repository(parentpath, newpath)
-
-    repo_commit = fork_obj[request.stop_id]
-
-    ori_remote = new_repo.remotes[0]
-    # Add the fork as remote repo
-    reponame = '%s_%s' % (request.user.user, repo.name)
-    remote = new_repo.create_remote(reponame, repopath)
+    try:
+        job = spechub.jobs.submit(
+            SESSION, APP.config, 'merge',
+            lock_key=request.repo.name,
+            user=flask.g.fas_user.username,
+            url=flask.url_for('view_repo', repo=request.repo.name),
+            requestid=request.id)
+    except SQLAlchemyError, err:  # pragma: no cover
+        SESSION.rollback()
+        flask.flash(str(err), 'error')
+        return flask.redirect(error_output)
 
-    # Fetch the commits
-    remote.fetch()
+    return _job_redirect(job, error_output)
 
-    merge = new_repo.merge(repo_commit.oid)
-    master_ref = new_repo.lookup_reference('HEAD').resolve()
 
-    refname = '%s:%s' % (master_ref.name, master_ref.name)
-    if merge.is_uptodate:
-        flask.flash('Nothing to do, changes were already merged', 'error')
-        spechub.lib.close_pull_request(SESSION, request)
-        SESSION.commit()
-        return flask.redirect(error_output)
-    elif merge.is_fastforward:
-        master_ref.target = merge.fastforward_oid
-        ori_remote.push(refname)
-        flask.flash('Changes merged!')
-    else:
-        new_repo.index.write()
-        try:
-            tree = new_repo.index.write_tree()
-        except pygit2.GitError:
-            shutil.rmtree(newpath)
-            flask.flash('Merge conflicts!', 'error')
-            return flask.redirect(flask.url_for(
-                'request_pull',
-                repo=repo.name,
-                username=username,
-                requestid=requestid))
-        head = new_repo.lookup_reference('HEAD').get_object()
-        commit = new_repo[head.oid]
-        sha = new_repo.create_commit(
-            'refs/heads/master',
-            repo_commit.author,
-            repo_commit.committer,
-            'Merge #%s `%s`' % (request.id, request.title),
-            tree,
-            [head.hex, repo_commit.oid.hex])
-        ori_remote.push(refname)
-        flask.flash('Changes merged!')
-
-    # Update status
-    spechub.lib.close_pull_request(SESSION, request)
-    SESSION.commit()
-    shutil.rmtree(newpath)
-
-    return flask.redirect(flask.url_for('view_repo', repo=repo.name))
+## Specific actions
 
 
-## Specific actions
+def _job_redirect(job, error_url):
+    """ Redirect to the outcome of the specified job if it is over or to
+    the page presenting its progress otherwise.
+    """
+    if job.status == 'done':
+        flask.flash(job.message)
+        return flask.redirect(job.url)
+    elif job.status == 'failed':
+        flask.flash(job.message, 'error')
+        return flask.redirect(error_url)
+    return flask.redirect(flask.url_for('view_job', jobid=job.id))
 
 
 @APP.route('/do_fork/<repo>')
@@ -343,25 +328,24 @@ def fork_project(repo, username=None):
     if not os.path.exists(reponame):
         flask.abort(404, 'Project not found')
 
-    repo_obj = pygit2.Repository(reponame)
+    user = flask.g.fas_user.username
+    lock_key = 'fork:%s/%s' % (user, repo)
 
     try:
-        message = spechub.lib.fork_project(
-            session=SESSION,
-            repo=repo,
-            gitfolder=APP.config['GIT_FOLDER'],
-            forkfolder=APP.config['FORK_FOLDER'],
-            username=flask.g.fas_user.username)
-
-        SESSION.commit()
-        #generate_gitolite_acls()
-        flask.flash(message)
-        return flask.redirect(
-            flask.url_for(
-                'view_repo',
-                username=flask.g.fas_user.username,
+        # Do not queue the same fork twice
+        job = spechub.jobs.get_pending_job(
+            SESSION, 'fork', lock_key,
+            APP.config.get('JOB_STALE_TIMEOUT', spechub.jobs.STALE_TIMEOUT))
+        if job is None:
+            job = spechub.jobs.submit(
+                SESSION, APP.config, 'fork',
+                lock_key=lock_key,
+                user=user,
+                url=flask.url_for('view_repo', username=user, repo=repo),
+                username=user,
                 repo=repo)
-        )
+        return _job_redirect(
+            job, flask.url_for('view_repo', repo=repo))
     except spechub.exceptions.SpecHubException, err:
         flask.flash(str(err), 'error')
     except SQLAlchemyError, err:  # pragma: no cover
@@ -388,8 +372,8 @@ def new_request_pull(repo, username, commitid=None):
     if not os.path.exists(parentname):
         flask.abort(404, 'Fork not found')
 
-    repo_obj = pygit2.Repository(reponame)
-    orig_repo = pygit2.Repository(parentname)
+    repo_obj = open_repo(reponame)
+    orig_repo = open_repo(parentname)
 
     branchname = flask.request.args.get('branch', 'master')
     branch = orig_repo.lookup_branch(branchname)
@@ -404,31 +388,17 @@ def new_request_pull(repo, username, commitid=None):
             commitid = branch.get_object().hex
 
     diff_commits = []
-    diffs = []
     if not repo_obj.is_empty and not orig_repo.is_empty:
         orig_commit = orig_repo[
             orig_repo.lookup_branch(branchname).get_object().hex]
 
-        master_commits = [
-            commit.oid.hex
-            for commit in orig_repo.walk(
-                orig_repo.lookup_branch(branchname).get_object().hex,
-                pygit2.GIT_SORT_TIME)
-        ]
-
         repo_commit = repo_obj[commitid]
 
-        for commit in repo_obj.walk(
-                repo_commit.oid.hex, pygit2.GIT_SORT_TIME):
-            if commit.oid.hex in master_commits:
-                break
-            diff_commits.append(commit)
-            diffs.append(
-                repo_obj.diff(
-                    repo_obj.revparse_single(commit.parents[0].oid.hex),
-                    repo_obj.revparse_single(commit.oid.hex)
-                )
-            )
+        ancestry = spechub.ancestry.get_ancestry(
+            repo_obj, repo_commit.oid, orig_repo, orig_commit.oid,
+            graph=get_commit_graph(repo_obj))
+
+        diff_commits = ancestry.ahead
 
     elif orig_repo.is_empty:
         orig_commit = None
@@ -441,17 +411,13 @@ def new_request_pull(repo, username, commitid=None):
         return flask.redirect(flask.url_for(
             'view_repo', username=username, repo=repo.name))
 
-    html_diffs = []
-    for diff in diffs:
-        html_diffs.append(
-            highlight(
-                diff.patch,
-                DiffLexer(),
-                HtmlFormatter(
-                    noclasses=True,
-                    style="tango",)
-            )
-        )
+    # Only the first diffs are rendered, the others are loaded by the page
+    # when needed
+    html_diffs = [
+        spechub.highlight_utils.highlight_diff(
+            repo_obj, commit, cache=DIFF_CACHE)
+        for commit in diff_commits[:APP.config['PULL_REQUEST_DIFFS']]
+    ]
 
     form = spechub.ui.forms.RequestPullForm()
     if form.validate_on_submit():
@@ -491,8 +457,8 @@ def new_request_pull(repo, username, commitid=None):
         repo_obj=repo_obj,
         orig_repo=orig_repo,
         diff_commits=diff_commits,
-        diffs=diffs,
         html_diffs=html_diffs,
+        diff_username=username,
         form=form,
         branches=[
             branch.replace('refs/heads/', '')
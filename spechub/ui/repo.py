@@ -15,16 +15,45 @@ from math import ceil
 
 import pygit2
 from sqlalchemy.exc import SQLAlchemyError
-from pygments import highlight
-from pygments.lexers import guess_lexer
-from pygments.lexers.text import DiffLexer
-from pygments.formatters import HtmlFormatter
 
+import spechub.ancestry
+import spechub.blobs
+import spechub.commit_graph
 import spechub.exceptions
+import spechub.highlight_utils
 import spechub.lib
 import spechub.ui.forms
-from spechub import (APP, SESSION, LOG, __get_file_in_tree, cla_required,
-                    is_repo_admin)
+from spechub import (APP, SESSION, LOG, DIFF_CACHE, DOC_CACHE,
+                    HIGHLIGHT_CACHE, __get_file_in_tree, cla_required,
+                    get_commit_graph, get_project, immutable_by_oid,
+                    is_repo_admin, open_repo)
+
+
+def _get_commit(repo_obj, identifier):
+    """ Return the commit the identifier, a branch name or a commit id,
+    points to and the name under which it is presented.
+    """
+    if identifier in repo_obj.listall_branches():
+        branch = repo_obj.lookup_branch(identifier)
+        return branch.get_object(), identifier
+
+    try:
+        commit = repo_obj.get(identifier)
+        branchname = identifier
+    except ValueError:
+        # If it's not a commit id then it's part of the filename
+        commit = repo_obj[repo_obj.head.target]
+        branchname = 'master'
+    return commit, branchname
+
+
+def _get_forks(project):
+    """ Return the forks of the project shown in the navigation of its
+    pages, none for the immutable pages which leave them out.
+    """
+    if getattr(flask.g, 'immutable', False):
+        return []
+    return spechub.lib.get_forks(SESSION, project)
 
 
 @APP.route('/<repo>')
@@ -41,8 +70,8 @@ def view_repo(repo, username=None):
     if not os.path.exists(reponame):
         flask.abort(404, 'Project not found')
 
-    project = spechub.lib.get_or_create_project(SESSION, repo, username)
-    repo_obj = pygit2.Repository(reponame)
+    project = get_project(repo, username)
+    repo_obj = open_repo(reponame)
 
     cnt = 0
     last_commits = []
@@ -61,7 +90,8 @@ def view_repo(repo, username=None):
         name, ext = os.path.splitext(i.name)
         if name == 'README':
             content = repo_obj[i.oid].data
-            readme = spechub.doc_utils.convert_readme(content, ext)
+            readme = spechub.doc_utils.convert_readme(
+                content, ext, cache=DOC_CACHE, oid=i.hex)
 
     diff_commits = []
     if username:
@@ -76,27 +106,13 @@ def view_repo(repo, username=None):
     else:
         parentname = os.path.join(APP.config['GIT_FOLDER'], repo + '.git')
 
-    orig_repo = pygit2.Repository(parentname)
+    orig_repo = open_repo(parentname)
 
     if not repo_obj.is_empty and not orig_repo.is_empty:
-        orig_commit = orig_repo[
-            orig_repo.lookup_branch('master').get_object().hex]
-
-        master_commits = [
-            commit.oid.hex
-            for commit in orig_repo.walk(
-                orig_repo.lookup_branch('master').get_object().hex,
-                pygit2.GIT_SORT_TIME)
-        ]
-
-        repo_commit = repo_obj[
-            repo_obj.lookup_branch('master').get_object().hex]
-
-        for commit in repo_obj.walk(
-                repo_commit.oid.hex, pygit2.GIT_SORT_TIME):
-            if commit.oid.hex in master_commits:
-                break
-            diff_commits.append(commit.oid.hex)
+        ancestry = spechub.ancestry.get_branch_ancestry(
+            repo_obj, repo_obj.lookup_branch('master').get_object().oid,
+            orig_repo, graph=get_commit_graph(repo_obj))
+        diff_commits = [commit.oid.hex for commit in ancestry.ahead]
 
     return flask.render_template(
         'repo_info.html',
@@ -126,8 +142,8 @@ def view_repo_branch(repo, branchname, username=None):
     if not os.path.exists(reponame):
         flask.abort(404, 'Project not found')
 
-    project = spechub.lib.get_or_create_project(SESSION, repo, username)
-    repo_obj = pygit2.Repository(reponame)
+    project = get_project(repo, username)
+    repo_obj = open_repo(reponame)
 
     if branchname not in repo_obj.listall_branches():
         flask.abort(404, 'Branch no found')
@@ -156,26 +172,13 @@ def view_repo_branch(repo, branchname, username=None):
         parentname = parentname = os.path.join(
             APP.config['GIT_FOLDER'], repo + '.git')
 
-    orig_repo = pygit2.Repository(parentname)
+    orig_repo = open_repo(parentname)
 
     if not repo_obj.is_empty and not orig_repo.is_empty:
-        orig_commit = orig_repo[
-            orig_repo.lookup_branch('master').get_object().hex]
-
-        master_commits = [
-            commit.oid.hex
-            for commit in orig_repo.walk(
-                orig_repo.lookup_branch('master').get_object().hex,
-                pygit2.GIT_SORT_TIME)
-        ]
-
-        repo_commit = repo_obj[branch.get_object().hex]
-
-        for commit in repo_obj.walk(
-                repo_commit.oid.hex, pygit2.GIT_SORT_TIME):
-            if commit.oid.hex in master_commits:
-                break
-            diff_commits.append(commit.oid.hex)
+        ancestry = spechub.ancestry.get_branch_ancestry(
+            repo_obj, branch.get_object().oid, orig_repo,
+            graph=get_commit_graph(repo_obj))
+        diff_commits = [commit.oid.hex for commit in ancestry.ahead]
 
     return flask.render_template(
         'repo_info.html',
@@ -207,8 +210,8 @@ def view_log(repo, branchname='master', username=None):
     if not os.path.exists(reponame):
         flask.abort(404, 'Project not found')
 
-    project = spechub.lib.get_or_create_project(SESSION, repo, username)
-    repo_obj = pygit2.Repository(reponame)
+    project = get_project(repo, username)
+    repo_obj = open_repo(reponame)
 
     if branchname and branchname not in repo_obj.listall_branches():
         flask.abort(404, 'Branch no found')
@@ -220,19 +223,20 @@ def view_log(repo, branchname='master', username=None):
         page = int(flask.request.args.get('page', 1))
     except ValueError:
         page = 1
+    page = max(page, 1)
+    after = flask.request.args.get('after', None)
 
     limit = APP.config['ITEM_PER_PAGE']
     start = limit * (page - 1)
-    end = limit * page
 
     n_commits = 0
     last_commits = []
     if branch:
-        for commit in repo_obj.walk(
-                branch.get_object().hex, pygit2.GIT_SORT_TIME):
-            if n_commits >= start and n_commits <= end:
-                last_commits.append(commit)
-            n_commits += 1
+        graph = get_commit_graph(repo_obj)
+        tip = branch.get_object().oid
+        n_commits = spechub.commit_graph.count_commits(repo_obj, tip, graph)
+        last_commits = spechub.commit_graph.get_log_page(
+            repo_obj, tip, limit, start=start, after=after, graph=graph)
 
     total_page = int(ceil(n_commits / float(limit)))
 
@@ -249,26 +253,13 @@ def view_log(repo, branchname='master', username=None):
     else:
         parentname = os.path.join(APP.config['GIT_FOLDER'], repo + '.git')
 
-    orig_repo = pygit2.Repository(parentname)
+    orig_repo = open_repo(parentname)
 
     if not repo_obj.is_empty and not orig_repo.is_empty:
-        orig_commit = orig_repo[
-            orig_repo.lookup_branch('master').get_object().hex]
-
-        master_commits = [
-            commit.oid.hex
-            for commit in orig_repo.walk(
-                orig_repo.lookup_branch('master').get_object().hex,
-                pygit2.GIT_SORT_TIME)
-        ]
-
-        repo_commit = repo_obj[branch.get_object().hex]
-
-        for commit in repo_obj.walk(
-                repo_commit.oid.hex, pygit2.GIT_SORT_TIME):
-            if commit.oid.hex in master_commits:
-                break
-            diff_commits.append(commit.oid.hex)
+        ancestry = spechub.ancestry.get_branch_ancestry(
+            repo_obj, branch.get_object().oid, orig_repo,
+            graph=get_commit_graph(repo_obj))
+        diff_commits = [commit.oid.hex for commit in ancestry.ahead]
 
     origin = 'view_log'
 
@@ -294,6 +285,7 @@ def view_log(repo, branchname='master', username=None):
 @APP.route('/<repo>/blob/<identifier>/<path:filename>')
 @APP.route('/fork/<username>/<repo>/blob/<identifier>/<path:filename>')
 @APP.route('/fork/<username>/<repo>/blob/<identifier>/<path:filename>')
+@immutable_by_oid('identifier')
 def view_file(repo, identifier, filename, username=None):
     """ Displays the content of a file or a tree for the specified repo.
     """
@@ -305,36 +297,29 @@ def view_file(repo, identifier, filename, username=None):
     if not os.path.exists(reponame):
         flask.abort(404, 'Project not found')
 
-    project = spechub.lib.get_or_create_project(SESSION, repo, username)
-    repo_obj = pygit2.Repository(reponame)
-
-    if identifier in repo_obj.listall_branches():
-        branchname = identifier
-        branch = repo_obj.lookup_branch(identifier)
-        commit = branch.get_object()
-    else:
-        try:
-            commit = repo_obj.get(identifier)
-            branchname = identifier
-        except ValueError:
-            # If it's not a commit id then it's part of the filename
-            commit = repo_obj[repo_obj.head.target]
-            branchname = 'master'
+    project = get_project(repo, username)
+    repo_obj = open_repo(reponame)
+    commit, branchname = _get_commit(repo_obj, identifier)
 
     content = __get_file_in_tree(repo_obj, commit.tree, filename.split('/'))
     if not content:
         flask.abort(404, 'File not found')
 
     content = repo_obj[content.oid]
+    size = None
+    truncated = False
     if isinstance(content, pygit2.Blob):
-        content = highlight(
-            content.data,
-            guess_lexer(content.data),
-            HtmlFormatter(
-                noclasses=True,
-                style="tango",)
-        )
-        output_type = 'file'
+        size = content.size
+        if content.is_binary:
+            content = None
+            output_type = 'binary'
+        else:
+            truncated = size > APP.config['MAX_HIGHLIGHT_SIZE']
+            content = spechub.highlight_utils.highlight_blob(
+                content, cache=HIGHLIGHT_CACHE, filename=filename,
+                size=APP.config['PREVIEW_SIZE'] if truncated else None,
+                repo_path=repo_obj.path)
+            output_type = 'file'
     else:
         content = sorted(content, key=lambda x: x.filemode)
         output_type = 'tree'
@@ -348,12 +333,63 @@ def view_file(repo, identifier, filename, username=None):
         filename=filename,
         content=content,
         output_type=output_type,
-        forks=spechub.lib.get_forks(SESSION, project),
+        size=size,
+        truncated=truncated,
+        forks=_get_forks(project),
     )
 
 
+@APP.route('/<repo>/raw/<identifier>/<path:filename>')
+@APP.route('/fork/<username>/<repo>/raw/<identifier>/<path:filename>')
+@immutable_by_oid('identifier')
+def view_raw_file(repo, identifier, filename, username=None):
+    """ Send the raw content of a file of the specified repo.
+    """
+    reponame = os.path.join(APP.config['GIT_FOLDER'], repo + '.git')
+    if username:
+        reponame = os.path.join(
+            APP.config['FORK_FOLDER'], username, repo + '.git')
+
+    if not os.path.exists(reponame):
+        flask.abort(404, 'Project not found')
+
+    if get_project(repo, username) is None:
+        flask.abort(404, 'Project not found')
+
+    repo_obj = open_repo(reponame)
+    commit = _get_commit(repo_obj, identifier)[0]
+
+    content = __get_file_in_tree(repo_obj, commit.tree, filename.split('/'))
+    if not content:
+        flask.abort(404, 'File not found')
+
+    blob = repo_obj[content.oid]
+    if not isinstance(blob, pygit2.Blob):
+        flask.abort(404, 'File not found')
+
+    mimetype = 'text/plain'
+    if blob.is_binary:
+        mimetype = 'application/octet-stream'
+
+    # Read by git cat-file while the response is sent, the repository
+    # itself going back to the pool at the end of the request
+    response = flask.Response(
+        spechub.blobs.iter_blob(
+            repo_obj.path, blob.oid.hex, APP.config['RAW_CHUNK_SIZE']),
+        mimetype=mimetype)
+    response.headers['Content-Length'] = str(blob.size)
+    # The content comes from the users, it must not be run as HTML
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    if blob.is_binary:
+        response.headers.set(
+            'Content-Disposition', 'attachment',
+            filename=os.path.basename(filename))
+    return response
+
+
 @APP.route('/<repo>/<commitid>')
 @APP.route('/fork/<username>/<repo>/<commitid>')
+@immutable_by_oid('commitid')
 def view_commit(repo, commitid, username=None):
     """ Render a commit in a repo
     """
@@ -365,30 +401,16 @@ def view_commit(repo, commitid, username=None):
     if not os.path.exists(reponame):
         flask.abort(404, 'Project not found')
 
-    project = spechub.lib.get_or_create_project(SESSION, repo, username)
-    repo_obj = pygit2.Repository(reponame)
+    project = get_project(repo, username)
+    repo_obj = open_repo(reponame)
 
     try:
         commit = repo_obj.get(commitid)
     except ValueError:
         flask.abort(404, 'Commit not found')
 
-    if commit.parents:
-        diff = commit.tree.diff_to_tree()
-
-        parent = repo_obj.revparse_single('%s^' % commitid)
-        diff = repo_obj.diff(parent, commit)
-    else:
-        # First commit in the repo
-        diff = commit.tree.diff_to_tree(swap=True)
-
-    html_diff = highlight(
-        diff.patch,
-        DiffLexer(),
-        HtmlFormatter(
-            noclasses=True,
-            style="tango",)
-    )
+    html_diff = spechub.highlight_utils.highlight_diff(
+        repo_obj, commit, cache=DIFF_CACHE)
 
     return flask.render_template(
         'commit.html',
@@ -397,9 +419,8 @@ def view_commit(repo, commitid, username=None):
         username=username,
         commitid=commitid,
         commit=commit,
-        diff=diff,
         html_diff=html_diff,
-        forks=spechub.lib.get_forks(SESSION, project),
+        forks=_get_forks(project),
     )
 
 
@@ -407,6 +428,7 @@ def view_commit(repo, commitid, username=None):
 @APP.route('/<repo>/tree/<identifier>')
 @APP.route('/fork/<username>/<repo>/tree/')
 @APP.route('/fork/<username>/<repo>/tree/<identifier>')
+@immutable_by_oid('identifier')
 def view_tree(repo, identifier=None, username=None):
     """ Render the tree of the repo
     """
@@ -418,8 +440,8 @@ def view_tree(repo, identifier=None, username=None):
     if not os.path.exists(reponame):
         flask.abort(404, 'Project not found')
 
-    project = spechub.lib.get_or_create_project(SESSION, repo, username)
-    repo_obj = pygit2.Repository(reponame)
+    project = get_project(repo, username)
+    repo_obj = open_repo(reponame)
 
     branchname = None
     content = None
@@ -451,7 +473,7 @@ def view_tree(repo, identifier=None, username=None):
         filename='',
         content=content,
         output_type=output_type,
-        forks=spechub.lib.get_forks(SESSION, project),
+        forks=_get_forks(project),
     )
 
 
@@ -468,7 +490,7 @@ def view_forks(repo, username=None):
     if not repo:
         flask.abort(404, 'Project not found')
 
-    project = spechub.lib.get_or_create_project(SESSION, repo, username)
+    project = get_project(repo, username)
 
     return flask.render_template(
         'forks.html',
@@ -0,0 +1,102 @@
+#-*- coding: utf-8 -*-
+
+"""
+ (c) 2014 - Copyright Red Hat Inc
+
+ Authors:
+   Pierre-Yves Chibon <pingou@pingoured.fr>
+
+Common set up of the spechub tests.
+
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import pygit2
+
+# spechub is configured when it is imported, point it to a test database
+# before any test module imports it
+HERE = tempfile.mkdtemp(prefix='spechub-tests-')
+CONFIG = os.path.join(HERE, 'spechub.cfg')
+with open(CONFIG, 'w') as stream:
+    stream.write('\n'.join([
+        "DB_URL = 'sqlite:///%s'" % os.path.join(HERE, 'spechub.sqlite'),
+        "SECRET_KEY = 'tests'",
+        "TESTING = True",
+        "",
+    ]))
+os.environ['SPECHUB_CONFIG'] = CONFIG
+
+import spechub
+from spechub import model
+
+
+def add_commit(repo_obj, files, message='Commit'):
+    ''' Commit the provided files, a dict of name -> content, on top of
+    the master branch of the bare repository and return the commit oid.
+    '''
+    parents = []
+    if not repo_obj.is_empty:
+        parents = [repo_obj.lookup_branch('master').get_object().oid]
+    builder = repo_obj.TreeBuilder()
+    for name, content in sorted(files.items()):
+        builder.insert(
+            name, repo_obj.create_blob(content), pygit2.GIT_FILEMODE_BLOB)
+    signature = pygit2.Signature('Tester', 'tester@example.com')
+    return repo_obj.create_commit(
+        'refs/heads/master', signature, signature, message,
+        builder.write(), parents)
+
+
+class Modeltests(unittest.TestCase):
+    """ Tests running against a fresh database and empty git folders. """
+
+    def setUp(self):
+        """ Create the database and the git folders. """
+        self.path = tempfile.mkdtemp(prefix='spechub-test-', dir=HERE)
+        self.gitfolder = os.path.join(self.path, 'repos')
+        self.forkfolder = os.path.join(self.path, 'forks')
+        os.makedirs(self.gitfolder)
+        os.makedirs(self.forkfolder)
+        spechub.APP.config['GIT_FOLDER'] = self.gitfolder
+        spechub.APP.config['FORK_FOLDER'] = self.forkfolder
+
+        model.BASE.metadata.create_all(spechub.SESSION.bind)
+        model.create_default_status(spechub.SESSION)
+        self.session = spechub.SESSION
+        spechub.PROJECT_IDS.clear()
+        self.app = spechub.APP.test_client()
+
+    def tearDown(self):
+        """ Drop the database and the git folders. """
+        self.session.remove()
+        model.BASE.metadata.drop_all(spechub.SESSION.bind)
+        spechub.PROJECT_IDS.clear()
+        shutil.rmtree(self.path)
+
+    def login(self, username='tester', groups=None):
+        """ Log the specified user in the session of the test client. """
+        with self.app.session_transaction() as sess:
+            sess['FLASK_FAS_OPENID_USER'] = {
+                'username': username,
+                'fullname': username,
+                'email': '%s@example.com' % username,
+                'timezone': 'UTC',
+                'cla_done': True,
+                'groups': groups or [],
+            }
+
+    def create_repo(self, name, files):
+        """ Create a bare repository in the git folder, with a commit of
+        the provided files, and its project in the database.
+
+        :return: the oid of the commit.
+        """
+        repo_obj = pygit2.init_repository(
+            os.path.join(self.gitfolder, name + '.git'), bare=True)
+        oid = add_commit(repo_obj, files)
+        model.Project.get_or_create(self.session, name)
+        return oid
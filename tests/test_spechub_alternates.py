@@ -0,0 +1,64 @@
+#-*- coding: utf-8 -*-
+
+"""
+ (c) 2014 - Copyright Red Hat Inc
+
+ Authors:
+   Pierre-Yves Chibon <pingou@pingoured.fr>
+
+spechub.alternates tests.
+
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import pygit2
+
+from spechub import alternates
+from tests import add_commit
+
+
+class SpecHubAlternatestests(unittest.TestCase):
+    """ Tests the forks sharing the objects of their parent. """
+
+    def setUp(self):
+        """ Create a parent repository and a shared fork of it. """
+        self.path = tempfile.mkdtemp(prefix='spechub-test-')
+        self.parentpath = os.path.join(self.path, 'parent.git')
+        self.forkpath = os.path.join(self.path, 'fork.git')
+        parent = pygit2.init_repository(self.parentpath, bare=True)
+        self.oid = add_commit(parent, {'test.spec': 'Name: test\n'})
+        self.fork = alternates.create_shared_fork(
+            self.parentpath, self.forkpath)
+
+    def tearDown(self):
+        """ Remove the repositories. """
+        shutil.rmtree(self.path)
+
+    def test_create_shared_fork(self):
+        """ Test that the fork borrows the objects of its parent and that
+        git gc no longer prunes the parent. """
+        self.assertTrue(alternates.is_shared(self.forkpath))
+        self.assertEqual(
+            self.fork.lookup_branch('master').get_object().oid, self.oid)
+        parent = pygit2.Repository(self.parentpath)
+        self.assertEqual(parent.config['gc.pruneExpire'], 'never')
+
+    def test_detach_fork(self):
+        """ Test that a detached fork keeps its objects without its parent.
+        """
+        self.assertTrue(alternates.detach_fork(self.forkpath) > 0)
+        self.assertFalse(alternates.is_shared(self.forkpath))
+        shutil.rmtree(self.parentpath)
+        fork = pygit2.Repository(self.forkpath)
+        blob = fork[fork[self.oid].tree['test.spec'].oid]
+        self.assertEqual(blob.data, 'Name: test\n')
+
+
+if __name__ == '__main__':
+    SUITE = unittest.TestLoader().loadTestsFromTestCase(
+        SpecHubAlternatestests)
+    unittest.TextTestRunner(verbosity=2).run(SUITE)
@@ -0,0 +1,79 @@
+#-*- coding: utf-8 -*-
+
+"""
+ (c) 2014 - Copyright Red Hat Inc
+
+ Authors:
+   Pierre-Yves Chibon <pingou@pingoured.fr>
+
+spechub.cache tests.
+
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from spechub.cache import DiskCache
+
+
+class SpecHubCachetests(unittest.TestCase):
+    """ Tests the size limit of the DiskCache. """
+
+    def setUp(self):
+        """ Create the folder of the cache. """
+        self.folder = tempfile.mkdtemp(prefix='spechub-test-')
+
+    def tearDown(self):
+        """ Remove the folder of the cache. """
+        shutil.rmtree(self.folder)
+
+    def age(self, cache, key, seconds):
+        """ Make the entry ``key`` look used ``seconds`` ago. """
+        stamp = time.time() - seconds
+        os.utime(cache._path(key), (stamp, stamp))
+
+    def test_prune(self):
+        """ Test that the least recently used entries are removed once the
+        folder is larger than the limit. """
+        # Written without limit, not to prune before every entry is there
+        writer = DiskCache(self.folder)
+        for cnt in range(5):
+            writer.set(cnt, u'x' * 300)
+            self.age(writer, cnt, 100 - cnt)
+        cache = DiskCache(self.folder, max_size=1000)
+        # The first entry is read, it becomes the most recently used
+        self.assertEqual(cache.get(0), u'x' * 300)
+
+        self.assertEqual(cache.prune(), 2)
+        self.assertEqual(cache.get(0), u'x' * 300)
+        self.assertEqual(cache.get(1), None)
+        self.assertEqual(cache.get(2), None)
+        self.assertEqual(cache.get(3), u'x' * 300)
+        self.assertEqual(cache.get(4), u'x' * 300)
+        stats = cache.stats()
+        self.assertEqual(stats['size'], 900)
+        self.assertEqual(stats['evictions'], 2)
+
+    def test_set_prunes(self):
+        """ Test that writing entries keeps the folder under the limit. """
+        cache = DiskCache(self.folder, max_size=1000)
+        for cnt in range(20):
+            cache.set(cnt, u'x' * 100)
+        self.assertTrue(cache.stats()['size'] <= 1000)
+        self.assertEqual(cache.get(19), u'x' * 100)
+
+    def test_no_limit(self):
+        """ Test that nothing is removed without a limit. """
+        cache = DiskCache(self.folder)
+        for cnt in range(20):
+            cache.set(cnt, u'x' * 100)
+        self.assertEqual(cache.get(0), u'x' * 100)
+        self.assertEqual(cache.stats()['evictions'], 0)
+
+
+if __name__ == '__main__':
+    SUITE = unittest.TestLoader().loadTestsFromTestCase(SpecHubCachetests)
+    unittest.TextTestRunner(verbosity=2).run(SUITE)
@@ -0,0 +1,106 @@
+#-*- coding: utf-8 -*-
+
+"""
+ (c) 2014 - Copyright Red Hat Inc
+
+ Authors:
+   Pierre-Yves Chibon <pingou@pingoured.fr>
+
+spechub.commit_graph tests.
+
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import pygit2
+
+from spechub import commit_graph
+from tests import add_commit
+
+
+class SpecHubCommitGraphtests(unittest.TestCase):
+    """ Tests the commit-graph index and the refs stamp. """
+
+    def setUp(self):
+        """ Create a repository with a history of three commits. """
+        self.path = tempfile.mkdtemp(prefix='spechub-test-')
+        self.repo = pygit2.init_repository(
+            os.path.join(self.path, 'test.git'), bare=True)
+        self.oids = [
+            add_commit(self.repo, {'file': str(cnt)}, 'Commit %s' % cnt)
+            for cnt in range(3)
+        ]
+
+    def tearDown(self):
+        """ Remove the repository. """
+        shutil.rmtree(self.path)
+
+    def test_refs_stamp(self):
+        """ Test that the stamp changes when a ref is moved in place or
+        added in a nested namespace. """
+        stamp = commit_graph.refs_stamp(self.repo.path)
+        self.assertEqual(stamp, commit_graph.refs_stamp(self.repo.path))
+
+        # Same file, same size, possibly same mtime
+        self.repo.lookup_reference('refs/heads/master').target = self.oids[1]
+        moved = commit_graph.refs_stamp(self.repo.path)
+        self.assertNotEqual(stamp, moved)
+
+        self.repo.create_reference('refs/pull/1/head', self.oids[0])
+        self.assertNotEqual(moved, commit_graph.refs_stamp(self.repo.path))
+
+    def test_queries(self):
+        """ Test the queries of the CommitGraph. """
+        graph = commit_graph.get_commit_graph(self.repo)
+        self.assertEqual(len(graph), 3)
+        self.assertEqual(graph.count(self.oids[2]), 3)
+        self.assertEqual(graph.generation(self.oids[2]), 3)
+        self.assertEqual(graph.parents(self.oids[2]), [self.oids[1].hex])
+        self.assertEqual(
+            list(graph.walk(self.oids[2])),
+            [oid.hex for oid in reversed(self.oids)])
+        self.assertEqual(
+            graph.ahead(self.oids[2], [self.oids[0]]),
+            [self.oids[2].hex, self.oids[1].hex])
+        self.assertTrue(graph.is_ancestor(self.oids[0], self.oids[2]))
+        self.assertFalse(graph.is_ancestor(self.oids[2], self.oids[0]))
+
+        # A walk started before an update keeps its view of the index
+        history = graph.walk(self.oids[2])
+        self.assertEqual(next(history), self.oids[2].hex)
+        oid = add_commit(self.repo, {'file': '3'})
+        graph.update(self.repo)
+        self.assertEqual(len(graph), 4)
+        self.assertEqual(
+            list(history), [self.oids[1].hex, self.oids[0].hex])
+        self.assertEqual(graph.count(oid), 4)
+
+    def test_get_log_page_after(self):
+        """ Test that the pages asked with ``after`` start right after the
+        commit, with or without the CommitGraph. """
+        graph = commit_graph.get_commit_graph(self.repo)
+        for index in [graph, None]:
+            page = commit_graph.get_log_page(
+                self.repo, self.oids[2], 1, after=self.oids[2].hex,
+                graph=index)
+            self.assertEqual([commit.oid for commit in page], [self.oids[1]])
+
+            page = commit_graph.get_log_page(
+                self.repo, self.oids[2], 5, after=self.oids[0].hex,
+                graph=index)
+            self.assertEqual(page, [])
+
+            # Invalid commits are ignored
+            page = commit_graph.get_log_page(
+                self.repo, self.oids[2], 1, start=1, after='invalid',
+                graph=index)
+            self.assertEqual([commit.oid for commit in page], [self.oids[1]])
+
+
+if __name__ == '__main__':
+    SUITE = unittest.TestLoader().loadTestsFromTestCase(
+        SpecHubCommitGraphtests)
+    unittest.TextTestRunner(verbosity=2).run(SUITE)
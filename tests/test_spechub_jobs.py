@@ -0,0 +1,83 @@
+#-*- coding: utf-8 -*-
+
+"""
+ (c) 2014 - Copyright Red Hat Inc
+
+ Authors:
+   Pierre-Yves Chibon <pingou@pingoured.fr>
+
+spechub.jobs tests.
+
+"""
+
+import datetime
+import unittest
+
+import spechub
+import spechub.jobs
+from spechub import model
+from tests import Modeltests
+
+
+class SpecHubJobstests(Modeltests):
+    """ Tests the jobs and their views. """
+
+    def setUp(self):
+        """ Create a job requested by a user. """
+        super(SpecHubJobstests, self).setUp()
+        self.config = {
+            'FORK_FOLDER': self.forkfolder,
+            'JOB_LOCK_TIMEOUT': 0,
+        }
+        self.job = model.Job(
+            kind='reap_trash',
+            lock_key='trash',
+            user_id=model.User.get_or_create(self.session, 'owner').id,
+            status='running',
+            date_started=datetime.datetime.utcnow(),
+        )
+        self.session.add(self.job)
+        self.session.commit()
+
+    def test_submit_locked(self):
+        """ Test that a job run inline fails if a job with the same lock
+        key is still running. """
+        job = spechub.jobs.submit(
+            self.session, self.config, 'reap_trash', lock_key='trash')
+        self.assertEqual(job.status, 'failed')
+        self.assertIn('try again', job.message)
+
+        job = spechub.jobs.submit(
+            self.session, self.config, 'reap_trash', lock_key='other')
+        self.assertEqual(job.status, 'done')
+
+    def test_submit_stale(self):
+        """ Test that a stale running job does not block the lock key. """
+        self.job.date_started = datetime.datetime(2014, 1, 1)
+        self.session.add(self.job)
+        self.session.commit()
+        job = spechub.jobs.submit(
+            self.session, self.config, 'reap_trash', lock_key='trash')
+        self.assertEqual(job.status, 'done')
+
+    def test_view_job(self):
+        """ Test that only the owner of a job and the admins see it. """
+        for url in ('/job/%s' % self.job.id, '/job/%s/status' % self.job.id):
+            self.assertEqual(self.app.get(url).status_code, 404)
+
+            self.login('other')
+            self.assertEqual(self.app.get(url).status_code, 404)
+
+            self.login('owner')
+            self.assertEqual(self.app.get(url).status_code, 200)
+
+            self.login('admin', groups=[spechub.APP.config['ADMIN_GROUP']])
+            self.assertEqual(self.app.get(url).status_code, 200)
+
+            with self.app.session_transaction() as sess:
+                sess.clear()
+
+
+if __name__ == '__main__':
+    SUITE = unittest.TestLoader().loadTestsFromTestCase(SpecHubJobstests)
+    unittest.TextTestRunner(verbosity=2).run(SUITE)
@@ -0,0 +1,173 @@
+#-*- coding: utf-8 -*-
+
+"""
+ (c) 2014 - Copyright Red Hat Inc
+
+ Authors:
+   Pierre-Yves Chibon <pingou@pingoured.fr>
+
+spechub.lib tests.
+
+"""
+
+import shutil
+import tempfile
+import unittest
+
+import sqlalchemy as sa
+
+import spechub.lib
+from spechub import model
+
+
+class SpecHubLibtests(unittest.TestCase):
+    """ Tests the number of queries made by the listings of spechub.lib.
+    """
+
+    def setUp(self):
+        """ Set up an in-memory database counting its queries. """
+        self.session = model.create_tables('sqlite://')
+        self.queries = 0
+
+        def count(conn, cursor, statement, parameters, context, many):
+            ''' Count the statements run. '''
+            self.queries += 1
+        sa.event.listen(self.session.bind, 'before_cursor_execute', count)
+
+        self.parent = model.Project.get_or_create(self.session, 'test')
+        self.n_forks = 0
+
+    def tearDown(self):
+        """ Close the database. """
+        self.session.remove()
+
+    def add_forks(self, number):
+        """ Add forks of the test project, each with a pull-request having
+        a comment. """
+        for _ in range(number):
+            self.n_forks += 1
+            user = model.User.get_or_create(
+                self.session, 'user%s' % self.n_forks)
+            fork = model.Project.get_or_create(
+                self.session, 'test', user_id=user.id,
+                parent_id=self.parent.id)
+            request = model.PullRequest(
+                project_id=self.parent.id,
+                project_id_from=fork.id,
+                title='Request %s' % self.n_forks,
+                stop_id='%040x' % self.n_forks,
+                user_id=user.id,
+            )
+            self.session.add(request)
+            self.session.flush()
+            self.session.add(model.PullRequestComment(
+                pull_request_id=request.id,
+                commit_id=request.stop_id,
+                user_id=user.id,
+                comment='Comment',
+            ))
+        self.session.commit()
+        self.session.expire_all()
+
+    def count_queries(self, function):
+        """ Return the number of queries run by the provided function. """
+        self.session.expire_all()
+        self.queries = 0
+        function()
+        return self.queries
+
+    def list_pull_requests(self):
+        """ List the pull-requests as requests.html does. """
+        for request in spechub.lib.get_pull_requests(
+                self.session, project_id=self.parent.id):
+            (request.user.user, request.repo.fullname,
+             request.repo_from.fullname, request.comment_count)
+
+    def list_forks(self):
+        """ List the forks of the test project as forks.html does. """
+        for fork in spechub.lib.get_forks(self.session, self.parent):
+            fork.fullname
+
+    def list_all_forks(self):
+        """ List all the forks as gitolite.html does. """
+        for fork in spechub.lib.get_all_forks(self.session):
+            (fork.fullname, fork.path)
+
+    def test_get_pull_requests(self):
+        """ Test the number of queries of get_pull_requests. """
+        self.add_forks(2)
+        queries = self.count_queries(self.list_pull_requests)
+        self.add_forks(10)
+        self.assertEqual(
+            self.count_queries(self.list_pull_requests), queries)
+
+    def test_get_forks(self):
+        """ Test the number of queries of get_forks. """
+        self.add_forks(2)
+        queries = self.count_queries(self.list_forks)
+        self.add_forks(10)
+        self.assertEqual(self.count_queries(self.list_forks), queries)
+
+    def test_get_all_forks(self):
+        """ Test the number of queries of get_all_forks. """
+        self.add_forks(2)
+        queries = self.count_queries(self.list_all_forks)
+        self.add_forks(10)
+        self.assertEqual(self.count_queries(self.list_all_forks), queries)
+
+    def test_get_project_by_id(self):
+        """ Test that get_project_by_id loads the user of the project in
+        the same query. """
+        self.add_forks(1)
+        fork = spechub.lib.get_forks(self.session, self.parent)[0]
+        fork_id = fork.id
+        self.session.expunge_all()
+
+        def get_project():
+            """ Get the fork and its user as spechub.get_project does. """
+            project = spechub.lib.get_project_by_id(self.session, fork_id)
+            self.assertEqual(project.user.user, 'user1')
+
+        self.assertEqual(self.count_queries(get_project), 1)
+
+    def test_delete_forks(self):
+        """ Test that delete_forks keeps the pull-requests the forks made
+        to their parent and deletes the ones made to them. """
+        self.add_forks(2)
+        fork = [
+            fork for fork in spechub.lib.get_forks(self.session, self.parent)
+            if fork.user.user == 'user1'][0]
+        user_id = fork.user_id
+        self.session.add(model.PullRequest(
+            project_id=fork.id,
+            project_id_from=self.parent.id,
+            title='Request to the fork',
+            stop_id='%040x' % 100,
+            user_id=user_id,
+        ))
+        self.session.commit()
+
+        forkfolder = tempfile.mkdtemp()
+        try:
+            self.assertEqual(
+                spechub.lib.delete_forks(self.session, [fork], forkfolder),
+                1)
+        finally:
+            shutil.rmtree(forkfolder)
+
+        requests = spechub.lib.get_pull_requests(self.session)
+        self.assertEqual(
+            [request.title for request in requests],
+            ['Request 1', 'Request 2'])
+        self.assertEqual(requests[0].repo_from, None)
+        self.assertFalse(requests[0].status)
+        self.assertEqual(requests[0].comment_count, 1)
+        self.assertNotEqual(requests[1].repo_from, None)
+        self.assertEqual(
+            len(spechub.lib.get_forks(self.session, self.parent)), 1)
+
+
+if __name__ == '__main__':
+    SUITE = unittest.TestLoader().loadTestsFromTestCase(
+        SpecHubLibtests)
+    unittest.TextTestRunner(verbosity=2).run(SUITE)
@@ -0,0 +1,179 @@
+#-*- coding: utf-8 -*-
+
+"""
+ (c) 2014 - Copyright Red Hat Inc
+
+ Authors:
+   Pierre-Yves Chibon <pingou@pingoured.fr>
+
+spechub.ui.repo tests.
+
+"""
+
+import os
+import shutil
+import unittest
+
+import spechub
+from tests import Modeltests
+
+
+BINARY = '\x00\x01\x02\x03' * 1024
+LARGE = ''.join('line %s\n' % cnt for cnt in range(20000))
+
+
+class SpecHubUiRepotests(Modeltests):
+    """ Tests the views of the files of spechub.ui.repo. """
+
+    def setUp(self):
+        """ Create a repository holding a text, a large and a binary file.
+        """
+        super(SpecHubUiRepotests, self).setUp()
+        spechub.APP.config['MAX_HIGHLIGHT_SIZE'] = 64 * 1024
+        spechub.APP.config['PREVIEW_SIZE'] = 1024
+        spechub.APP.config['RAW_CHUNK_SIZE'] = 4096
+        self.oid = self.create_repo('test', {
+            'test.spec': 'Name: test\n',
+            'large.txt': LARGE,
+            'data.bin': BINARY,
+        })
+
+    def test_view_file(self):
+        """ Test view_file with a small text file. """
+        output = self.app.get('/test/blob/master/test.spec')
+        self.assertEqual(output.status_code, 200)
+        self.assertIn('Name', output.data)
+        self.assertIn('>Raw</a>', output.data)
+        self.assertNotIn('only its beginning is shown', output.data)
+
+    def test_view_file_truncated(self):
+        """ Test view_file with a file larger than MAX_HIGHLIGHT_SIZE. """
+        output = self.app.get('/test/blob/master/large.txt')
+        self.assertEqual(output.status_code, 200)
+        self.assertIn('only its beginning is shown', output.data)
+        self.assertIn('line 10', output.data)
+        self.assertNotIn('line 19999', output.data)
+
+    def test_view_file_binary(self):
+        """ Test view_file with a binary file. """
+        output = self.app.get('/test/blob/master/data.bin')
+        self.assertEqual(output.status_code, 200)
+        self.assertIn('Binary file', output.data)
+        self.assertIn('download it', output.data)
+
+    def test_view_raw_file(self):
+        """ Test view_raw_file with a text file. """
+        output = self.app.get('/test/raw/master/large.txt')
+        self.assertEqual(output.status_code, 200)
+        self.assertEqual(output.data, LARGE)
+        self.assertEqual(output.mimetype, 'text/plain')
+        self.assertEqual(output.headers['Content-Length'], str(len(LARGE)))
+        self.assertEqual(
+            output.headers['X-Content-Type-Options'], 'nosniff')
+        self.assertNotIn('Content-Disposition', output.headers)
+
+    def test_view_raw_file_binary(self):
+        """ Test view_raw_file with a binary file. """
+        output = self.app.get('/test/raw/master/data.bin')
+        self.assertEqual(output.status_code, 200)
+        self.assertEqual(output.data, BINARY)
+        self.assertEqual(output.mimetype, 'application/octet-stream')
+        self.assertEqual(
+            output.headers['X-Content-Type-Options'], 'nosniff')
+        self.assertEqual(
+            output.headers['Content-Disposition'],
+            'attachment; filename=data.bin')
+
+    def test_view_raw_file_not_found(self):
+        """ Test view_raw_file with unknown files and projects. """
+        output = self.app.get('/test/raw/master/unknown.txt')
+        self.assertEqual(output.status_code, 404)
+        output = self.app.get('/unknown/raw/master/test.spec')
+        self.assertEqual(output.status_code, 404)
+
+    def test_immutable(self):
+        """ Test the caching headers of the pages addressed by a commit id.
+        """
+        output = self.app.get('/test/%s' % self.oid.hex)
+        self.assertEqual(output.status_code, 200)
+        etag = output.headers['ETag']
+        self.assertTrue(etag.startswith('"%s-' % self.oid.hex))
+        self.assertEqual(
+            output.headers['Cache-Control'],
+            'public, max-age=3600, immutable')
+        self.assertIn('Cookie', output.headers['Vary'])
+
+        # The page of a branch can change
+        output = self.app.get('/test/blob/master/test.spec')
+        self.assertEqual(output.status_code, 200)
+        self.assertNotIn('ETag', output.headers)
+        self.assertNotIn('immutable', output.headers.get('Cache-Control', ''))
+
+    def test_immutable_not_modified(self):
+        """ Test that a matching If-None-Match gets a 304 without the view
+        being run. """
+        url = '/test/blob/%s/test.spec' % self.oid.hex
+        etag = self.app.get(url).headers['ETag']
+
+        # The view would answer 404 without the repository
+        shutil.rmtree(os.path.join(self.gitfolder, 'test.git'))
+        output = self.app.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(output.status_code, 304)
+        self.assertEqual(output.headers['ETag'], etag)
+        self.assertEqual(output.data, '')
+
+        output = self.app.get(url, headers={'If-None-Match': '"other"'})
+        self.assertEqual(output.status_code, 404)
+
+    def test_immutable_private(self):
+        """ Test that the pages of the logged in users are private and have
+        their own ETag. """
+        url = '/test/tree/%s' % self.oid.hex
+        anonymous = self.app.get(url)
+        self.login()
+        output = self.app.get(url)
+        self.assertEqual(output.status_code, 200)
+        self.assertEqual(
+            output.headers['Cache-Control'],
+            'private, max-age=3600, immutable')
+        self.assertNotEqual(
+            output.headers['ETag'], anonymous.headers['ETag'])
+
+        output = self.app.get(
+            url, headers={'If-None-Match': anonymous.headers['ETag']})
+        self.assertEqual(output.status_code, 200)
+
+    def test_immutable_flashes(self):
+        """ Test that the pages showing flashed messages are not cached. """
+        url = '/test/%s' % self.oid.hex
+        etag = self.app.get(url).headers['ETag']
+        with self.app.session_transaction() as sess:
+            sess['_flashes'] = [('message', 'Flashed message')]
+
+        output = self.app.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(output.status_code, 200)
+        self.assertIn('Flashed message', output.data)
+        self.assertNotIn('ETag', output.headers)
+        self.assertNotIn('immutable', output.headers.get('Cache-Control', ''))
+
+    def test_server_timing(self):
+        """ Test that the Server-Timing header is only sent to the admins,
+        unless SERVER_TIMING is set. """
+        output = self.app.get('/test/blob/master/test.spec')
+        self.assertNotIn('Server-Timing', output.headers)
+
+        spechub.APP.config['SERVER_TIMING'] = True
+        try:
+            output = self.app.get('/test/blob/master/test.spec')
+        finally:
+            spechub.APP.config['SERVER_TIMING'] = False
+        self.assertIn('total;dur=', output.headers['Server-Timing'])
+
+        self.login(groups=[spechub.APP.config['ADMIN_GROUP']])
+        output = self.app.get('/test/blob/master/test.spec')
+        self.assertIn('total;dur=', output.headers['Server-Timing'])
+
+
+if __name__ == '__main__':
+    SUITE = unittest.TestLoader().loadTestsFromTestCase(SpecHubUiRepotests)
+    unittest.TextTestRunner(verbosity=2).run(SUITE)
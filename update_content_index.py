@@ -0,0 +1,13 @@
+#!/usr/bin/env python2
+
+## These two lines are needed to run on EL6
+__requires__ = ['SQLAlchemy >= 0.8', 'jinja2 >= 2.4']
+import pkg_resources
+
+from spechub import APP, CONTENT_INDEX
+
+if CONTENT_INDEX is None:
+    raise SystemExit('CONTENT_INDEX_PATH is not set in the configuration')
+
+updated = CONTENT_INDEX.refresh(APP.config['GIT_FOLDER'])
+print '%s branches re-indexed' % updated